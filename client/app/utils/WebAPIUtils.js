@@ -130,9 +130,13 @@ export function getFrames(experiment) {
     }
   }
 
-  const segmentationCallback = i => {
+  const segmentationCallback = frames => {
     return data => {
-      ServerActionCreators.receiveSegmentationFrame(i, data);
+      data.forEach(d => {
+        if (frames.includes(d.frame)) {
+          ServerActionCreators.receiveSegmentationFrame(d.frame, d.data);
+        }
+      });
     }
   }
 
@@ -146,13 +150,15 @@ export function getFrames(experiment) {
     }
   }
   
+  const segmentationFrames = [];
+
   for (let frame = experiment.start; frame <= experiment.stop; frame++) {
     if (!experiment.images.find(d => d.frame === frame)) {
       const imageURL = "/display-image/" + experiment.id + "/" + imageType + "/" + frame;
 
-      // Load image
+      // Load image with GET so that the browser cache can answer the image element request
       $.ajax({
-        type: "POST",
+        type: "GET",
         url: imageURL,
         success: imageCallback(frame, imageURL),
         error: errorCallback
@@ -160,17 +166,22 @@ export function getFrames(experiment) {
     }
 
     if (!experiment.segmentationData.find(d => d.frame === frame)) {
-      // Load segmentation frame
-      if (experiment.has_segmentation) {
-        $.ajax({
-          type: "POST",
-          url: "/get_frame_seg_data/" + experiment.id + "/" + frame,
-          success: segmentationCallback(frame),
-          error: errorCallback
-        });
-      }
+      segmentationFrames.push(frame);
     }
   }
+
+  if (experiment.has_segmentation && segmentationFrames.length > 0) {
+    // Load all missing segmentation frames in one request
+    const start = segmentationFrames[0];
+    const stop = segmentationFrames[segmentationFrames.length - 1];
+
+    $.ajax({
+      type: "POST",
+      url: "/get_frames_seg_data/" + experiment.id + "/" + start + "/" + stop,
+      success: segmentationCallback(segmentationFrames),
+      error: errorCallback
+    });
+  }
 }
 
 function pollUpdatedTracking(taskId) {
@@ -230,6 +241,29 @@ function getAllUserInfo() {
   });
 }
 
+function pollPendingScores() {
+  $.ajax({
+    dataType: "json",
+    cache: false,
+    type: "POST",
+    url: "/get_user_info/",
+    success: data => {
+      if (data.pending_scores > 0) {
+        // Edited regions are still being scored on the server
+        setTimeout(pollPendingScores, 2000);
+      }
+      else {
+        ServerActionCreators.receiveScore(+data.total_score, Date.now());
+
+        getAllUserInfo();
+      }
+    },
+    error: (xhr, textStatus, errorThrown) => {
+      console.log(textStatus + ": " + errorThrown);
+    }
+  });
+}
+
 export function saveSegmentationData(id, data) {
   setupAjax();
 
@@ -281,6 +315,12 @@ export function saveSegmentationData(id, data) {
           pollUpdatedTracking(data.task_id);
         }
         */
+        if (data.pending_scores > 0) {
+          // Scores of edited regions are added asynchronously
+          pollPendingScores();
+          return;
+        }
+
         const totalScore = +data.total_score;
 
         if (!isNaN(totalScore)) {
@@ -1,6 +1,8 @@
 import os
+import logging
 
 from celery import Celery
+from celery.signals import worker_process_init
 from django.conf import settings
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'celltracker.settings')
@@ -14,3 +16,15 @@ app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
 @app.task(bind=True)
 def debug_task(self):
     print('Request: {0!r}'.format(self.request))
+
+
+@worker_process_init.connect
+def preload_score_model(**kwargs):
+    # load the scoring model when a worker process starts if edited regions are scored in tasks
+    if settings.SCORE_ASYNC and settings.SCORE_MODEL_PRELOAD:
+        from scoring_module import get_score_model
+        try:
+            get_score_model()
+        except Exception as ex:
+            # the model is loaded again on first use
+            logging.getLogger(__name__).error('Failed to preload scoring model: ' + str(ex))
@@ -185,12 +185,80 @@ MAX_PRIORITY_STRING_LEN = 10
 # settings for scoring
 SCORE_MODEL_PATH = os.path.join(BASE_DIR, 'models', 'scoreNet_t3_180_unfreeze.pkl')
 SCORE_IMAGE_DIMENSION = (180, 180)
+# load the scoring model when a web worker starts rather than on its first scoring request
+SCORE_MODEL_PRELOAD = True
+# score newly edited regions in a celery task rather than in the save request so that save
+# latency does not depend on scoring model inference time. Scores are added to the user score
+# once the task has run, and the client polls for the updated score
+SCORE_ASYNC = False
+# maximum number of pending edited regions scored by each run of the scoring task
+SCORE_ASYNC_BATCH_SIZE = 256
+# pending regions claimed by a scoring task run that has not added their scores within this time,
+# e.g., because its worker died or scoring failed, are claimed again by a later run
+SCORE_ASYNC_CLAIM_SECONDS = 300
+# pending regions that still cannot be scored after being claimed this many times are dropped
+SCORE_ASYNC_MAX_ATTEMPTS = 3
 
 # settings for supported color maps
 SUPPORTED_COLOR_MAPS = ('gray','cividis','viridis','bone','gist_heat','magma')
 
 # set experiment lock timeout to be 12 hours
 LOCK_TIMEOUT_SECONDS = 43200
+# seconds an experiment lock check is cached for, which bounds how long a process can keep
+# seeing a lock changed by another process when the cache is not shared among processes
+EXPERIMENT_LOCK_CACHE_SECONDS = 5
+
+# maximum centroid distance in normalized image coordinates for two regions in consecutive frames
+# to be linked by the global assignment linking method
+TRACKING_ASSIGNMENT_MAX_DISTANCE = 0.03
+
+# number of segmentation frames written to database in each bulk query by tracking
+TRACKING_DB_BATCH_SIZE = 100
+
+# iRODS storage backend, 'django_irods.storage.IrodsStorage' to run icommands or
+# 'django_irods.client_storage.IrodsClientStorage' to use python-irodsclient in-process
+IRODS_STORAGE_CLASS = 'django_irods.storage.IrodsStorage'
+
+# local directory to cache frame images retrieved from iRODS, which is IRODS_ROOT/image_cache
+# if empty
+IMAGE_CACHE_ROOT = ''
+# byte budget of the frame image cache beyond which least recently used images are evicted
+IMAGE_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+# byte budget of decoded grayscale frames kept in memory by each process for scoring, time
+# series computation and colormap application beyond which least recently used frames are evicted
+FRAME_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# read all frames of an experiment from a memory-mapped per-experiment frame stack when computing
+# time series rather than decoding frame images one by one
+FRAME_STACK_ENABLED = False
+# number of worker processes to measure frames with when computing time series
+TIME_SERIES_WORKERS = 1
+# seconds an in-progress time series export task is shared by repeat export requests for the
+# same segmentation state, which bounds how long a lost task blocks exports of that state
+TIME_SERIES_EXPORT_TASK_SECONDS = 3600
+# local directory to write per-experiment frame stacks to, which is IRODS_ROOT/frame_stacks
+# if empty
+FRAME_STACK_ROOT = ''
+
+# header to hand off sending frame images to the front end web server, 'X-Accel-Redirect' for
+# nginx or 'X-Sendfile' for apache, or empty to stream them from Django
+IMAGE_SENDFILE_HEADER = ''
+# internal nginx location aliased to IMAGE_CACHE_ROOT for X-Accel-Redirect
+IMAGE_SENDFILE_URL_PREFIX = '/protected_image_cache/'
+# seconds browsers can cache grayscale frame images without revalidation, which bounds how long
+# a browser keeps showing grayscale frames after the experiment colormap is changed
+IMAGE_MAX_AGE_SECONDS = 3600
+
+# store segmentation frame data in iRODS in the compact binary format as frameN.seg next to the
+# JSON frameN.json as well
+SEG_DATA_STORE_BINARY = True
+
+# maximum number of pooled iRODS sessions open at the same time in each process
+IRODS_SESSION_POOL_SIZE = 8
+# seconds to wait for a pooled iRODS session when all sessions are in use
+IRODS_SESSION_POOL_TIMEOUT_SECONDS = 30
+# seconds a pooled iRODS session can stay idle before it is health checked on checkout
+IRODS_SESSION_HEALTH_CHECK_SECONDS = 60
 
 ####################
 # LOGGING SETTINGS #
@@ -14,3 +14,14 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "celltracker.settings")
 
 application = get_wsgi_application()
+
+# load the scoring model when a web worker starts rather than on its first scoring request
+from django.conf import settings
+if settings.SCORE_MODEL_PRELOAD:
+    import logging
+    from scoring_module import get_score_model
+    try:
+        get_score_model()
+    except Exception as ex:
+        # the model is loaded again on first use
+        logging.getLogger(__name__).error('Failed to preload scoring model: ' + str(ex))
@@ -0,0 +1,181 @@
+import os
+import threading
+
+from collections import OrderedDict
+from tempfile import NamedTemporaryFile
+
+import cv2
+import numpy as np
+
+from django.conf import settings
+
+
+# decode modes of frame images. GRAY_MODE decodes a frame into a uint8 grayscale array, and
+# LUMINANCE_MODE decodes a colour frame into its [0, 1] float32 luminance with the weights of
+# skimage rgb2gray as the scoring model was trained on and leaves a grayscale frame as is
+GRAY_MODE = 'gray'
+LUMINANCE_MODE = 'luminance'
+# luminance weights of skimage rgb2gray in the BGR channel order cv2 decodes colour images in
+_BGR_LUMINANCE_WEIGHTS = np.array([0.0721, 0.7154, 0.2125])
+
+_lock = threading.Lock()
+# decoded frames keyed by (file name, modification time, size, mode) in least recently used order
+_frames = OrderedDict()
+_stats = {
+    'hits': 0,
+    'misses': 0,
+    'evictions': 0,
+    'bytes': 0,
+}
+
+
+def _get_frame_key(ifile, mode):
+    stat = os.stat(ifile)
+    return ifile, stat.st_mtime_ns, stat.st_size, mode
+
+
+def decode_frame_image(ifile, mode=GRAY_MODE):
+    """
+    decode a frame image file into a grayscale array without caching it
+    :param ifile: local image file name with full path
+    :param mode: GRAY_MODE or LUMINANCE_MODE
+    :return: array of shape (rows, cols), which is uint8 in GRAY_MODE, or None if the file cannot
+    be decoded
+    """
+    if mode != LUMINANCE_MODE:
+        return cv2.imread(ifile, cv2.IMREAD_GRAYSCALE)
+    img = cv2.imread(ifile, cv2.IMREAD_UNCHANGED)
+    if img is None or img.ndim == 2:
+        return img
+    # the alpha channel is dropped and values are scaled into [0, 1] as skimage rgb2gray does
+    return (np.dot(img[..., :3], _BGR_LUMINANCE_WEIGHTS) /
+            np.iinfo(img.dtype).max).astype(np.float32)
+
+
+def get_frame_array(ifile, mode=GRAY_MODE):
+    """
+    get a decoded grayscale frame image from the in-process frame cache, decoding it if it is not
+    cached yet so that a frame is decoded at most once per worker for scoring, time series
+    computation and colormap application alike. Least recently used frames are evicted once the
+    cache exceeds FRAME_CACHE_MAX_BYTES. Cached arrays are shared, so they are read-only.
+    :param ifile: local image file name with full path, e.g., returned from get_exp_image()
+    :param mode: GRAY_MODE by default; LUMINANCE_MODE to get the frame as the scoring model
+    expects it, which is cached separately
+    :return: read-only array of shape (rows, cols) decoded by decode_frame_image(), or None if the
+    file cannot be decoded
+    """
+    key = _get_frame_key(ifile, mode)
+    with _lock:
+        img = _frames.get(key)
+        if img is not None:
+            _frames.move_to_end(key)
+            _stats['hits'] += 1
+            return img
+        _stats['misses'] += 1
+
+    img = decode_frame_image(ifile, mode)
+    if img is None:
+        return None
+    img.flags.writeable = False
+    max_bytes = settings.FRAME_CACHE_MAX_BYTES
+    if img.nbytes > max_bytes:
+        return img
+
+    with _lock:
+        if key not in _frames:
+            _frames[key] = img
+            _stats['bytes'] += img.nbytes
+        while _stats['bytes'] > max_bytes:
+            _, evicted = _frames.popitem(last=False)
+            _stats['bytes'] -= evicted.nbytes
+            _stats['evictions'] += 1
+        return _frames.get(key, img)
+
+
+def clear_frame_cache():
+    """
+    drop all decoded frames from the in-process frame cache
+    """
+    with _lock:
+        _frames.clear()
+        _stats['bytes'] = 0
+
+
+def get_frame_cache_stats():
+    """
+    get hit/miss/eviction counters and memory usage of the frame cache of this process
+    :return: a dict of frame cache statistics
+    """
+    with _lock:
+        stats = dict(_stats)
+        stats['entries'] = len(_frames)
+    stats['max_bytes'] = settings.FRAME_CACHE_MAX_BYTES
+    stats['pid'] = os.getpid()
+    return stats
+
+
+def get_stack_root():
+    """
+    get the local directory that holds per-experiment memory-mapped frame stacks
+    """
+    return settings.FRAME_STACK_ROOT or os.path.join(settings.IRODS_ROOT, 'frame_stacks')
+
+
+def write_frame_stack(stack_file, ifiles, frame_count):
+    """
+    decode frame images into a (frames, rows, cols) uint8 .npy stack file. The stack is written to
+    a temporary file and then atomically renamed so that concurrent workers never map a
+    half-written stack, and other stacks in the same directory, which are older versions of the
+    stack, are removed.
+    :param stack_file: .npy stack file name with full path
+    :param ifiles: iterable of local image file names with full path in frame order, which can be
+    a generator retrieving each image only when it is decoded
+    :param frame_count: number of frames in ifiles
+    :return: stack_file
+    """
+    stack_dir = os.path.dirname(stack_file)
+    os.makedirs(stack_dir, exist_ok=True)
+    with NamedTemporaryFile(dir=stack_dir, prefix='.tmp', suffix='.npy', delete=False) as tmp:
+        tmp_name = tmp.name
+    try:
+        stack = None
+        for i, ifile in enumerate(ifiles):
+            img = decode_frame_image(ifile)
+            if img is None:
+                raise ValueError('cannot decode frame image {}'.format(ifile))
+            if stack is None:
+                stack = np.lib.format.open_memmap(tmp_name, mode='w+', dtype=np.uint8,
+                                                  shape=(frame_count,) + img.shape)
+            elif img.shape != stack.shape[1:]:
+                raise ValueError('frame image {} has shape {} rather than {}'.format(
+                    ifile, img.shape, stack.shape[1:]))
+            stack[i] = img
+        if stack is None or i + 1 != frame_count:
+            raise ValueError('expected {} frames to write a frame stack'.format(frame_count))
+        stack.flush()
+        del stack
+        os.rename(tmp_name, stack_file)
+    except Exception:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+
+    for entry in os.scandir(stack_dir):
+        if entry.path != stack_file and not entry.name.startswith('.tmp'):
+            try:
+                os.remove(entry.path)
+            except OSError:
+                # removed by another worker already
+                pass
+    return stack_file
+
+
+def load_frame_stack(stack_file):
+    """
+    map a frame stack written by write_frame_stack() read-only into memory. Pages are loaded by
+    the OS on access and shared by all processes mapping the same stack, so they do not count
+    towards FRAME_CACHE_MAX_BYTES.
+    :param stack_file: .npy stack file name with full path
+    :return: read-only memory-mapped uint8 array of shape (frames, rows, cols)
+    """
+    return np.load(stack_file, mmap_mode='r')
@@ -0,0 +1,189 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+
+from tempfile import NamedTemporaryFile
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+_counter_lock = threading.Lock()
+_counters = {
+    'hits': 0,
+    'misses': 0,
+    'evictions': 0,
+    'evicted_bytes': 0,
+}
+
+# estimated bytes of cached images keyed by cache root, which is the usage found by the last scan
+# plus images cached by this process since then, so that a miss does not scan the whole cache
+_usage = {}
+
+# temporary files older than this in seconds are left by workers that crashed while downloading
+# an image and are removed on eviction
+STALE_TMP_SECONDS = 3600
+# eviction frees the cache down to this fraction of the byte budget so that it is not run again on
+# every miss once the cache is full
+EVICT_TARGET_RATIO = 0.9
+
+
+def _count(name, value=1):
+    with _counter_lock:
+        _counters[name] += value
+
+
+def get_cache_root():
+    """
+    get the local directory that holds cached frame images
+    """
+    return settings.IMAGE_CACHE_ROOT or os.path.join(settings.IRODS_ROOT, 'image_cache')
+
+
+def get_cache_key(exp_id, image_type, image_name, file_info):
+    """
+    get the content address of a frame image in the cache, which changes whenever the image in
+    iRODS changes so that a stale cached image is never served
+    :param exp_id: experiment id
+    :param image_type: type of the image, 'png' or 'jpg'
+    :param image_name: name of the image in iRODS
+    :param file_info: IrodsFileInfo of the image in iRODS returned from list_files_info()
+    :return: cache key string
+    """
+    if file_info.checksum:
+        version = file_info.checksum
+    else:
+        version = '{}:{}'.format(file_info.modify_time, file_info.size)
+    key_str = '{}/{}/{}:{}'.format(exp_id, image_type, image_name, version)
+    return hashlib.sha1(key_str.encode()).hexdigest()
+
+
+def _get_cache_path(key, image_name):
+    _, ext = os.path.splitext(image_name)
+    return os.path.join(get_cache_root(), key[:2], key + ext)
+
+
+def get_cached_image(istorage, exp_id, image_type, image_name, file_info):
+    """
+    get a local copy of a frame image from the cache, retrieving it from iRODS if it is not
+    cached yet. A retrieved image is written to a temporary file and then atomically renamed into
+    the cache so that concurrent workers never see a half-written image.
+    :param istorage: iRODS storage backend to retrieve the image with
+    :param exp_id: experiment id
+    :param image_type: type of the image, 'png' or 'jpg'
+    :param image_name: name of the image in iRODS
+    :param file_info: IrodsFileInfo of the image in iRODS returned from list_files_info()
+    :return: local image file name with full path
+    """
+    key = get_cache_key(exp_id, image_type, image_name, file_info)
+    cache_path = _get_cache_path(key, image_name)
+    if os.path.isfile(cache_path):
+        _count('hits')
+        try:
+            # mark the entry as recently used for LRU eviction
+            os.utime(cache_path, None)
+        except OSError:
+            # evicted by another worker in the meantime
+            pass
+        else:
+            return cache_path
+    else:
+        _count('misses')
+
+    cache_dir = os.path.dirname(cache_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    with NamedTemporaryFile(dir=cache_dir, prefix='.tmp', delete=False) as tmp:
+        tmp_name = tmp.name
+    try:
+        istorage.get_file(os.path.join(exp_id, 'data', 'image', image_type, image_name), tmp_name)
+        os.rename(tmp_name, cache_path)
+    except Exception:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+
+    root = get_cache_root()
+    with _counter_lock:
+        usage = _usage.get(root)
+        if usage is not None:
+            usage += os.path.getsize(cache_path)
+            _usage[root] = usage
+    # other workers share the cache, so the estimate is trued up by the scan whenever it exceeds
+    # the budget
+    if usage is None or usage > settings.IMAGE_CACHE_MAX_BYTES:
+        evict(settings.IMAGE_CACHE_MAX_BYTES, keep=cache_path)
+    return cache_path
+
+
+def _list_entries(remove_stale_tmp=False):
+    """
+    internal method to list cached images as (last used time, size, path) tuples, optionally
+    removing temporary files left by crashed downloads
+    """
+    entries = []
+    root = get_cache_root()
+    if not os.path.isdir(root):
+        return entries
+    stale_time = time.time() - STALE_TMP_SECONDS
+    for sub_dir in os.scandir(root):
+        if not sub_dir.is_dir():
+            continue
+        for entry in os.scandir(sub_dir.path):
+            try:
+                stat = entry.stat()
+                if entry.name.startswith('.tmp'):
+                    if remove_stale_tmp and stat.st_mtime < stale_time:
+                        os.remove(entry.path)
+                    continue
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    return entries
+
+
+def evict(max_bytes, keep=None):
+    """
+    scan the cache and evict least recently used images down to EVICT_TARGET_RATIO of the byte
+    budget if the cache exceeds the budget. Stale temporary files are removed as well
+    :param max_bytes: byte budget of the cache
+    :param keep: optional path of an image not to be evicted, e.g., the one just cached
+    :return: number of evicted images
+    """
+    entries = _list_entries(remove_stale_tmp=True)
+    total = sum(size for _, size, _ in entries)
+    target = max_bytes * EVICT_TARGET_RATIO if total > max_bytes else max_bytes
+    evicted = 0
+    for _, size, path in sorted(entries):
+        if total <= target:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            # removed by another worker already
+            continue
+        total -= size
+        evicted += 1
+        _count('evictions')
+        _count('evicted_bytes', size)
+    with _counter_lock:
+        _usage[get_cache_root()] = total
+    return evicted
+
+
+def get_cache_stats():
+    """
+    get hit/miss/eviction counters of this process along with current cache usage
+    :return: a dict of cache statistics
+    """
+    with _counter_lock:
+        stats = dict(_counters)
+    entries = _list_entries()
+    stats['entries'] = len(entries)
+    stats['bytes'] = sum(size for _, size, _ in entries)
+    stats['max_bytes'] = settings.IMAGE_CACHE_MAX_BYTES
+    return stats
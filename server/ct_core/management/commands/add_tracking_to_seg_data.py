@@ -2,6 +2,7 @@ import logging
 
 from django.core.management.base import BaseCommand
 
+from ct_core.models import ExperimentInfo
 from ct_core.tasks import add_tracking
 from ct_core.utils import get_all_edit_users
 
@@ -15,19 +16,36 @@ class Command(BaseCommand):
      DB and iRODS
     To run this command, do:
     docker exec -ti celltracker python manage.py add_tracking_to_seg_data <exp_id>
+    or
+    docker exec -ti celltracker python manage.py add_tracking_to_seg_data <exp_id> --linking_method <method>
     For example:
     docker exec -ti celltracker python manage.py add_tracking_to_seg_data '18061934100'
+    docker exec -ti celltracker python manage.py add_tracking_to_seg_data '18061934100' --linking_method assignment
+    Only frames that have changed since they were last tracked are re-linked unless --force is given
     """
     help = "add tracking to system segmentation data for specified experiment in iRODS and database"
 
     def add_arguments(self, parser):
         # experiment id
         parser.add_argument('exp_id', help='experiment id')
+        # optional linking method to save for the experiment before adding tracking
+        parser.add_argument('--linking_method', default=None,
+                            choices=[c[0] for c in ExperimentInfo.LINKING_METHOD_CHOICES],
+                            help='method to link regions between consecutive frames')
+        # re-link all frames rather than only frames that have changed since last tracking
+        parser.add_argument('--force', action='store_true',
+                            help='re-link all frames including frames that have not changed')
 
     def handle(self, *args, **options):
         if options['exp_id']:
             exp_id = str(options['exp_id'])
-            add_tracking(exp_id)
+            if options['linking_method']:
+                obj, created = ExperimentInfo.objects.get_or_create(
+                    exp_id=exp_id, defaults={'linking_method': options['linking_method']})
+                if not created:
+                    obj.linking_method = options['linking_method']
+                    obj.save()
+            add_tracking(exp_id, force=options['force'])
             edit_users = get_all_edit_users(exp_id)
             for u in edit_users:
-                add_tracking(exp_id, username=u['username'])
+                add_tracking(exp_id, username=u['username'], force=options['force'])
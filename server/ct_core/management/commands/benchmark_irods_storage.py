@@ -0,0 +1,101 @@
+import os
+import time
+import shutil
+import tempfile
+
+from uuid import uuid4
+
+from django.core.management.base import BaseCommand
+
+from django_irods.storage import IrodsStorage
+from django_irods.client_storage import IrodsClientStorage
+
+
+def time_calls(func, iterations):
+    """
+    Call func repeatedly and measure its per-call latency
+    :param func: callable that takes the iteration index as the only argument
+    :param iterations: number of calls
+    :return: a tuple of (mean, max) per-call latency in milliseconds
+    """
+    latencies = []
+    for i in range(iterations):
+        start = time.time()
+        func(i)
+        latencies.append((time.time() - start) * 1000.0)
+    return sum(latencies) / len(latencies), max(latencies)
+
+
+def benchmark_storage(istorage, irods_path, local_file, local_path, iterations):
+    """
+    Benchmark listdir, exists, get and put calls of an iRODS storage backend
+    :param istorage: iRODS storage backend instance
+    :param irods_path: scratch iRODS collection path to put benchmark files in
+    :param local_file: local file to put to iRODS
+    :param local_path: local scratch directory to get files from iRODS to
+    :param iterations: number of calls for each operation
+    :return: list of (operation, mean latency, max latency) tuples
+    """
+    results = []
+
+    def put(i):
+        istorage.save_file(local_file, '{}/file{}.dat'.format(irods_path, i))
+
+    def listdir(i):
+        istorage.listdir(irods_path)
+
+    def exists(i):
+        istorage.exists('{}/file{}.dat'.format(irods_path, i))
+
+    def get(i):
+        istorage.get_file('{}/file{}.dat'.format(irods_path, i),
+                          os.path.join(local_path, 'file{}.dat'.format(i)))
+
+    istorage.save_file('', irods_path + '/', create_directory=True)
+    for name, func in (('put', put), ('listdir', listdir), ('exists', exists), ('get', get)):
+        mean, max_latency = time_calls(func, iterations)
+        results.append((name, mean, max_latency))
+    return results
+
+
+class Command(BaseCommand):
+    """
+    This script benchmarks per-call latency of listdir, exists, get and put calls on the icommands
+    IrodsStorage backend and the python-irodsclient IrodsClientStorage backend against the
+    configured iRODS server. Benchmark files are put in a scratch collection which is removed
+    afterwards.
+    To run this command, do:
+    docker exec -ti celltracker python manage.py benchmark_irods_storage --iterations <n>
+    For example:
+    docker exec -ti celltracker python manage.py benchmark_irods_storage --iterations 50
+    """
+    help = "Benchmark per-call latency of icommands and python-irodsclient iRODS storage backends"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20,
+                            help='number of calls for each operation')
+        parser.add_argument('--file_size', type=int, default=64 * 1024,
+                            help='size in bytes of the file to put and get')
+
+    def handle(self, *args, **options):
+        local_path = tempfile.mkdtemp()
+        local_file = os.path.join(local_path, 'benchmark.dat')
+        with open(local_file, 'wb') as f:
+            f.write(os.urandom(options['file_size']))
+
+        try:
+            for istorage in (IrodsStorage(), IrodsClientStorage()):
+                irods_path = 'benchmark_irods_storage_{}'.format(uuid4().hex)
+                get_path = os.path.join(local_path, 'get')
+                os.makedirs(get_path)
+                try:
+                    results = benchmark_storage(istorage, irods_path, local_file, get_path,
+                                                options['iterations'])
+                finally:
+                    istorage.delete(irods_path)
+                    shutil.rmtree(get_path)
+                for name, mean, max_latency in results:
+                    print('{}.{}: mean {:.1f} ms, max {:.1f} ms'.format(
+                        type(istorage).__name__, name, mean, max_latency))
+        finally:
+            shutil.rmtree(local_path)
@@ -0,0 +1,56 @@
+import time
+
+import numpy as np
+
+from django.core.management.base import BaseCommand
+
+from scoring_module import _create_mask_overlay_stack
+from ct_core.frame_cache import get_frame_array, clear_frame_cache, LUMINANCE_MODE
+from ct_core.management.commands.benchmark_tracking import create_synthetic_experiment
+
+
+class Command(BaseCommand):
+    """
+    This script benchmarks per-region preprocessing time of scoring, which crops the frame image
+    around each region and rasterizes the region mask, on a synthetic frame. If an image file is
+    given, frame image decoding time with and without the decoded image cache is also measured
+    To run this command, do:
+    docker exec -ti celltracker python manage.py benchmark_score_preprocessing --cells <cells> --image <image_file>
+    For example:
+    docker exec -ti celltracker python manage.py benchmark_score_preprocessing --cells 500
+    """
+    help = "Benchmark per-region preprocessing time of scoring on a synthetic frame"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cells', type=int, default=500, help='number of regions to score')
+        parser.add_argument('--vertices', type=int, default=32,
+                            help='number of vertices per region')
+        parser.add_argument('--rows', type=int, default=1024, help='number of image rows')
+        parser.add_argument('--cols', type=int, default=1344, help='number of image columns')
+        parser.add_argument('--repeat', type=int, default=5, help='number of timed runs')
+        parser.add_argument('--image', default='', help='frame image file to time decoding on')
+
+    def handle(self, *args, **options):
+        frame = create_synthetic_experiment(1, options['cells'], options['vertices'])[0]
+        vert_lists = [region['vertices'] for region in frame]
+        img = np.random.RandomState(0).randint(0, 256, (options['rows'], options['cols'])).astype(
+            np.uint8)
+
+        elapsed = []
+        for _ in range(options['repeat']):
+            start = time.time()
+            _create_mask_overlay_stack(img, vert_lists)
+            elapsed.append(time.time() - start)
+        per_region = min(elapsed) * 1000.0 / len(vert_lists)
+        print('preprocessing: {:.3f} ms per region, {:.1f} ms for {} regions'.format(
+            per_region, min(elapsed) * 1000.0, len(vert_lists)))
+
+        if options['image']:
+            clear_frame_cache()
+            start = time.time()
+            get_frame_array(options['image'], mode=LUMINANCE_MODE)
+            decode_ms = (time.time() - start) * 1000.0
+            start = time.time()
+            get_frame_array(options['image'], mode=LUMINANCE_MODE)
+            cached_ms = (time.time() - start) * 1000.0
+            print('decoding: {:.2f} ms uncached, {:.4f} ms cached'.format(decode_ms, cached_ms))
@@ -0,0 +1,59 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from ct_core.seg_codec import encode_frame, decode_frame
+from ct_core.management.commands.benchmark_tracking import create_synthetic_experiment
+
+
+def time_frames(func, frames):
+    """
+    Call func on each frame and measure the total elapsed time
+    :param func: callable that takes a frame as the only argument
+    :param frames: list of frames
+    :return: a tuple of (list of results, elapsed milliseconds per frame)
+    """
+    start = time.time()
+    results = [func(frame) for frame in frames]
+    return results, (time.time() - start) * 1000.0 / len(frames)
+
+
+class Command(BaseCommand):
+    """
+    This script benchmarks encoded size and encode/decode time per frame of the compact binary
+    segmentation format against indented and compact JSON on synthetic frames with linked
+    regions as produced by tracking
+    To run this command, do:
+    docker exec -ti celltracker python manage.py benchmark_seg_codec --frames <frames> --cells <cells>
+    For example:
+    docker exec -ti celltracker python manage.py benchmark_seg_codec --frames 20 --cells 2000
+    """
+    help = "Benchmark the compact binary segmentation format against JSON on synthetic frames"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frames', type=int, default=20, help='number of frames')
+        parser.add_argument('--cells', type=int, default=2000, help='number of cells per frame')
+        parser.add_argument('--vertices', type=int, default=32,
+                            help='number of vertices per cell')
+
+    def handle(self, *args, **options):
+        exp_data = create_synthetic_experiment(options['frames'], options['cells'],
+                                               options['vertices'])
+        for fno in range(1, len(exp_data)):
+            for region, prev_region in zip(exp_data[fno], exp_data[fno - 1]):
+                region['link_id'] = prev_region['id']
+
+        formats = (
+            ('json indent=2', lambda f: json.dumps(f, indent=2).encode(),
+             lambda b: json.loads(b.decode())),
+            ('json compact', lambda f: json.dumps(f, separators=(',', ':')).encode(),
+             lambda b: json.loads(b.decode())),
+            ('binary', encode_frame, decode_frame),
+        )
+        for name, encode, decode in formats:
+            encoded, encode_ms = time_frames(encode, exp_data)
+            _, decode_ms = time_frames(decode, encoded)
+            size = sum(len(b) for b in encoded) / len(encoded)
+            print('{}: {:.1f} KB, encode {:.2f} ms, decode {:.2f} ms per frame'.format(
+                name, size / 1024.0, encode_ms, decode_ms))
@@ -0,0 +1,143 @@
+import time
+import random
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from ct_core.models import Segmentation, UserSegmentation, ExperimentLock
+from ct_core.utils import get_start_frame, is_exp_locked, get_edited_frames, get_all_edit_users
+
+
+def seed_data(users, experiments, frames, edits_per_user, locked, batch_size=10000, seed=0):
+    """
+    Seed benchmark users with system and user edit segmentation data
+    :param users: number of users
+    :param experiments: number of experiments
+    :param frames: number of frames per experiment
+    :param edits_per_user: number of frames each user has edited across random experiments
+    :param locked: number of locked experiments
+    :param batch_size: number of objects to create in each query
+    :param seed: random seed
+    :return: a tuple of (list of User objects, list of experiment ids)
+    """
+    rng = random.Random(seed)
+    User.objects.bulk_create([User(username='benchmark_user_{}'.format(i),
+                                   first_name='First{}'.format(i), last_name='Last{}'.format(i))
+                              for i in range(users)], batch_size=batch_size)
+    user_objs = list(User.objects.filter(username__startswith='benchmark_user_'))
+    exp_ids = ['benchmark_exp_{}'.format(i) for i in range(experiments)]
+
+    now = timezone.now()
+    Segmentation.objects.bulk_create([
+        Segmentation(exp_id=exp_id, frame_no=fno, data=[])
+        for exp_id in exp_ids for fno in range(1, frames + 1)], batch_size=batch_size)
+    ExperimentLock.objects.bulk_create([
+        ExperimentLock(exp_id=exp_ids[i], user=user_objs[i], locked_time=now,
+                       expire_time=now + datetime.timedelta(hours=1))
+        for i in range(min(locked, experiments))])
+
+    user_segs = []
+    for u in user_objs:
+        edits = set()
+        while len(edits) < min(edits_per_user, experiments * frames):
+            edits.add((rng.choice(exp_ids), rng.randint(1, frames)))
+        for exp_id, fno in edits:
+            user_segs.append(UserSegmentation(
+                user=u, exp_id=exp_id, frame_no=fno, data=[], num_edited=1,
+                update_time=now - datetime.timedelta(seconds=rng.randint(0, 86400))))
+        if len(user_segs) >= batch_size:
+            UserSegmentation.objects.bulk_create(user_segs, batch_size=batch_size)
+            user_segs = []
+    UserSegmentation.objects.bulk_create(user_segs, batch_size=batch_size)
+
+    with connection.cursor() as cursor:
+        for model in (User, Segmentation, UserSegmentation, ExperimentLock):
+            cursor.execute('ANALYZE {}'.format(model._meta.db_table))
+    return user_objs, exp_ids
+
+
+def explain_calls(func):
+    """
+    Call func once and get EXPLAIN ANALYZE plans of all queries it runs
+    :param func: callable without arguments
+    :return: list of (sql, plan) tuples
+    """
+    with CaptureQueriesContext(connection) as ctx:
+        func()
+    plans = []
+    with connection.cursor() as cursor:
+        for query in ctx.captured_queries:
+            cursor.execute('EXPLAIN ANALYZE ' + query['sql'])
+            plans.append((query['sql'], '\n'.join(row[0] for row in cursor.fetchall())))
+    return plans
+
+
+def time_calls(func, args_list):
+    """
+    Call func with each argument tuple and measure its per-call latency
+    :param func: callable to benchmark
+    :param args_list: list of argument tuples
+    :return: a tuple of (mean, max) per-call latency in milliseconds
+    """
+    latencies = []
+    for args in args_list:
+        start = time.time()
+        func(*args)
+        latencies.append((time.time() - start) * 1000.0)
+    return sum(latencies) / len(latencies), max(latencies)
+
+
+class Command(BaseCommand):
+    """
+    This script benchmarks the hot segmentation lookups get_start_frame, is_exp_locked,
+    get_edited_frames and get_all_edit_users on seeded data, printing the EXPLAIN ANALYZE plan of
+    each query so that index usage can be verified. Seeded data is rolled back afterwards.
+    To run this command, do:
+    docker exec -ti celltracker python manage.py benchmark_segmentation_queries --users <n> --experiments <n>
+    For example:
+    docker exec -ti celltracker python manage.py benchmark_segmentation_queries --users 10000 --experiments 100
+    """
+    help = "Benchmark hot segmentation lookups with EXPLAIN ANALYZE on seeded data"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000, help='number of users')
+        parser.add_argument('--experiments', type=int, default=100,
+                            help='number of experiments')
+        parser.add_argument('--frames', type=int, default=100,
+                            help='number of frames per experiment')
+        parser.add_argument('--edits_per_user', type=int, default=20,
+                            help='number of frames each user has edited')
+        parser.add_argument('--locked', type=int, default=5,
+                            help='number of locked experiments')
+        parser.add_argument('--iterations', type=int, default=200,
+                            help='number of calls for each lookup')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            print('Seeding {} users and {} experiments'.format(options['users'],
+                                                               options['experiments']))
+            user_objs, exp_ids = seed_data(options['users'], options['experiments'],
+                                           options['frames'], options['edits_per_user'],
+                                           options['locked'])
+            rng = random.Random(1)
+            samples = [(rng.choice(user_objs), rng.choice(exp_ids))
+                       for _ in range(options['iterations'])]
+            lookups = (
+                ('get_start_frame', get_start_frame, [(u, e) for u, e in samples]),
+                ('is_exp_locked', is_exp_locked, [(e,) for _, e in samples]),
+                ('get_edited_frames', get_edited_frames, [(u.username, e) for u, e in samples]),
+                ('get_all_edit_users', get_all_edit_users, [(e,) for _, e in samples]),
+            )
+            # lock checks are not cached so that the database lookup is measured
+            with override_settings(EXPERIMENT_LOCK_CACHE_SECONDS=0):
+                for name, func, args_list in lookups:
+                    for sql, plan in explain_calls(lambda: func(*args_list[0])):
+                        print('{} query: {}\n{}'.format(name, sql, plan))
+                    mean, max_latency = time_calls(func, args_list)
+                    print('{}: mean {:.2f} ms, max {:.2f} ms'.format(name, mean, max_latency))
+            # do not keep seeded data
+            transaction.set_rollback(True)
@@ -0,0 +1,93 @@
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from django.core.management.base import BaseCommand
+
+from ct_core.time_series import measure_frame_regions, get_region_points
+from ct_core.management.commands.benchmark_tracking import create_synthetic_experiment
+
+
+def measure_with_masks(img, regions):
+    """
+    Measure average intensity of each region with a full-frame mask per region as done before
+    regions were measured on a label image, for comparison
+    :param img: grayscale frame image array
+    :param regions: list of region dicts in a frame
+    :return: list of average intensities in region order
+    """
+    rows, cols = img.shape
+    values = []
+    for region in regions:
+        mask = np.zeros_like(img)
+        cv2.fillPoly(mask, [get_region_points(region['vertices'], rows, cols)], 255)
+        values.append(cv2.mean(img, mask)[0])
+    return values
+
+
+def measure_synthetic_frame(args):
+    """
+    Create a synthetic frame and measure all of its regions on a label image, which runs in a
+    worker process to benchmark scaling of time series computation across processes
+    :param args: tuple of (seed, cells, vertices, rows, cols)
+    :return: number of measured regions
+    """
+    seed, cells, vertices, rows, cols = args
+    frame = create_synthetic_experiment(1, cells, vertices, seed=seed)[0]
+    img = np.random.RandomState(seed).randint(0, 256, (rows, cols)).astype(np.uint8)
+    return len(measure_frame_regions(img, frame)['mean'])
+
+
+class Command(BaseCommand):
+    """
+    This script benchmarks per-frame intensity measurement of time series computation with a
+    single label image against a full-frame mask per region on synthetic frames. If workers is
+    greater than 1, it also benchmarks scaling of measuring frames across 1 to workers processes
+    To run this command, do:
+    docker exec -ti celltracker python manage.py benchmark_time_series --frames <frames> --cells <cells>
+    For example:
+    docker exec -ti celltracker python manage.py benchmark_time_series --frames 5 --cells 2000
+    To benchmark scaling across up to 8 processes, do:
+    docker exec -ti celltracker python manage.py benchmark_time_series --frames 64 --cells 2000 --workers 8
+    """
+    help = "Benchmark per-frame intensity measurement of time series computation"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frames', type=int, default=5, help='number of frames')
+        parser.add_argument('--cells', type=int, default=2000, help='number of cells per frame')
+        parser.add_argument('--vertices', type=int, default=32,
+                            help='number of vertices per cell')
+        parser.add_argument('--rows', type=int, default=1024, help='number of image rows')
+        parser.add_argument('--cols', type=int, default=1344, help='number of image columns')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='maximum number of worker processes to benchmark scaling with')
+
+    def handle(self, *args, **options):
+        exp_data = create_synthetic_experiment(options['frames'], options['cells'],
+                                               options['vertices'])
+        img = np.random.RandomState(0).randint(0, 256, (options['rows'], options['cols'])).astype(
+            np.uint8)
+        for name, measure in (('label image', lambda f: measure_frame_regions(img, f)['mean']),
+                              ('mask per region', lambda f: measure_with_masks(img, f))):
+            start = time.time()
+            for frame in exp_data:
+                measure(frame)
+            elapsed = (time.time() - start) * 1000.0 / len(exp_data)
+            print('{}: {:.1f} ms per frame'.format(name, elapsed))
+
+        if options['workers'] <= 1:
+            return
+        args_list = [(seed, options['cells'], options['vertices'], options['rows'],
+                      options['cols']) for seed in range(options['frames'])]
+        base_elapsed = None
+        for workers in range(1, options['workers'] + 1):
+            start = time.time()
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(measure_synthetic_frame, args_list))
+            elapsed = time.time() - start
+            base_elapsed = base_elapsed or elapsed
+            print('{} workers: {:.2f} s, speedup {:.2f}x'.format(workers, elapsed,
+                                                                 base_elapsed / elapsed))
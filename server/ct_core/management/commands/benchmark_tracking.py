@@ -0,0 +1,172 @@
+import time
+import tracemalloc
+
+import numpy as np
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ct_core.task_utils import find_centroid, distance_between_point_sets
+from ct_core.tracking import get_frame_centroids, link_frames, NEAREST_LINKING, ASSIGNMENT_LINKING
+
+
+def create_synthetic_experiment(frames, cells, vertices, seed=0):
+    """
+    Create synthetic segmentation data for benchmarking with cells drifting randomly between frames
+    :param frames: number of frames
+    :param cells: number of cells in each frame
+    :param vertices: number of vertices of each cell polygon
+    :param seed: random seed
+    :return: list of frames, each of which is a list of region dicts as stored in the database
+    """
+    rng = np.random.RandomState(seed)
+    radius = 0.25 / np.sqrt(cells)
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    offsets = radius * np.stack((np.sin(angles), np.cos(angles)), axis=1)
+    centers = rng.uniform(0, 1, (cells, 2))
+    exp_data = []
+    for fno in range(frames):
+        centers = np.clip(centers + rng.normal(0, radius / 4, centers.shape), 0, 1)
+        frame_data = []
+        for cno in range(cells):
+            frame_data.append({'id': 'cell_{}_{}'.format(fno, cno),
+                               'vertices': (centers[cno] + offsets).tolist()})
+        exp_data.append(frame_data)
+    return exp_data
+
+
+def track_with_loop(exp_data):
+    """
+    Link regions the way add_tracking did before the vectorized tracking engine, one region
+    at a time
+    :param exp_data: list of frames returned from create_synthetic_experiment()
+    :return: list of linked id lists, one per frame starting from the second frame
+    """
+    centroids_xy = []
+    for data in exp_data:
+        centroid_list = []
+        for region in data:
+            x, y = find_centroid(np.array(region['vertices']))
+            centroid_list.append([x, y])
+        centroids_xy.append(np.array(centroid_list))
+
+    links = []
+    for fi in range(1, len(exp_data)):
+        frame_links = []
+        for cur_re in range(centroids_xy[fi].shape[0]):
+            xy1 = np.array([centroids_xy[fi][cur_re]])
+            min_idx = np.argmin(distance_between_point_sets(xy1, centroids_xy[fi - 1]))
+            frame_links.append(exp_data[fi - 1][min_idx]['id'])
+        links.append(frame_links)
+    return links
+
+
+def track_vectorized(exp_data, method=NEAREST_LINKING, max_distance=None):
+    """
+    Link regions using the vectorized tracking engine used by add_tracking
+    :param exp_data: list of frames returned from create_synthetic_experiment()
+    :param method: linking method passed to link_frames()
+    :param max_distance: maximum linking distance passed to link_frames()
+    :return: list of linked id lists, one per frame starting from the second frame, with None for
+    regions that are not linked
+    """
+    centroids_xy = [get_frame_centroids(data) for data in exp_data]
+    links = []
+    for fi in range(1, len(exp_data)):
+        linked_idx = link_frames(centroids_xy[fi], centroids_xy[fi - 1], method=method,
+                                 max_distance=max_distance)
+        pre_data = exp_data[fi - 1]
+        links.append([pre_data[idx]['id'] if idx >= 0 else None for idx in linked_idx])
+    return links
+
+
+def run_timed(func, *args, **kwargs):
+    """
+    Run func and measure its run time
+    :return: a tuple of (func return value, seconds)
+    """
+    start = time.time()
+    ret = func(*args, **kwargs)
+    return ret, time.time() - start
+
+
+def run_traced(func, *args, **kwargs):
+    """
+    Run func and measure its peak traced memory allocation. This is done in a separate run from
+    run_timed() since tracing memory allocations slows func down considerably
+    :return: peak memory in MB
+    """
+    tracemalloc.start()
+    func(*args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / (1024.0 * 1024.0)
+
+
+def count_shared_parents(links):
+    """
+    Count links that point to a parent region claimed by another region in the same frame
+    """
+    shared = 0
+    for frame_links in links:
+        linked = [lid for lid in frame_links if lid is not None]
+        shared += len(linked) - len(set(linked))
+    return shared
+
+
+class Command(BaseCommand):
+    """
+    This script benchmarks the vectorized tracking engine with nearest centroid and global
+    assignment linking against the per-region tracking loop on a synthetic experiment
+    To run this command, do:
+    docker exec -ti celltracker python manage.py benchmark_tracking --frames <frames> --cells <cells>
+    For example:
+    docker exec -ti celltracker python manage.py benchmark_tracking --frames 500 --cells 2000
+    """
+    help = "Benchmark vectorized tracking against the per-region tracking loop on synthetic data"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frames', type=int, default=500, help='number of frames')
+        parser.add_argument('--cells', type=int, default=2000, help='number of cells per frame')
+        parser.add_argument('--vertices', type=int, default=16,
+                            help='number of vertices per cell')
+        parser.add_argument('--max_distance', type=float,
+                            default=settings.TRACKING_ASSIGNMENT_MAX_DISTANCE,
+                            help='maximum linking distance for global assignment linking')
+        parser.add_argument('--skip_loop', action='store_true',
+                            help='do not time the per-region tracking loop')
+        parser.add_argument('--memory', action='store_true',
+                            help='also measure peak memory in an additional traced run')
+
+    def handle(self, *args, **options):
+        print('Creating synthetic experiment with {} frames and {} cells per frame'.format(
+            options['frames'], options['cells']))
+        exp_data = create_synthetic_experiment(options['frames'], options['cells'],
+                                               options['vertices'])
+
+        results = {}
+        for method in (NEAREST_LINKING, ASSIGNMENT_LINKING):
+            links, elapsed = run_timed(track_vectorized, exp_data, method=method,
+                                       max_distance=options['max_distance'])
+            results[method] = (links, elapsed)
+            print('{} linking: {:.2f} seconds, {} links sharing a parent'.format(
+                method, elapsed, count_shared_parents(links)))
+            if options['memory']:
+                peak = run_traced(track_vectorized, exp_data, method=method,
+                                  max_distance=options['max_distance'])
+                print('{} linking: peak memory {:.1f} MB'.format(method, peak))
+
+        if options['skip_loop']:
+            return
+
+        loop_links, loop_time = run_timed(track_with_loop, exp_data)
+        print('per-region tracking loop: {:.2f} seconds'.format(loop_time))
+        if options['memory']:
+            print('per-region tracking loop: peak memory {:.1f} MB'.format(
+                run_traced(track_with_loop, exp_data)))
+        vec_links, vec_time = results[NEAREST_LINKING]
+        print('nearest linking speedup: {:.1f}x'.format(loop_time / vec_time))
+
+        mismatches = sum(1 for vec_frm, loop_frm in zip(vec_links, loop_links)
+                         for vec_id, loop_id in zip(vec_frm, loop_frm) if vec_id != loop_id)
+        print('nearest links that differ from the tracking loop: {}'.format(mismatches))
@@ -1,8 +1,37 @@
 from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef, F, Q
 
-from ct_core.models import Segmentation, UserSegmentation
+from ct_core.models import Segmentation, UserSegmentation, SegmentationRegion
 from ct_core.utils import get_experiment_list_util, get_all_edit_users
-from ct_core.task_utils  import get_exp_frame_no
+
+
+def get_invalid_linked_regions(exp_id, username=''):
+    """
+    Find regions whose link_id does not link to a valid region id in the previous frame with
+    indexed queries on the region table rather than walking all frames
+    :param exp_id: experiment id
+    :param username: username to check user edit segmentation data for, or empty to check
+    system segmentation data. A user edit frame links to the previous user edit frame if the
+    user has edited the previous frame, and to the previous system frame otherwise
+    :return: queryset of invalid SegmentationRegion objects ordered by frame
+    """
+    prev_regions = SegmentationRegion.objects.filter(exp_id=exp_id,
+                                                     frame_no=OuterRef('prev_frame_no'),
+                                                     region_id=OuterRef('link_id'))
+    regions = SegmentationRegion.objects.filter(exp_id=exp_id, username=username).exclude(
+        link_id='').annotate(prev_frame_no=F('frame_no') - 1).annotate(
+        valid=Exists(prev_regions.filter(username=username)))
+    if not username:
+        return regions.filter(valid=False).order_by('frame_no', 'region_index')
+
+    regions = regions.annotate(
+        prev_edited=Exists(UserSegmentation.objects.filter(exp_id=exp_id,
+                                                           user__username=username,
+                                                           frame_no=OuterRef('prev_frame_no'))),
+        valid_system=Exists(prev_regions.filter(username='')))
+    return regions.filter(Q(prev_edited=True, valid=False) |
+                          Q(prev_edited=False, valid_system=False)).order_by('frame_no',
+                                                                             'region_index')
 
 
 class Command(BaseCommand):
@@ -28,66 +57,17 @@ class Command(BaseCommand):
             if not Segmentation.objects.filter(exp_id=exp_id).exists():
                 continue
 
-            edit_users = get_all_edit_users(exp_id)
-
-            fno = get_exp_frame_no(exp_id)
-            min_f = 0
-            max_f = fno
             # check system segmentation for all experiments
-            ids = {}
-            lids = {}
-            for i in range(max_f, min_f, -1):
-                id_list = []
-                lid_list = []
-                seg_obj = Segmentation.objects.get(exp_id=exp_id, frame_no=i)
-                data = seg_obj.data
-                for region in data:
-                    id = region['id']
-                    id_list.append(id)
-                    if 'link_id' in region:
-                        lid = region['link_id']
-                        lid_list.append(lid)
-                ids[i] = id_list
-                lids[i] = lid_list
-
-            for i, lid_lst in lids.iteritems():
-                for lid in lid_lst:
-                    if i-1 not in ids:
-                        print('key error: i=' + str(i) + ', lid=' + str(lid) + ', exp_id=' + exp_id)
-                    else:
-                        if lid not in ids[i-1]:
-                            print('link_id {} in frame {} for experiment {} does not link to a '
-                                  'valid object id in its previous frame'.format(lid, i, exp_id))
+            for region in get_invalid_linked_regions(exp_id):
+                print('link_id {} in frame {} for experiment {} does not link to a '
+                      'valid object id in its previous frame'.format(region.link_id,
+                                                                     region.frame_no, exp_id))
 
             # check user segmentation data
-            for u in edit_users:
-                uids = {}
-                ulids = {}
-                for useg in UserSegmentation.objects.filter(exp_id=exp_id,
-                                                            user__username=u['username']):
-                    uid_list = []
-                    ulid_list = []
-                    ufno = useg.frame_no
-                    for region in useg.data:
-                        uid_list.append(region['id'])
-                        if 'link_id' in region:
-                            ulid_list.append(region['link_id'])
-                    uids[ufno] = uid_list
-                    ulids[ufno] = ulid_list
-                for i, ulid_lst in ulids.iteritems():
-                    for ulid in ulid_lst:
-                        if i-1 in uids:
-                            if ulid not in uids[i-1]:
-                                print('user {} link_id {} in frame {} for experiment {} does not '
-                                      'link to a valid object id in its previous user-editted '
-                                      'frame {}'.format(u, lid, i, exp_id, i-1))
-                        elif i-1 in ids:
-                            if ulid not in ids[i-1]:
-                                print('user {} link_id {} in frame {} for experiment {} does not '
-                                      'link to a valid object id in its previous system '
-                                      'frame {}'.format(u, lid, i, exp_id, i-1))
-                        else:
-                            print(
-                            'key error: i=' + str(i) + ', ulid=' + str(ulid) +
-                            ', exp_id=' + exp_id + ', user=' + u['username'])
+            for u in get_all_edit_users(exp_id):
+                for region in get_invalid_linked_regions(exp_id, username=u['username']):
+                    print('user {} link_id {} in frame {} for experiment {} does not link to a '
+                          'valid object id in its previous frame {}'.format(
+                            u['username'], region.link_id, region.frame_no, exp_id,
+                            region.frame_no - 1))
         return
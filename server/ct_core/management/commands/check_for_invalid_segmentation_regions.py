@@ -4,6 +4,7 @@ import logging
 
 from django.core.management.base import BaseCommand
 
+from ct_core.models import SegmentationRegion
 from ct_core.utils import get_seg_collection
 
 
@@ -12,34 +13,48 @@ logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
     """
-    This script checks all segmentation frames in iRODS for invalid segmentation regions, in
-    particular, segmentation polygon regions with less than 3 vertices.
+    This script checks all segmentation frames for invalid segmentation regions, in
+    particular, segmentation polygon regions with less than 3 vertices. Regions are checked with
+    an indexed query on the region table in the database unless --irods is given, in which case
+    segmentation frames in iRODS are checked.
     To run this command, do:
     docker exec -ti celltracker python manage.py check_for_invalid_segmentation_regions <exp_id>
     For example:
     docker exec -ti celltracker python manage.py check_for_invalid_segmentation_regions '18061934100'
+    docker exec -ti celltracker python manage.py check_for_invalid_segmentation_regions '18061934100' --irods
     """
-    help = "Check all segmentation frames for an experiment in iRODS for invalid regions with " \
+    help = "Check all segmentation frames for an experiment for invalid regions with " \
            "less than 3 vertices"
 
 
     def add_arguments(self, parser):
         # experiment id to check against
         parser.add_argument('exp_id', help='experiment id')
+        # check segmentation frames in iRODS rather than in the database
+        parser.add_argument('--irods', action='store_true',
+                            help='check segmentation frames in iRODS')
 
     def handle(self, *args, **options):
         eid = options['exp_id']
-        session, coll, coll_path = get_seg_collection(eid)
-        if coll:
-            for obj in coll.data_objects:
-                basename, ext = os.path.splitext(obj.name)
-                if ext != '.json':
-                    continue
-                logical_file = session.data_objects.get(obj.path)
-                with logical_file.open('r') as json_f:
-                    json_data = json.load(json_f)
-                    for item in json_data:
-                        v_array = item['vertices']
-                        if len(v_array) < 3:
-                            print(len(v_array))
+        if not options['irods']:
+            for region in SegmentationRegion.objects.filter(
+                    exp_id=eid, username='', num_vertices__lt=3).order_by('frame_no',
+                                                                          'region_index'):
+                print('frame {} region {}: {}'.format(region.frame_no, region.region_id,
+                                                      region.num_vertices))
+            return
+
+        with get_seg_collection(eid) as (session, coll, coll_path):
+            if coll:
+                for obj in coll.data_objects:
+                    basename, ext = os.path.splitext(obj.name)
+                    if ext != '.json':
+                        continue
+                    logical_file = session.data_objects.get(obj.path)
+                    with logical_file.open('r') as json_f:
+                        json_data = json.load(json_f)
+                        for item in json_data:
+                            v_array = item['vertices']
+                            if len(v_array) < 3:
+                                print(len(v_array))
         return
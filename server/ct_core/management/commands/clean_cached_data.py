@@ -4,6 +4,8 @@ import os
 from django.core.management.base import BaseCommand
 from django.conf import settings
 
+from ct_core.task_utils import invalidate_frame_index
+
 
 class Command(BaseCommand):
     """
@@ -26,3 +28,4 @@ class Command(BaseCommand):
             input_dest_path = os.path.join(settings.IRODS_ROOT, exp_id)
             if os.path.exists(input_dest_path):
                 shutil.rmtree(input_dest_path)
+            invalidate_frame_index(exp_id)
@@ -1,8 +1,8 @@
 from django.core.management.base import BaseCommand
 
-from ct_core.models import UserSegmentation
+from ct_core.models import UserSegmentation, SegmentationRegion
 from ct_core.utils import get_experiment_list_util
-from django_irods.storage import IrodsStorage
+from django_irods.storage import get_irods_storage
 from django_irods.icommands import SessionException
 
 
@@ -60,7 +60,7 @@ class Command(BaseCommand):
                     del_objs.append(filter_objs)
 
             # delete irods file if any
-            istorage = IrodsStorage()
+            istorage = get_irods_storage()
             for objs in del_objs:
                 for obj in objs:
                     try:
@@ -69,4 +69,7 @@ class Command(BaseCommand):
                         print(ex.stderr)
                         continue
                 if len(objs):
+                    SegmentationRegion.objects.filter(
+                        exp_id=objs[0].exp_id, username=username,
+                        frame_no__in=[obj.frame_no for obj in objs]).delete()
                     print(objs.delete())
@@ -3,6 +3,8 @@ import logging
 from django.core.management.base import BaseCommand
 
 from ct_core.utils import compute_time_series_and_put_in_irods
+from ct_core.time_series import TIME_SERIES_FEATURES, TIME_SERIES_FILES, TIME_SERIES_FORMATS, \
+    WIDE_LAYOUT, CSV_FORMAT
 
 
 logger = logging.getLogger(__name__)
@@ -17,6 +19,16 @@ class Command(BaseCommand):
     docker exec -ti celltracker python manage.py output_time_series_cell_data <exp_id>
     For example:
     docker exec -ti celltracker python manage.py output_time_series_cell_data '18061934100'
+    To also output area and integrated intensity of each cell, do:
+    docker exec -ti celltracker python manage.py output_time_series_cell_data '18061934100' --features mean area integrated
+    To output one row per cell per frame rather than one column per cell, do:
+    docker exec -ti celltracker python manage.py output_time_series_cell_data '18061934100' --layout long
+    To measure frames across 8 worker processes, do:
+    docker exec -ti celltracker python manage.py output_time_series_cell_data '18061934100' --workers 8
+    To gzip the output on the fly, do:
+    docker exec -ti celltracker python manage.py output_time_series_cell_data '18061934100' --format csv.gz
+    To output the long layout as a Parquet file, which requires pyarrow, do:
+    docker exec -ti celltracker python manage.py output_time_series_cell_data '18061934100' --layout long --format parquet
     """
     help = "Compute average intensity of each cell and output time series cell data in csv format " \
            "for specified experiment"
@@ -24,8 +36,27 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         # experiment id
         parser.add_argument('exp_id', help='experiment id')
+        parser.add_argument('--features', nargs='+', default=['mean'],
+                            choices=list(TIME_SERIES_FEATURES),
+                            help='features to output for each cell, which are average, area, '
+                                 'integrated, minimum and maximum intensity')
+        parser.add_argument('--layout', default=WIDE_LAYOUT, choices=list(TIME_SERIES_FILES),
+                            help='wide to output one row per frame and one column per cell as '
+                                 'imported by Cell Cycle Browser, or long to output one row per '
+                                 'cell per frame')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='number of worker processes to measure frames with, with '
+                                 'default being TIME_SERIES_WORKERS')
+        parser.add_argument('--format', default=CSV_FORMAT, choices=list(TIME_SERIES_FORMATS),
+                            help='output format, which is csv, gzipped csv, or Parquet for the '
+                                 'long layout')
 
     def handle(self, *args, **options):
         if options['exp_id']:
             exp_id = str(options['exp_id'])
-            compute_time_series_and_put_in_irods(exp_id)
+            err_msg = compute_time_series_and_put_in_irods(exp_id, features=options['features'],
+                                                           workers=options['workers'],
+                                                           layout=options['layout'],
+                                                           output_format=options['format'])
+            if err_msg:
+                print(err_msg)
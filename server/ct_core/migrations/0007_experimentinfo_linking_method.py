@@ -0,0 +1,18 @@
+# Generated by Django 2.2.10 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ct_core', '0006_experimentinfo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='experimentinfo',
+            name='linking_method',
+            field=models.CharField(choices=[('nearest', 'Nearest centroid'), ('assignment', 'Global assignment')], default='nearest', max_length=20),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.10 on 2026-10-18 13:40
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ct_core', '0007_experimentinfo_linking_method'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrackingState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('exp_id', models.CharField(max_length=50)),
+                ('username', models.CharField(blank=True, default='', max_length=150)),
+                ('frame_no', models.PositiveIntegerField()),
+                ('regions_hash', models.CharField(max_length=64)),
+                ('pre_regions_hash', models.CharField(blank=True, default='', max_length=64)),
+                ('linking_method', models.CharField(default='nearest', max_length=20)),
+                ('region_ids', django.contrib.postgres.fields.jsonb.JSONField(default=list)),
+                ('centroids', models.BinaryField()),
+            ],
+            options={
+                'unique_together': {('exp_id', 'username', 'frame_no')},
+            },
+        ),
+    ]
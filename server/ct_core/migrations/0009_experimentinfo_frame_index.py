@@ -0,0 +1,19 @@
+# Generated by Django 2.2.10 on 2026-10-18 16:40
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ct_core', '0008_trackingstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='experimentinfo',
+            name='frame_index',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,106 @@
+# Generated by Django 2.2.10 on 2026-10-18 18:10
+
+import numpy as np
+
+from django.db import migrations, models
+
+
+def get_region_fields(data):
+    '''
+    Compute SegmentationRegion field values for all regions in a frame. This is a frozen copy of
+    ct_core.task_utils.get_region_fields as of this migration so that later changes to it do not
+    change the backfill.
+    '''
+    if not isinstance(data, list) or not data:
+        return []
+    counts = np.array([len(region['vertices']) for region in data], dtype=np.intp)
+    centroids = np.full((len(data), 2), np.nan)
+    mins = np.full((len(data), 2), np.nan)
+    maxs = np.full((len(data), 2), np.nan)
+    non_empty = counts > 0
+    if counts.sum():
+        vertices = np.array([v for region in data for v in region['vertices']], dtype=float)
+        starts = (np.cumsum(counts) - counts)[non_empty]
+        centroids[non_empty] = np.add.reduceat(vertices, starts, axis=0) / \
+            counts[non_empty, np.newaxis]
+        mins[non_empty] = np.minimum.reduceat(vertices, starts, axis=0)
+        maxs[non_empty] = np.maximum.reduceat(vertices, starts, axis=0)
+    # NaN of regions without vertices is stored as null
+    centroids, mins, maxs = ([[None if v != v else v for v in row] for row in a.tolist()]
+                             for a in (centroids, mins, maxs))
+    return [{'region_id': str(region['id']),
+             'link_id': str(region.get('link_id') or ''),
+             'centroid_y': centroids[i][0],
+             'centroid_x': centroids[i][1],
+             'min_y': mins[i][0],
+             'min_x': mins[i][1],
+             'max_y': maxs[i][0],
+             'max_x': maxs[i][1],
+             'num_vertices': int(counts[i]),
+             'edited': str(region.get('edited', False)).lower() == 'true'}
+            for i, region in enumerate(data)]
+
+
+def populate_segmentation_regions(apps, schema_editor):
+    '''
+    Populate the region table from the frame region lists of existing system and user
+    segmentation data. We use the historical models rather than importing them directly.
+    '''
+    Segmentation = apps.get_model('ct_core', 'Segmentation')
+    UserSegmentation = apps.get_model('ct_core', 'UserSegmentation')
+    SegmentationRegion = apps.get_model('ct_core', 'SegmentationRegion')
+
+    def create_rows(seg_objs):
+        for exp_id, username, frame_no, data in seg_objs.iterator():
+            rows = [SegmentationRegion(exp_id=exp_id, username=username or '', frame_no=frame_no,
+                                       region_index=idx, **fields)
+                    for idx, fields in enumerate(get_region_fields(data))]
+            SegmentationRegion.objects.bulk_create(rows)
+
+    create_rows(Segmentation.objects.annotate(
+        username=models.Value('', output_field=models.CharField())).values_list(
+        'exp_id', 'username', 'frame_no', 'data'))
+    create_rows(UserSegmentation.objects.values_list('exp_id', 'user__username', 'frame_no',
+                                                     'data'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ct_core', '0009_experimentinfo_frame_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SegmentationRegion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('exp_id', models.CharField(max_length=50)),
+                ('username', models.CharField(blank=True, default='', max_length=150)),
+                ('frame_no', models.PositiveIntegerField()),
+                ('region_index', models.PositiveIntegerField()),
+                ('region_id', models.CharField(max_length=100)),
+                ('link_id', models.CharField(blank=True, default='', max_length=100)),
+                ('centroid_y', models.FloatField(blank=True, null=True)),
+                ('centroid_x', models.FloatField(blank=True, null=True)),
+                ('min_y', models.FloatField(blank=True, null=True)),
+                ('min_x', models.FloatField(blank=True, null=True)),
+                ('max_y', models.FloatField(blank=True, null=True)),
+                ('max_x', models.FloatField(blank=True, null=True)),
+                ('num_vertices', models.PositiveIntegerField(default=0)),
+                ('edited', models.BooleanField(default=False)),
+            ],
+            options={
+                'unique_together': {('exp_id', 'username', 'frame_no', 'region_index')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='segmentationregion',
+            index=models.Index(fields=['exp_id', 'username', 'frame_no', 'region_id'], name='ct_core_segreg_region_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='segmentationregion',
+            index=models.Index(fields=['exp_id', 'username', 'frame_no', 'link_id'], name='ct_core_segreg_link_idx'),
+        ),
+        migrations.RunPython(populate_segmentation_regions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.10 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ct_core', '0010_segmentationregion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='segmentation',
+            index=models.Index(condition=models.Q(locked_time__isnull=False), fields=['exp_id'], name='ct_core_seg_locked_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersegmentation',
+            index=models.Index(fields=['exp_id', 'user'], name='ct_core_useg_exp_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usersegmentation',
+            index=models.Index(condition=models.Q(update_time__isnull=False), fields=['user', 'exp_id', '-update_time'], name='ct_core_useg_update_idx'),
+        ),
+    ]
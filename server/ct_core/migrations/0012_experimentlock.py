@@ -0,0 +1,57 @@
+# Generated by Django 2.2.10 on 2026-10-18 19:50
+
+import datetime
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_segmentation_locks(apps, schema_editor):
+    '''
+    Move unexpired experiment locks kept on Segmentation rows to the lock table.
+    We use the historical models rather than importing them directly.
+    '''
+    Segmentation = apps.get_model('ct_core', 'Segmentation')
+    ExperimentLock = apps.get_model('ct_core', 'ExperimentLock')
+    timeout = datetime.timedelta(seconds=settings.LOCK_TIMEOUT_SECONDS)
+    for exp_id, locked_time, user_id in Segmentation.objects.filter(
+            locked_time__isnull=False, locked_user__isnull=False).order_by(
+            'exp_id', '-locked_time').distinct('exp_id').values_list(
+            'exp_id', 'locked_time', 'locked_user'):
+        ExperimentLock.objects.create(exp_id=exp_id, user_id=user_id, locked_time=locked_time,
+                                      expire_time=locked_time + timeout)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ct_core', '0011_segmentation_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExperimentLock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('exp_id', models.CharField(max_length=50, unique=True)),
+                ('locked_time', models.DateTimeField()),
+                ('expire_time', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='experiment_locks', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(copy_segmentation_locks, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='segmentation',
+            name='ct_core_seg_locked_idx',
+        ),
+        migrations.RemoveField(
+            model_name='segmentation',
+            name='locked_time',
+        ),
+        migrations.RemoveField(
+            model_name='segmentation',
+            name='locked_user',
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.10 on 2026-10-18 20:40
+
+from django.conf import settings
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ct_core', '0012_experimentlock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingRegionScore',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('exp_id', models.CharField(max_length=50)),
+                ('frame_no', models.PositiveIntegerField()),
+                ('vertices', django.contrib.postgres.fields.jsonb.JSONField()),
+                ('created_time', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pending_region_scores', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.10 on 2026-10-18 23:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ct_core', '0013_pendingregionscore'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pendingregionscore',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='pendingregionscore',
+            name='claimed_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -7,6 +7,8 @@ from django.core.validators import MinValueValidator, MaxValueValidator
 
 from django_irods.storage import IrodsStorage
 
+from ct_core.tracking import NEAREST_LINKING, ASSIGNMENT_LINKING
+
 
 def get_path_by_paras(exp_id, filename, username=''):
     """
@@ -71,12 +73,7 @@ class Segmentation(models.Model):
     data = JSONField()
     file = models.FileField(upload_to=get_path, max_length=4096, null=True, blank=True,
                             storage=IrodsStorage())
-    # this locked_time field is added for locking experiments by power users to avoid multiple
-    # power users from updating ground truth data for the same experiment. It represents
-    # the time when the experiment is locked by a power user. A value of null
-    # means the experiment is not locked
-    locked_time = models.DateTimeField(null=True, blank=True)
-    locked_user = models.ForeignKey(User, null=True, blank=True, related_name='locked_user', on_delete=models.CASCADE)
+
     class Meta:
         unique_together = ("exp_id", "frame_no")
 
@@ -97,6 +94,14 @@ class UserSegmentation(models.Model):
 
     class Meta:
         unique_together = ("user", "exp_id", "frame_no")
+        indexes = [
+            # lookups of all users who edited an experiment or of a user by username in an
+            # experiment, which cannot use the unique index led by user
+            models.Index(fields=['exp_id', 'user'], name='ct_core_useg_exp_user_idx'),
+            # lookup of the frame a user saved most recently in an experiment
+            models.Index(fields=['user', 'exp_id', '-update_time'], name='ct_core_useg_update_idx',
+                         condition=models.Q(update_time__isnull=False)),
+        ]
 
     def __unicode__(self):
         return 'User {} experiment {} frame {} segmentation'.format(self.user.username,
@@ -104,6 +109,110 @@ class UserSegmentation(models.Model):
                                                                     self.frame_no)
 
 
+class ExperimentLock(models.Model):
+    # lock placed on an experiment by a power user to avoid multiple power users from updating
+    # ground truth data for the same experiment. The experiment is not locked once expire_time
+    # has passed, so expired locks never need to be released
+    exp_id = models.CharField(max_length=50, unique=True)
+    user = models.ForeignKey(User, related_name='experiment_locks', on_delete=models.CASCADE)
+    locked_time = models.DateTimeField()
+    expire_time = models.DateTimeField()
+
+    def __unicode__(self):
+        return 'Experiment {} locked by {}'.format(self.exp_id, self.user.username)
+
+
+class PendingRegionScore(models.Model):
+    # newly edited region saved by a user which is waiting to be scored by the
+    # score_pending_regions task when scoring is asynchronous. The row is deleted in the same
+    # transaction in which its score is added to the user score
+    user = models.ForeignKey(User, related_name='pending_region_scores', on_delete=models.CASCADE)
+    exp_id = models.CharField(max_length=50)
+    frame_no = models.PositiveIntegerField()
+    vertices = JSONField()
+    created_time = models.DateTimeField(auto_now_add=True)
+    # time the region was claimed by a run of score_pending_regions, which can be claimed again
+    # once the claim is older than SCORE_ASYNC_CLAIM_SECONDS, and number of times it was claimed
+    claimed_time = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+
+    def __unicode__(self):
+        return 'Pending region score for {} in experiment {} frame {}'.format(
+            self.user.username, self.exp_id, self.frame_no)
+
+
 class ExperimentInfo(models.Model):
+    LINKING_METHOD_CHOICES = (
+        (NEAREST_LINKING, 'Nearest centroid'),
+        (ASSIGNMENT_LINKING, 'Global assignment'),
+    )
+
     exp_id = models.CharField(max_length=50)
     colormap = models.CharField(max_length=50, default='gray')
+    # method used by tracking to link regions in a frame to regions in its previous frame
+    linking_method = models.CharField(max_length=20, choices=LINKING_METHOD_CHOICES,
+                                      default=NEAREST_LINKING)
+    # frame image index keyed by image type built by get_frame_index() from the iRODS image
+    # collection listing so that frame lookups do not list iRODS every time. It is reset
+    # whenever image frames are uploaded or recolored
+    frame_index = JSONField(default=dict, blank=True)
+
+
+class TrackingState(models.Model):
+    # tracking state of a frame kept by add_tracking to only re-link frame pairs whose segmentation
+    # has changed since they were last linked. An empty username means system segmentation data
+    exp_id = models.CharField(max_length=50)
+    username = models.CharField(max_length=150, blank=True, default='')
+    frame_no = models.PositiveIntegerField()
+    # content hash of the frame regions and of the previous frame regions when the frame
+    # was last linked to its previous frame
+    regions_hash = models.CharField(max_length=64)
+    pre_regions_hash = models.CharField(max_length=64, blank=True, default='')
+    linking_method = models.CharField(max_length=20, default=NEAREST_LINKING)
+    region_ids = JSONField(default=list)
+    centroids = models.BinaryField()
+
+    class Meta:
+        unique_together = ("exp_id", "username", "frame_no")
+
+    def __unicode__(self):
+        return 'Experiment {} frame {} tracking state for {}'.format(self.exp_id, self.frame_no,
+                                                                    self.username or 'system')
+
+
+class SegmentationRegion(models.Model):
+    # one row per region of system or user segmentation data, kept in sync with the frame region
+    # lists in Segmentation.data and UserSegmentation.data in the same transaction by
+    # save_seg_regions() so that queries about cells can be done with indexed SQL rather than
+    # loading and parsing every frame. An empty username means system segmentation data
+    exp_id = models.CharField(max_length=50)
+    username = models.CharField(max_length=150, blank=True, default='')
+    frame_no = models.PositiveIntegerField()
+    # position of the region in the frame region list, which points to its vertices in the
+    # frame data
+    region_index = models.PositiveIntegerField()
+    region_id = models.CharField(max_length=100)
+    link_id = models.CharField(max_length=100, blank=True, default='')
+    # centroid and bounding box in normalized [y, x] coordinates of the region vertices
+    centroid_y = models.FloatField(null=True, blank=True)
+    centroid_x = models.FloatField(null=True, blank=True)
+    min_y = models.FloatField(null=True, blank=True)
+    min_x = models.FloatField(null=True, blank=True)
+    max_y = models.FloatField(null=True, blank=True)
+    max_x = models.FloatField(null=True, blank=True)
+    num_vertices = models.PositiveIntegerField(default=0)
+    edited = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ("exp_id", "username", "frame_no", "region_index")
+        indexes = [
+            models.Index(fields=['exp_id', 'username', 'frame_no', 'region_id'],
+                         name='ct_core_segreg_region_idx'),
+            models.Index(fields=['exp_id', 'username', 'frame_no', 'link_id'],
+                         name='ct_core_segreg_link_idx'),
+        ]
+
+    def __unicode__(self):
+        return 'Experiment {} frame {} region {} for {}'.format(self.exp_id, self.frame_no,
+                                                                self.region_id,
+                                                                self.username or 'system')
@@ -0,0 +1,85 @@
+import os
+import json
+import struct
+
+import numpy as np
+
+from django.conf import settings
+
+
+# content type of segmentation frame data in the compact binary format
+SEG_CODEC_CONTENT_TYPE = 'application/x-celltracker-seg'
+# file extension of segmentation frame data in the compact binary format stored in iRODS
+SEG_CODEC_FILE_EXT = '.seg'
+
+_MAGIC = b'CTSG'
+_VERSION = 1
+# magic, version, region count, vertex count, side table byte length
+_HEADER = struct.Struct('<4sBIII')
+# vertex coordinates normalized to [0, 1] are quantized to uint16
+_SCALE = 65535.0
+
+
+def encode_frame(regions):
+    """
+    Encode segmentation regions of a frame in the compact binary format, which is laid out as a
+    header followed by uint32 vertex offsets per region, quantized uint16 [y, x] vertex
+    coordinates of all regions, and a compact JSON side table holding all other region fields
+    such as id and link_id. Vertex coordinates are normalized to [0, 1], so quantization keeps
+    them within 1/131070 of the original values.
+    :param regions: list of region dicts in a frame as stored in the database
+    :return: encoded bytes
+    """
+    counts = np.fromiter((len(region['vertices']) for region in regions), dtype=np.uint32,
+                         count=len(regions))
+    offsets = np.zeros(len(regions) + 1, dtype='<u4')
+    np.cumsum(counts, out=offsets[1:])
+    if offsets[-1]:
+        vertices = np.array([v for region in regions for v in region['vertices']], dtype=float)
+        quantized = np.rint(np.clip(vertices, 0.0, 1.0) * _SCALE).astype('<u2')
+    else:
+        quantized = np.empty((0, 2), dtype='<u2')
+    side_table = json.dumps([{k: v for k, v in region.items() if k != 'vertices'}
+                             for region in regions], separators=(',', ':')).encode()
+    header = _HEADER.pack(_MAGIC, _VERSION, len(regions), int(offsets[-1]), len(side_table))
+    return b''.join((header, offsets.tobytes(), quantized.tobytes(), side_table))
+
+
+def decode_frame(buf):
+    """
+    Decode segmentation regions of a frame encoded by encode_frame()
+    :param buf: encoded bytes
+    :return: list of region dicts in a frame with the same fields as the encoded regions
+    """
+    magic, version, n_regions, n_vertices, side_len = _HEADER.unpack_from(buf, 0)
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError('not a version {} segmentation frame'.format(_VERSION))
+    pos = _HEADER.size
+    offsets = np.frombuffer(buf, dtype='<u4', count=n_regions + 1, offset=pos)
+    pos += offsets.nbytes
+    quantized = np.frombuffer(buf, dtype='<u2', count=n_vertices * 2, offset=pos)
+    pos += quantized.nbytes
+    vertices = (quantized.reshape(-1, 2) / _SCALE).tolist()
+    regions = json.loads(bytes(buf[pos:pos + side_len]).decode())
+    for i, region in enumerate(regions):
+        region['vertices'] = vertices[offsets[i]:offsets[i + 1]]
+    return regions
+
+
+def write_frame_files(regions, json_file_name):
+    """
+    Write segmentation regions of a frame to a compact JSON file, and also to a binary file
+    with SEG_CODEC_FILE_EXT extension next to it if SEG_DATA_STORE_BINARY is set
+    :param regions: list of region dicts in a frame
+    :param json_file_name: local JSON file name with full path to write to
+    :return: list of local file names written
+    """
+    with open(json_file_name, 'w') as json_file:
+        json.dump(regions, json_file, separators=(',', ':'))
+    written = [json_file_name]
+    if settings.SEG_DATA_STORE_BINARY and isinstance(regions, list):
+        seg_file_name = os.path.splitext(json_file_name)[0] + SEG_CODEC_FILE_EXT
+        with open(seg_file_name, 'wb') as seg_file:
+            seg_file.write(encode_frame(regions))
+        written.append(seg_file_name)
+    return written
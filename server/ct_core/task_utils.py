@@ -1,25 +1,29 @@
 import os
-import json
 import shutil
 import errno
+from uuid import uuid4
 
 import matplotlib.pyplot as plt
-from PIL import Image
 
 import numpy as np
 from scipy.spatial import distance
 
 import logging
 
-from irods.session import iRODSSession
 from irods.exception import CollectionDoesNotExist
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django_irods.storage import IrodsStorage
+from django_irods.storage import get_irods_storage
+from django_irods.session_pool import irods_session
 from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Value, IntegerField
 
-from ct_core.models import get_path_by_paras, UserProfile, Segmentation, UserSegmentation
+from ct_core.models import get_path_by_paras, UserProfile, Segmentation, UserSegmentation, \
+    TrackingState, ExperimentInfo, SegmentationRegion
+from ct_core.tracking import centroids_to_bytes, pack_frame_regions, compute_centroids
+from ct_core.seg_codec import write_frame_files
+from ct_core.frame_cache import get_frame_array
 
 frame_no_key = 'frame_no'
 logger = logging.getLogger(__name__)
@@ -53,8 +57,7 @@ def get_exp_frame_no(exp_id):
     :return: total number of frames for an experiment or -1 if the experiment does not exist
     """
     fno = -1
-    with iRODSSession(host=settings.IRODS_HOST, port=settings.IRODS_PORT, user=settings.IRODS_USER,
-                      password=settings.IRODS_PWD, zone=settings.IRODS_ZONE) as session:
+    with irods_session() as session:
         epath = '/' + settings.IRODS_ZONE + '/home/' + settings.IRODS_USER + '/' + str(exp_id)
         try:
             coll = session.collections.get(epath)
@@ -98,6 +101,18 @@ def distance_between_point_sets(xy1, xy2):
     return distance.cdist(xy1, xy2, 'euclidean')
 
 
+def _backup_system_seg_files(istorage, exp_id, fnames):
+    """
+    internal method to back up system segmentation files to bak_ prefixed files before they are
+    overridden by power user edit segmentation data. A binary file is only backed up if it exists
+    since frames synced before binary files were stored only have JSON files
+    """
+    for fname in fnames:
+        src_path = get_path_by_paras(exp_id, fname)
+        if fname.endswith('.json') or istorage.exists(src_path):
+            istorage.copy_file(src_path, get_path_by_paras(exp_id, 'bak_{}'.format(fname)))
+
+
 def sync_seg_data_to_irods(exp_id='', username='', json_data={}, irods_path=''):
     """
     Sync system or user segmentation data from Database to iRODS
@@ -129,23 +144,26 @@ def sync_seg_data_to_irods(exp_id='', username='', json_data={}, irods_path=''):
             return
 
     local_data_file = os.path.join(local_data_path, fname)
-    with open(local_data_file, 'w') as json_file:
-        json.dump(json_data, json_file, indent=2)
+    local_files = write_frame_files(json_data, local_data_file)
 
-    istorage = IrodsStorage()
+    istorage = get_irods_storage()
     istorage.save_file(local_data_file, irods_path, True)
+    for local_file in local_files[1:]:
+        istorage.save_file(local_file, os.path.join(coll_path, os.path.basename(local_file)))
 
     if username:
         try:
             u = User.objects.get(username=username)
             if is_power_user(u):
                 # backup old system data first before overriding it
-                backup_fname = 'bak_{}'.format(fname)
+                _backup_system_seg_files(istorage, exp_id,
+                                         [os.path.basename(f) for f in local_files])
                 src_path = get_path_by_paras(exp_id, fname)
-                tgt_path = get_path_by_paras(exp_id, backup_fname)
-                istorage.copy_file(src_path, tgt_path)
                 # override system ground truth data with user edit segmentation data
                 istorage.save_file(local_data_file, src_path)
+                for local_file in local_files[1:]:
+                    istorage.save_file(local_file,
+                                       get_path_by_paras(exp_id, os.path.basename(local_file)))
         except ObjectDoesNotExist:
             pass
 
@@ -153,6 +171,60 @@ def sync_seg_data_to_irods(exp_id='', username='', json_data={}, irods_path=''):
     return
 
 
+def bulk_sync_seg_data_to_irods(exp_id, username, frame_data):
+    """
+    Sync multiple frames of system or user segmentation data from Database to iRODS in one bulk
+    transfer rather than one frame at a time. Frames are serialized compactly into a staging
+    directory which is then uploaded to iRODS with a single recursive iput
+    :param exp_id: experiment id
+    :param username: requesting username, or empty to sync system segmentation data
+    :param frame_data: dict of json frame data to be serialized and saved to iRODS keyed by
+    frame number
+    :return: None with exceptions recorded in logs if failure
+    """
+    if not frame_data or not exp_id:
+        # nothing to sync
+        return
+
+    irods_coll = os.path.dirname(get_path_by_paras(exp_id, 'frame.json', username))
+    parent_coll, coll_name = os.path.split(irods_coll)
+    stage_path = os.path.join(settings.IRODS_ROOT, exp_id, 'data', 'sync', uuid4().hex)
+    local_coll_path = os.path.join(stage_path, coll_name)
+    try:
+        os.makedirs(local_coll_path)
+    except OSError as ex:
+        logger.error(str(ex))
+        return
+
+    try:
+        local_files = []
+        for frame_no, json_data in frame_data.items():
+            local_data_file = os.path.join(local_coll_path, 'frame{}.json'.format(frame_no))
+            local_files.extend(write_frame_files(json_data, local_data_file))
+
+        istorage = get_irods_storage()
+        istorage.save_dir(local_coll_path, parent_coll)
+
+        if username:
+            try:
+                u = User.objects.get(username=username)
+                if is_power_user(u):
+                    # backup old system data first before overriding it
+                    _backup_system_seg_files(istorage, exp_id,
+                                             [os.path.basename(f) for f in local_files])
+                    # override system ground truth data with user edit segmentation data
+                    sys_coll = os.path.dirname(get_path_by_paras(exp_id, 'frame.json'))
+                    sys_parent_coll, sys_coll_name = os.path.split(sys_coll)
+                    local_sys_coll_path = os.path.join(stage_path, sys_coll_name)
+                    os.rename(local_coll_path, local_sys_coll_path)
+                    istorage.save_dir(local_sys_coll_path, sys_parent_coll)
+            except ObjectDoesNotExist:
+                pass
+    finally:
+        shutil.rmtree(stage_path)
+    return
+
+
 def get_experiment_frame_seg_data(exp_id, frame_no, username=None):
     """
     get segmentation data for a specified frame in a specified experiment. If user is not None, user edit segmentation
@@ -183,6 +255,249 @@ def get_experiment_frame_seg_data(exp_id, frame_no, username=None):
     return seg_obj
 
 
+def iter_experiment_seg_data(exp_id, min_frame_no, max_frame_no, user=None):
+    """
+    iterate over segmentation data for frames in a frame range of an experiment with one query
+    that merges user edit segmentation data over system segmentation data. User edit
+    segmentation data is only used for regular users, while power users directly edit system
+    segmentation data
+    :param exp_id: experiment id
+    :param min_frame_no: the first frame number in the range
+    :param max_frame_no: the last frame number in the range
+    :param user: optional User object to merge user edit segmentation data for
+    :return: generator of (frame_no, data) tuples in frame order, one per frame that has
+    segmentation data
+    """
+    seg_qs = Segmentation.objects.filter(
+        exp_id=exp_id, frame_no__gte=min_frame_no, frame_no__lte=max_frame_no).annotate(
+        is_user=Value(0, output_field=IntegerField())).values_list('frame_no', 'is_user', 'data')
+    if user and not is_power_user(user):
+        user_seg_qs = UserSegmentation.objects.filter(
+            exp_id=exp_id, user=user, frame_no__gte=min_frame_no,
+            frame_no__lte=max_frame_no).annotate(
+            is_user=Value(1, output_field=IntegerField())).values_list('frame_no', 'is_user', 'data')
+        seg_qs = seg_qs.union(user_seg_qs, all=True)
+    # user edit data of a frame comes right after system data of the same frame in this order
+    last_frame_no, last_data = None, None
+    for frame_no, _, data in seg_qs.order_by('frame_no', 'is_user').iterator():
+        if last_frame_no is not None and frame_no != last_frame_no:
+            yield last_frame_no, last_data
+        last_frame_no, last_data = frame_no, data
+    if last_frame_no is not None:
+        yield last_frame_no, last_data
+
+
+def get_tracking_states(exp_id, username, min_frame_no, max_frame_no):
+    """
+    get tracking states kept by add_tracking for frames in a frame range of an experiment
+    :param exp_id: experiment id
+    :param username: username for user edit segmentation data or empty for system segmentation data
+    :param min_frame_no: the first frame number in the range
+    :param max_frame_no: the last frame number in the range
+    :return: dict of TrackingState objects keyed by frame number
+    """
+    states = TrackingState.objects.filter(exp_id=exp_id, username=username,
+                                          frame_no__gte=min_frame_no,
+                                          frame_no__lte=max_frame_no)
+    return {state.frame_no: state for state in states}
+
+
+def set_tracking_state(states, exp_id, username, frame_no, regions_hash, region_ids, centroids,
+                       pre_regions_hash='', linking_method=''):
+    """
+    set the tracking state kept by add_tracking for a frame of an experiment without saving it
+    to DB, creating a new TrackingState object in states if the frame does not have one yet
+    :param states: dict of TrackingState objects keyed by frame number returned from
+    get_tracking_states()
+    :param exp_id: experiment id
+    :param username: username for user edit segmentation data or empty for system segmentation data
+    :param frame_no: frame number
+    :param regions_hash: content hash of the frame regions
+    :param region_ids: list of region ids in the frame
+    :param centroids: 2D numpy array holding centroids of the frame regions
+    :param pre_regions_hash: content hash of the previous frame regions the frame is linked to
+    :param linking_method: linking method used to link the frame to its previous frame
+    :return: the TrackingState object to be saved with save_tracking_states()
+    """
+    state = states.get(frame_no)
+    if not state:
+        state = TrackingState(exp_id=exp_id, username=username, frame_no=frame_no)
+        states[frame_no] = state
+    state.regions_hash = regions_hash
+    state.pre_regions_hash = pre_regions_hash
+    state.linking_method = linking_method
+    state.region_ids = region_ids
+    state.centroids = centroids_to_bytes(centroids)
+    return state
+
+
+def save_tracking_states(state_list, batch_size=None):
+    """
+    save TrackingState objects set by set_tracking_state() to DB in bulk
+    :param state_list: list of TrackingState objects to save
+    :param batch_size: optional number of objects to save in each query
+    :return: None
+    """
+    update_states = [state for state in state_list if state.pk]
+    create_states = [state for state in state_list if not state.pk]
+    if update_states:
+        TrackingState.objects.bulk_update(update_states, ['regions_hash', 'pre_regions_hash',
+                                                          'linking_method', 'region_ids',
+                                                          'centroids'],
+                                          batch_size=batch_size)
+    if create_states:
+        TrackingState.objects.bulk_create(create_states, batch_size=batch_size)
+
+
+def get_region_fields(data):
+    """
+    compute SegmentationRegion field values for all regions in a frame in one batched pass
+    :param data: list of region dicts in a frame
+    :return: list of dicts of SegmentationRegion field values, one per region in region order
+    """
+    if not isinstance(data, list) or not data:
+        return []
+    vertices, counts = pack_frame_regions(data)
+    centroids = compute_centroids(vertices, counts)
+    mins = np.full((counts.shape[0], 2), np.nan)
+    maxs = np.full((counts.shape[0], 2), np.nan)
+    non_empty = counts > 0
+    if vertices.shape[0]:
+        starts = (np.cumsum(counts) - counts)[non_empty]
+        mins[non_empty] = np.minimum.reduceat(vertices, starts, axis=0)
+        maxs[non_empty] = np.maximum.reduceat(vertices, starts, axis=0)
+    # NaN of regions without vertices is stored as null
+    centroids, mins, maxs = ([[None if v != v else v for v in row] for row in a.tolist()]
+                             for a in (centroids, mins, maxs))
+    fields = []
+    for i, region in enumerate(data):
+        fields.append({
+            'region_id': str(region['id']),
+            'link_id': str(region.get('link_id') or ''),
+            'centroid_y': centroids[i][0],
+            'centroid_x': centroids[i][1],
+            'min_y': mins[i][0],
+            'min_x': mins[i][1],
+            'max_y': maxs[i][0],
+            'max_x': maxs[i][1],
+            'num_vertices': int(counts[i]),
+            'edited': str(region.get('edited', False)).lower() == 'true'
+        })
+    return fields
+
+
+def save_seg_regions(exp_id, username, frame_data, batch_size=None):
+    """
+    replace SegmentationRegion rows of frames with rows computed from their region lists. This
+    has to be called in the same transaction as saving the frame data to Segmentation or
+    UserSegmentation so that the region table never gets out of sync with the frame data
+    :param exp_id: experiment id
+    :param username: username for user edit segmentation data or empty for system segmentation data
+    :param frame_data: dict of frame region lists keyed by frame number
+    :param batch_size: optional number of rows to create in each query
+    :return: None
+    """
+    if not frame_data:
+        return
+    SegmentationRegion.objects.filter(exp_id=exp_id, username=username,
+                                      frame_no__in=list(frame_data)).delete()
+    rows = []
+    for frame_no, data in frame_data.items():
+        for idx, fields in enumerate(get_region_fields(data)):
+            rows.append(SegmentationRegion(exp_id=exp_id, username=username, frame_no=frame_no,
+                                           region_index=idx, **fields))
+    if rows:
+        SegmentationRegion.objects.bulk_create(rows, batch_size=batch_size)
+
+
+def get_experiment_seg_data_by_frame(exp_id, min_frame_no, max_frame_no, username=''):
+    """
+    get segmentation data for all frames in a frame range of an experiment in bulk rather than one
+    frame at a time. Like get_experiment_frame_seg_data(), user edit segmentation data is used for
+    frames the user has edited unless the user is a power user, and ground truth segmentation data
+    is used otherwise
+    :param exp_id: experiment id
+    :param min_frame_no: the first frame number in the range
+    :param max_frame_no: the last frame number in the range
+    :param username: optional, user name to retrieve segmentation objects for
+    :return: a tuple of two dicts keyed by frame number, the first holding the segmentation
+    object to read each frame from, and the second holding user edit segmentation objects of
+    the user, which is empty if username is empty
+    """
+    seg_objs = {obj.frame_no: obj for obj in Segmentation.objects.filter(
+        exp_id=exp_id, frame_no__gte=min_frame_no, frame_no__lte=max_frame_no)}
+    user_seg_objs = {}
+    if username:
+        user_seg_objs = {obj.frame_no: obj for obj in UserSegmentation.objects.filter(
+            exp_id=exp_id, user__username=username, frame_no__gte=min_frame_no,
+            frame_no__lte=max_frame_no)}
+        u = User.objects.select_related('user_profile').get(username=username)
+        if not is_power_user(u):
+            seg_objs.update(user_seg_objs)
+    return seg_objs, user_seg_objs
+
+
+def build_frame_index(files_info):
+    """
+    Build the frame image index of an experiment from the listing of its image collection
+    :param files_info: dict of IrodsFileInfo keyed by image name returned from list_files_info()
+    :return: dict with 'gray' and 'color' dicts mapping one-based frame number strings to image
+    names, and a 'files' dict mapping image names to [size, modify time, checksum]
+    """
+    frames = {'gray': {}, 'color': {}}
+    for name in files_info:
+        base, _ = os.path.splitext(name)
+        for variant, prefix in (('color', 'color_frame'), ('gray', 'frame')):
+            frame_str = base[len(prefix):]
+            if base.startswith(prefix) and frame_str.isdigit():
+                # parsing the frame number handles frame image names with or without zero padding
+                frames[variant][int(frame_str)] = name
+                break
+    # image frames in iRODS could start with 0 or 1
+    shift = 1 if 0 in frames['gray'] else 0
+    index = {variant: {str(fno + shift): name for fno, name in frame_dict.items()}
+             for variant, frame_dict in frames.items()}
+    if not index['gray'] and len(files_info) == 1:
+        index['gray']['1'] = next(iter(files_info))
+    index['files'] = {name: list(info) for name, info in files_info.items()}
+    return index
+
+
+def get_frame_index(exp_id, type='jpg'):
+    """
+    Get the frame image index of an experiment, which is built from the iRODS image collection
+    listing and stored in the database on first use
+    :param exp_id: experiment id
+    :param type: image type, jpg or png, with default being jpg
+    :return: ExperimentInfo object of the experiment and the frame index of the image type as
+    returned from build_frame_index()
+    """
+    exp_info = ExperimentInfo.objects.filter(exp_id=exp_id).first()
+    if exp_info and type in exp_info.frame_index:
+        return exp_info, exp_info.frame_index[type]
+
+    istorage = get_irods_storage()
+    files_info = istorage.list_files_info(os.path.join(exp_id, 'data', 'image', type))
+    index = build_frame_index(files_info)
+    if not files_info:
+        # do not store the index of an experiment whose images are not uploaded yet
+        return exp_info, index
+    if not exp_info:
+        exp_info, _ = ExperimentInfo.objects.get_or_create(exp_id=exp_id)
+    exp_info.frame_index[type] = index
+    ExperimentInfo.objects.filter(pk=exp_info.pk).update(frame_index=exp_info.frame_index)
+    return exp_info, index
+
+
+def invalidate_frame_index(exp_id):
+    """
+    Reset the frame image index of an experiment after its image frames are uploaded or
+    recolored so that it is rebuilt on next use
+    :param exp_id: experiment id
+    """
+    ExperimentInfo.objects.filter(exp_id=exp_id).update(frame_index={})
+
+
 def apply_colormap_to_experiment(exp_id, colormap, type='jpg'):
     image_path = os.path.join(settings.IRODS_ROOT, exp_id, 'image')
     try:
@@ -191,7 +506,7 @@ def apply_colormap_to_experiment(exp_id, colormap, type='jpg'):
     except OSError:
         # path already exists
         pass
-    istorage = IrodsStorage()
+    istorage = get_irods_storage()
     irods_img_path = os.path.join(exp_id, 'data', 'image', type)
     file_list = istorage.listdir(irods_img_path)[1]
     for img_name in file_list:
@@ -200,10 +515,10 @@ def apply_colormap_to_experiment(exp_id, colormap, type='jpg'):
             ifile = os.path.join(dest_path, img_name)
             if os.path.isfile(ifile):
                 # convert colormap to image
-                img_src = Image.open(ifile)
-                im = np.array(img_src)
+                im = get_frame_array(ifile)
                 color_img_name = 'color_{}'.format(img_name)
                 color_img_path = os.path.join(dest_path, color_img_name)
                 plt.imsave(color_img_path, im, cmap=colormap)
                 # save to iRODS
                 istorage.save_file(color_img_path, os.path.join(irods_img_path, color_img_name))
+    invalidate_frame_index(exp_id)
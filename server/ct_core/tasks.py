@@ -1,29 +1,46 @@
+import datetime
 import logging
-import numpy as np
+from collections import defaultdict
 
 from celery import shared_task
 
 from django.core.exceptions import ObjectDoesNotExist
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
 from django.contrib.auth.models import User
 from django.utils import timezone
 
-from ct_core.models import UserSegmentation, Segmentation, get_path
-from ct_core.task_utils  import get_exp_frame_no, find_centroid, distance_between_point_sets, \
-    sync_seg_data_to_irods, validate_user, get_experiment_frame_seg_data, apply_colormap_to_experiment
+from ct_core.models import UserSegmentation, Segmentation, ExperimentInfo, UserProfile, \
+    PendingRegionScore, get_path
+from ct_core.task_utils  import get_exp_frame_no, sync_seg_data_to_irods, validate_user, \
+    bulk_sync_seg_data_to_irods, \
+    get_experiment_seg_data_by_frame, apply_colormap_to_experiment, get_tracking_states, \
+    set_tracking_state, save_tracking_states, save_seg_regions
+from ct_core.utils import get_exp_image, get_time_series_export_key, get_time_series_export_dir, \
+    get_time_series_export_files, is_time_series_export_cached, compute_time_series_and_put_in_irods, \
+    validate_time_series_options
+from ct_core.time_series import WIDE_LAYOUT, CSV_FORMAT
+from ct_core.tracking import get_frame_centroids, link_frames, compute_regions_hash, \
+    centroids_from_bytes, NEAREST_LINKING
+from scoring_module import get_edit_scores
 
 
 logger = logging.getLogger('django')
 
 
 @shared_task
-def add_tracking(exp_id, username='', frm_idx=-1):
+def add_tracking(exp_id, username='', frm_idx=-1, force=False):
     """
-    Add tracking to segmentation data for an experiment
+    Add tracking to segmentation data for an experiment. Only frame pairs of which either frame
+    has changed since they were last linked are re-linked unless force is True
     :param exp_id: experiment id
     :param username: Empty by default. If Empty, add tracking to system segmentation data;
     otherwise, add tracking to user edit segmentation data
     :param frm_idx: -1 by default. If -1, add tracking to all frames; otherwise,
     add tracking to only the pass-in frm_idx which is one-based frame index
+    :param force: False by default. If True, re-link all frame pairs regardless of whether they
+    have changed or not
     :return:
     """
     ret_result = []
@@ -40,54 +57,79 @@ def add_tracking(exp_id, username='', frm_idx=-1):
                        + username)
         return ret_result
 
+    exp_info = ExperimentInfo.objects.filter(exp_id=exp_id).first()
+    linking_method = exp_info.linking_method if exp_info else NEAREST_LINKING
+
     centroids_xy = {}
     ids = {}
+    hashes = {}
     min_f = 0
     max_f = fno
     if frm_idx >= 1 and frm_idx <= fno:
         min_f = frm_idx - 2 if frm_idx > 1 else frm_idx - 1
         max_f = frm_idx + 1 if frm_idx < fno else fno
 
+    # load all frames in the frame range with one query for system segmentation data and
+    # one query for user edit segmentation data
+    seg_objs, user_seg_objs = get_experiment_seg_data_by_frame(exp_id, min_f + 1, max_f,
+                                                               username=username)
+    states = get_tracking_states(exp_id, username, min_f + 1, max_f)
     for i in range(max_f, min_f, -1):
-        seg_obj = get_experiment_frame_seg_data(exp_id, i, username=username)
-        data = seg_obj.data
-        centroid_list = []
-        id_list = []
-        for region in data:
-            id = region['id']
-            vertices = region['vertices']
-            # create numpy array from vertices
-            ary_vertices = np.array(vertices)
-            x, y = find_centroid(ary_vertices)
-            centroid_list.append([x, y])
-            id_list.append(id)
-        centroids_xy[i] = np.array(centroid_list)
-        ids[i] = id_list
-
-    # compute minimum distance from a centroid to all centroids in the previous frame
+        data = seg_objs[i].data
+        hashes[i] = compute_regions_hash(data)
+        state = states.get(i)
+        if state and state.regions_hash == hashes[i]:
+            # regions in the frame have not changed, so reuse centroids computed last time
+            centroids_xy[i] = centroids_from_bytes(state.centroids)
+            ids[i] = state.region_ids
+        else:
+            # compute centroids of all regions in the frame in one batch
+            centroids_xy[i] = get_frame_centroids(data)
+            ids[i] = [region['id'] for region in data]
+
+    user = User.objects.get(username=username) if username else None
+    # objects to be written back to DB in bulk
+    changed_states = []
+    update_objs = []
+    create_objs = []
+
+    if min_f == 0 and (1 not in states or states[1].regions_hash != hashes[1]):
+        # the first frame is not linked to any frame, so its state only caches its centroids
+        changed_states.append(set_tracking_state(states, exp_id, username, 1, hashes[1], ids[1],
+                                                 centroids_xy[1]))
+
+    # link each centroid to a centroid in the previous frame
     for fi in range(max_f, min_f+1, -1):
+        state = states.get(fi)
+        if not force and state and state.regions_hash == hashes[fi] and \
+                state.pre_regions_hash == hashes[fi - 1] and \
+                state.linking_method == linking_method:
+            # neither frame in this frame pair has changed since they were last linked
+            continue
         if username:
-            try:
-                seg_obj = UserSegmentation.objects.get(exp_id=exp_id, user__username=username,
-                                                       frame_no=fi)
-            except ObjectDoesNotExist:
-                # check system Segmentation if the frame of user segmentation does not exist,
-                # and create a UserSegmentation object for the frame using the data of the frame
+            seg_obj = user_seg_objs.get(fi)
+            if seg_obj:
+                update_objs.append(seg_obj)
+            else:
+                # create a UserSegmentation object for the frame using the data of the frame
                 # on the system segmentation data since the link_id field of some regions could be
                 # updated as a result of region updates of the next frame
-                sys_seg_obj = Segmentation.objects.get(exp_id=exp_id, frame_no=fi)
-                seg_obj = UserSegmentation(user=User.objects.get(username=username),
+                seg_obj = UserSegmentation(user=user,
                                            exp_id=exp_id, frame_no=fi,
-                                           data=sys_seg_obj.data,
+                                           data=seg_objs[fi].data,
                                            num_edited=0,
                                            update_time=timezone.now())
                 rel_path = get_path(seg_obj)
                 seg_obj.file = rel_path
+                create_objs.append(seg_obj)
         else:
-            seg_obj = Segmentation.objects.get(exp_id=exp_id, frame_no=fi)
+            seg_obj = seg_objs[fi]
+            update_objs.append(seg_obj)
         if frm_idx >= 0:
             return_regions = []
         pre_frm = fi - 1
+        linked_idx = link_frames(centroids_xy[fi], centroids_xy[pre_frm], method=linking_method,
+                                 max_distance=settings.TRACKING_ASSIGNMENT_MAX_DISTANCE)
         for cur_re in range(0, centroids_xy[fi].shape[0]):
             if username and frm_idx > 0:
                 if 'manual_link' in seg_obj.data[cur_re] and 'link_id' in seg_obj.data[cur_re]:
@@ -95,56 +137,69 @@ def add_tracking(exp_id, username='', frm_idx=-1):
                     if ml_flag == 'true':
                         # skip automatic tracking update since it is manually updated by user
                         continue
-            # xy1 contains centroid x, y for one region on frame fi
-            xy1 = np.array([centroids_xy[fi][cur_re]])
-            # xy2 contains all centroids for all regions on the previous frame
-            xy2 = centroids_xy[pre_frm]
-            min_idx = np.argmin(distance_between_point_sets(xy1, xy2))
-            linked_id = ids[pre_frm][min_idx]
+            if linked_idx[cur_re] < 0:
+                # no region in the previous frame to link to, i.e., a new cell appears
+                seg_obj.data[cur_re].pop('link_id', None)
+                continue
+            linked_id = ids[pre_frm][linked_idx[cur_re]]
             seg_obj.data[cur_re]['link_id'] = linked_id
             if username and frm_idx > 0:
                 return_regions.append({'id': ids[fi][cur_re],
                                        'link_id': linked_id})
-        seg_obj.save()
+        changed_states.append(set_tracking_state(states, exp_id, username, fi, hashes[fi],
+                                                 ids[fi], centroids_xy[fi],
+                                                 pre_regions_hash=hashes[pre_frm],
+                                                 linking_method=linking_method))
         if username and frm_idx > 0:
             ret_result.append({'frame_no': fi+1,
                                'region_ids': return_regions})
-        # update iRODS data to be in sync with updated data in DB
-        rel_path = get_path(seg_obj)
-        if username:
-            sync_seg_data_to_irods(exp_id=exp_id, username=username, json_data=seg_obj.data,
-                                   irods_path=rel_path)
-        else:
-            sync_seg_data_to_irods(exp_id=exp_id, username='system', json_data=seg_obj.data,
-                                   irods_path=rel_path)
 
+    sync_first_frame = False
     if frm_idx == -1 or frm_idx == 1:
         # this block will be run for migration of old data or sync segmentation data to irods for
         # the first frame that does not have tracking data. For the former, need to
         # remove link_id data if any for the first frame due to the linkage direction change from
         # forward to backward linkages
-        seg_obj = get_experiment_frame_seg_data(exp_id, 1, username=username)
-        changed = False
-        data = seg_obj.data
+        seg_obj = seg_objs[1]
         if frm_idx == -1:
-            for region in data:
+            for region in seg_obj.data:
                 if 'link_id' in region:
                     region.pop('link_id')
-                    changed = True
-            if changed:
-                seg_obj.save()
+                    sync_first_frame = True
+            if sync_first_frame and seg_obj not in update_objs:
+                update_objs.append(seg_obj)
         else:
-            changed = True
-
-        if changed:
-            # update iRODS data to be in sync with updated data in DB
-            rel_path = get_path(seg_obj)
-            if username:
-                sync_seg_data_to_irods(exp_id=exp_id, username=username, json_data=seg_obj.data,
-                                       irods_path=rel_path)
-            else:
-                sync_seg_data_to_irods(exp_id=exp_id, username='system', json_data=seg_obj.data,
-                                       irods_path=rel_path)
+            sync_first_frame = True
+
+    # write all changes back to DB in batches in one transaction
+    batch_size = settings.TRACKING_DB_BATCH_SIZE
+    with transaction.atomic():
+        for model in (Segmentation, UserSegmentation):
+            model_objs = [obj for obj in update_objs if isinstance(obj, model)]
+            if model_objs:
+                model.objects.bulk_update(model_objs, ['data'], batch_size=batch_size)
+        if create_objs:
+            UserSegmentation.objects.bulk_create(create_objs, batch_size=batch_size)
+        # link_id of regions in updated frames could have changed
+        for model, uname in ((Segmentation, ''), (UserSegmentation, username)):
+            save_seg_regions(exp_id, uname,
+                             {obj.frame_no: obj.data for obj in update_objs + create_objs
+                              if isinstance(obj, model)})
+        save_tracking_states(changed_states, batch_size=batch_size)
+
+    # update iRODS data to be in sync with updated data in DB in bulk once the DB changes are
+    # committed, which is deferred to another task so that tracking can return right away
+    sync_objs = update_objs + create_objs
+    if sync_first_frame and seg_objs[1] not in sync_objs:
+        sync_objs.append(seg_objs[1])
+    sys_frames = sorted(obj.frame_no for obj in sync_objs if isinstance(obj, Segmentation))
+    user_frames = sorted(obj.frame_no for obj in sync_objs if isinstance(obj, UserSegmentation))
+    if sys_frames:
+        transaction.on_commit(lambda: sync_seg_data_frames_to_irods.apply_async(
+            (exp_id, '', sys_frames), countdown=1))
+    if user_frames:
+        transaction.on_commit(lambda: sync_seg_data_frames_to_irods.apply_async(
+            (exp_id, username, user_frames), countdown=1))
     return ret_result
 
 
@@ -172,6 +227,135 @@ def sync_user_edit_frame_from_db_to_irods(exp_id, username, frm_idx):
     return
 
 
+@shared_task
+def sync_seg_data_frames_to_irods(exp_id, username, frame_nos):
+    """
+    Sync multiple system or user edit frames for an experiment from DB to iRODS in one bulk
+    transfer
+    :param exp_id: experiment id
+    :param username: user to sync edit segmentation data for, or empty to sync system
+    segmentation data
+    :param frame_nos: list of one-based frame indices in the experiment to sync
+    :return:
+    """
+    username = str(username)
+    if username:
+        seg_objs = UserSegmentation.objects.filter(exp_id=exp_id, user__username=username,
+                                                   frame_no__in=frame_nos)
+    else:
+        seg_objs = Segmentation.objects.filter(exp_id=exp_id, frame_no__in=frame_nos)
+    frame_data = {obj.frame_no: obj.data for obj in seg_objs}
+    if len(frame_data) < len(frame_nos):
+        logger.error('Not all frames {} exist in DB to sync to iRODS for experiment {} user '
+                     '{}'.format(frame_nos, exp_id, username))
+    bulk_sync_seg_data_to_irods(exp_id, username, frame_data)
+    return
+
+
 @shared_task
 def apply_colormap_to_exp_task(exp_id, colormap):
     apply_colormap_to_experiment(exp_id, colormap)
+
+
+@shared_task
+def score_pending_regions():
+    """
+    Score pending edited regions saved by users when scoring is asynchronous and add the scores
+    to user scores. Pending regions are claimed in a short transaction, in which rows being
+    claimed by another run of this task are skipped and claims older than
+    SCORE_ASYNC_CLAIM_SECONDS are taken over, and are then scored without holding row locks.
+    Pending regions of all users in the same frame are scored in one batch with one frame image
+    read. Scored regions are deleted in the same transaction in which each user score is
+    incremented with one atomic update, so that they are pending until their scores are visible.
+    Regions of a frame that cannot be scored stay claimed to be retried once their claim expires,
+    and are dropped after SCORE_ASYNC_MAX_ATTEMPTS claims. The task enqueues itself again if more
+    pending regions are left after claiming SCORE_ASYNC_BATCH_SIZE regions
+    :return: dict of score deltas keyed by user id
+    """
+    claim_time = timezone.now()
+    with transaction.atomic():
+        expired_time = claim_time - datetime.timedelta(seconds=settings.SCORE_ASYNC_CLAIM_SECONDS)
+        pending = list(PendingRegionScore.objects.select_for_update(skip_locked=True).filter(
+            Q(claimed_time__isnull=True) | Q(claimed_time__lt=expired_time)).order_by(
+            'id')[:settings.SCORE_ASYNC_BATCH_SIZE])
+        if not pending:
+            return {}
+        PendingRegionScore.objects.filter(id__in=[obj.id for obj in pending]).update(
+            claimed_time=claim_time, attempts=F('attempts') + 1)
+
+    frames = defaultdict(list)
+    for obj in pending:
+        frames[(obj.exp_id, obj.frame_no)].append(obj)
+    scored = []
+    dropped = []
+    retry = False
+    for (exp_id, frame_no), objs in frames.items():
+        try:
+            img_file, err_msg = get_exp_image(exp_id, frame_no)
+            if not err_msg:
+                scores, err_msg = get_edit_scores(img_file, [obj.vertices for obj in objs])
+        except Exception as ex:
+            err_msg = str(ex)
+        if err_msg:
+            logger.error('Cannot score {} pending regions in experiment {} frame {}: '
+                         '{}'.format(len(objs), exp_id, frame_no, err_msg))
+            for obj in objs:
+                if obj.attempts + 1 >= settings.SCORE_ASYNC_MAX_ATTEMPTS:
+                    dropped.append(obj)
+                else:
+                    retry = True
+            continue
+        scored.extend(zip(objs, scores))
+
+    deltas = defaultdict(int)
+    with transaction.atomic():
+        # regions whose claim has expired and been taken over by another run are left to it
+        claimed_ids = set(PendingRegionScore.objects.select_for_update().filter(
+            id__in=[obj.id for obj in pending], claimed_time=claim_time).values_list(
+            'id', flat=True))
+        for obj, score in scored:
+            if obj.id in claimed_ids:
+                deltas[obj.user_id] += score
+        for user_id, delta in deltas.items():
+            UserProfile.objects.filter(user_id=user_id).update(score=F('score') + delta)
+        done_ids = [obj.id for obj, _ in scored] + [obj.id for obj in dropped]
+        PendingRegionScore.objects.filter(id__in=claimed_ids.intersection(done_ids)).delete()
+
+    if len(pending) >= settings.SCORE_ASYNC_BATCH_SIZE:
+        score_pending_regions.apply_async()
+    if retry:
+        score_pending_regions.apply_async(countdown=settings.SCORE_ASYNC_CLAIM_SECONDS)
+    return dict(deltas)
+
+
+@shared_task
+def export_time_series(exp_id, username='', features=('mean',), layout=WIDE_LAYOUT,
+                       output_format=CSV_FORMAT):
+    """
+    Export time series of an experiment to the time series export cache in iRODS keyed by the
+    segmentation state it is computed from, which is skipped if the export is cached already
+    :param exp_id: experiment id
+    :param username: Empty by default. If Empty, use system segmentation tracking data;
+    otherwise, use user edit segmentation tracking data
+    :param features: features in TIME_SERIES_FEATURES to output for each cell
+    :param layout: WIDE_LAYOUT or LONG_LAYOUT
+    :param output_format: one of TIME_SERIES_FORMATS
+    :return: dict with 'export_key' and 'files' list of exported file names to download the
+    export with, or with 'error' message if time series cannot be exported
+    """
+    username = str(username)
+    err_msg = validate_time_series_options(username, features, layout, output_format)
+    if err_msg:
+        return {'error': err_msg}
+    export_key = get_time_series_export_key(exp_id, username, features, layout, output_format)
+    if not is_time_series_export_cached(exp_id, export_key, layout, output_format):
+        # celery worker processes are daemonic and cannot start a process pool, so frames are
+        # measured in the worker process itself
+        err_msg = compute_time_series_and_put_in_irods(
+            exp_id, username, features, workers=1, layout=layout, output_format=output_format,
+            irods_dir=get_time_series_export_dir(exp_id, export_key))
+        if err_msg:
+            logger.error('Cannot export time series for experiment {} user {}: {}'.format(
+                exp_id, username, err_msg))
+            return {'error': err_msg}
+    return {'export_key': export_key, 'files': get_time_series_export_files(layout, output_format)}
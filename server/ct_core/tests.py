@@ -1,6 +1,1502 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.test import TestCase
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
 
-# Create your tests here.
+from collections import OrderedDict
+from contextlib import contextmanager
+from unittest import mock, skipIf
+
+import numpy as np
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from ct_core import image_cache
+from ct_core.image_cache import get_cached_image, get_cache_stats
+from ct_core.frame_cache import get_frame_array, clear_frame_cache, get_frame_cache_stats, \
+    write_frame_stack, load_frame_stack, decode_frame_image, GRAY_MODE, LUMINANCE_MODE
+from ct_core.seg_codec import encode_frame, decode_frame, SEG_CODEC_CONTENT_TYPE
+from ct_core.time_series import measure_frame_regions, rasterize_frame_regions, LineageBuilder, \
+    open_time_series_writer, write_wide_time_series, pyarrow
+from ct_core.management.commands.check_for_invalid_linked_ids import get_invalid_linked_regions
+from ct_core.models import Segmentation, UserSegmentation, UserProfile, ExperimentInfo, \
+    SegmentationRegion, ExperimentLock, PendingRegionScore
+from ct_core.tasks import add_tracking, score_pending_regions, export_time_series
+from ct_core.task_utils import build_frame_index, get_frame_index, invalidate_frame_index, \
+    get_region_fields, find_centroid, distance_between_point_sets, sync_seg_data_to_irods, \
+    bulk_sync_seg_data_to_irods, save_seg_regions
+from ct_core.tracking import pack_frame_regions, compute_centroids, get_frame_centroids, \
+    link_to_nearest, link_by_assignment, link_frames, _link_component, ASSIGNMENT_LINKING
+from ct_core.utils import save_user_seg_data_to_db, get_frame_info, get_start_frame, \
+    get_edited_frames, get_all_edit_users, is_exp_locked, lock_experiment, release_locks_by_user, \
+    measure_time_series_frames, compute_time_series_and_put_in_irods, get_time_series_export_key
+from django_irods.client_storage import IrodsClientStorage
+from django_irods.icommands import SessionException
+from django_irods.session_pool import SessionPool
+from django_irods.storage import IrodsFileInfo
+from irods.exception import CollectionDoesNotExist, DataObjectDoesNotExist
+from irods.models import Collection
+from scoring_module import _create_mask_overlay_stack
+from scoring_module.registry import ModelRegistry
+
+
+def _create_frame_data(frame_no, cells=3):
+    """
+    create segmentation data for a frame with square cells drifting slowly from frame to frame
+    """
+    data = []
+    for cno in range(cells):
+        y = 0.1 + 0.2 * cno + 0.001 * frame_no
+        x = 0.5
+        data.append({'id': 'object{}'.format(cno + 1),
+                     'vertices': [[y, x], [y + 0.05, x], [y + 0.05, x + 0.05], [y, x + 0.05]]})
+    return data
+
+
+class AddTrackingQueryCountTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('trackuser', password='trackuser')
+        UserProfile.objects.create(user=self.user)
+
+    def _create_experiment(self, exp_id, frames):
+        Segmentation.objects.bulk_create([
+            Segmentation(exp_id=exp_id, frame_no=fno, data=_create_frame_data(fno))
+            for fno in range(1, frames + 1)])
+
+    def _count_tracking_queries(self, exp_id, frames, username=''):
+        with mock.patch('ct_core.tasks.get_exp_frame_no', return_value=frames), \
+                mock.patch('ct_core.tasks.sync_seg_data_frames_to_irods'):
+            with CaptureQueriesContext(connection) as ctx:
+                add_tracking(exp_id, username=username)
+        return len(ctx.captured_queries)
+
+    def _track_and_capture_sync(self, exp_id, frames, username=''):
+        # run on_commit callbacks right away since the test case transaction is never committed
+        with mock.patch('ct_core.tasks.get_exp_frame_no', return_value=frames), \
+                mock.patch('ct_core.tasks.transaction.on_commit', side_effect=lambda func: func()), \
+                mock.patch('ct_core.tasks.sync_seg_data_frames_to_irods') as sync_mock:
+            add_tracking(exp_id, username=username)
+        return [c[0][0] for c in sync_mock.apply_async.call_args_list]
+
+    @override_settings(TRACKING_DB_BATCH_SIZE=100)
+    def test_system_tracking_query_count_does_not_grow_with_frames(self):
+        self._create_experiment('small_exp', 5)
+        self._create_experiment('large_exp', 50)
+        small_cnt = self._count_tracking_queries('small_exp', 5)
+        large_cnt = self._count_tracking_queries('large_exp', 50)
+        self.assertEqual(small_cnt, large_cnt)
+        seg_obj = Segmentation.objects.get(exp_id='large_exp', frame_no=50)
+        for region in seg_obj.data:
+            self.assertEqual(region['link_id'], region['id'])
+
+    @override_settings(TRACKING_DB_BATCH_SIZE=10)
+    def test_system_tracking_query_count_grows_per_batch(self):
+        self._create_experiment('small_exp', 5)
+        self._create_experiment('large_exp', 50)
+        small_cnt = self._count_tracking_queries('small_exp', 5)
+        large_cnt = self._count_tracking_queries('large_exp', 50)
+        # 49 linked frames and 50 tracking states are written in 5 batches each rather than in
+        # one batch each for the small experiment
+        self.assertEqual(large_cnt - small_cnt, 8)
+
+    @override_settings(TRACKING_DB_BATCH_SIZE=100)
+    def test_user_tracking_query_count_does_not_grow_with_frames(self):
+        self._create_experiment('small_exp', 5)
+        self._create_experiment('large_exp', 50)
+        small_cnt = self._count_tracking_queries('small_exp', 5, username='trackuser')
+        large_cnt = self._count_tracking_queries('large_exp', 50, username='trackuser')
+        self.assertEqual(small_cnt, large_cnt)
+        self.assertEqual(UserSegmentation.objects.filter(exp_id='large_exp',
+                                                         user=self.user).count(), 49)
+
+    @override_settings(TRACKING_DB_BATCH_SIZE=100)
+    def test_tracking_syncs_frames_to_irods_in_one_task(self):
+        self._create_experiment('exp', 20)
+        # the first frame has no link to update, so it is only synced if a stale link is removed
+        self.assertEqual(self._track_and_capture_sync('exp', 20),
+                         [('exp', '', list(range(2, 21)))])
+        self.assertEqual(self._track_and_capture_sync('exp', 20, username='trackuser'),
+                         [('exp', 'trackuser', list(range(2, 21)))])
+
+    @override_settings(TRACKING_DB_BATCH_SIZE=100)
+    def test_tracking_syncs_first_frame_with_stale_links(self):
+        self._create_experiment('exp', 20)
+        Segmentation.objects.filter(exp_id='exp', frame_no=1).update(data=[
+            dict(region, link_id=region['id']) for region in _create_frame_data(1)])
+        self.assertEqual(self._track_and_capture_sync('exp', 20),
+                         [('exp', '', list(range(1, 21)))])
+        self.assertNotIn('link_id', Segmentation.objects.get(exp_id='exp', frame_no=1).data[0])
+
+    @override_settings(TRACKING_DB_BATCH_SIZE=100)
+    def test_unchanged_frames_are_not_written_again(self):
+        self._create_experiment('exp', 20)
+        self._count_tracking_queries('exp', 20)
+        with mock.patch('ct_core.tasks.get_exp_frame_no', return_value=20), \
+                mock.patch('ct_core.tasks.transaction.on_commit', side_effect=lambda func: func()), \
+                mock.patch('ct_core.tasks.sync_seg_data_frames_to_irods') as sync_mock:
+            with CaptureQueriesContext(connection) as ctx:
+                add_tracking('exp')
+        self.assertFalse(sync_mock.apply_async.called)
+        self.assertFalse([q for q in ctx.captured_queries
+                          if q['sql'].startswith(('UPDATE', 'INSERT'))])
+
+
+class VectorizedTrackingTestCase(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.frames = []
+        for _ in range(2):
+            regions = []
+            for cno in range(8):
+                center = rng.uniform(0.1, 0.9, 2)
+                vertices = center + rng.uniform(-0.05, 0.05, (rng.randint(3, 9), 2))
+                regions.append({'id': 'object{}'.format(cno + 1), 'vertices': vertices.tolist()})
+            self.frames.append(regions)
+        # a region without vertices in the current frame
+        self.frames[1].insert(3, {'id': 'empty', 'vertices': []})
+
+    def test_centroids_match_per_region_centroids(self):
+        for regions in self.frames:
+            vertices, counts = pack_frame_regions(regions)
+            self.assertEqual(counts.tolist(), [len(region['vertices']) for region in regions])
+            self.assertEqual(vertices.shape, (counts.sum(), 2))
+            centroids = compute_centroids(vertices, counts)
+            for region, centroid in zip(regions, centroids):
+                if region['vertices']:
+                    np.testing.assert_allclose(centroid,
+                                               find_centroid(np.array(region['vertices'])))
+                else:
+                    self.assertTrue(np.isnan(centroid).all())
+
+    def test_nearest_links_match_per_region_links(self):
+        pre_centroids = get_frame_centroids(self.frames[0])
+        cur_centroids = get_frame_centroids(self.frames[1])
+        linked_idx = link_to_nearest(cur_centroids, pre_centroids)
+        for cur_re, region in enumerate(self.frames[1]):
+            if region['vertices']:
+                xy1 = np.array([find_centroid(np.array(region['vertices']))])
+                self.assertEqual(linked_idx[cur_re],
+                                 np.argmin(distance_between_point_sets(xy1, pre_centroids)))
+            else:
+                # a region without vertices has no centroid to link
+                self.assertEqual(linked_idx[cur_re], -1)
+
+    def test_empty_frames(self):
+        vertices, counts = pack_frame_regions([])
+        self.assertEqual(compute_centroids(vertices, counts).shape, (0, 2))
+        centroids = get_frame_centroids(self.frames[0])
+        self.assertEqual(link_to_nearest(centroids, np.empty((0, 2))).tolist(), [-1] * 8)
+        self.assertEqual(link_to_nearest(np.empty((0, 2)), centroids).tolist(), [])
+
+
+class AssignmentLinkingTestCase(SimpleTestCase):
+    def test_children_compete_for_one_parent(self):
+        linked_idx = link_by_assignment(np.array([[0.0, 1.0], [0.0, 2.0]]), np.array([[0.0, 0.0]]),
+                                        max_distance=5)
+        # the nearer child takes the parent and the other one is a birth
+        self.assertEqual(linked_idx.tolist(), [0, -1])
+
+    def test_links_are_one_to_one(self):
+        cur = np.array([[0.0, 1.0], [0.0, 1.4]])
+        pre = np.array([[0.0, 0.0], [0.0, 3.0]])
+        # both regions are nearest to the first previous region
+        self.assertEqual(link_to_nearest(cur, pre).tolist(), [0, 0])
+        self.assertEqual(link_by_assignment(cur, pre, max_distance=5).tolist(), [0, 1])
+        self.assertEqual(link_frames(cur, pre, ASSIGNMENT_LINKING, 5).tolist(), [0, 1])
+
+    def test_regions_beyond_max_distance_are_not_linked(self):
+        cur = np.array([[0.0, 0.5], [10.0, 10.0]])
+        pre = np.array([[0.0, 0.0], [20.0, 20.0]])
+        self.assertEqual(link_by_assignment(cur, pre, max_distance=5).tolist(), [0, -1])
+
+    def test_components_are_linked_independently(self):
+        cur = np.array([[100.0, 101.0], [0.0, 1.0], [100.0, 102.0], [0.0, 1.4]])
+        pre = np.array([[0.0, 0.0], [100.0, 100.0], [0.0, 3.0], [100.0, 103.5]])
+        self.assertEqual(link_by_assignment(cur, pre, max_distance=5).tolist(), [1, 0, 3, 2])
+
+    def test_global_assignment_maximizes_links(self):
+        # greedily taking the shortest link leaves the second current and previous regions
+        # unlinked, while the assignment links both pairs at a lower total cost
+        linked_cur, linked_pre = _link_component(
+            np.array([0, 1]), np.array([0, 1]), np.array([0, 0, 1]), np.array([0, 1, 0]),
+            np.array([1.0, 1.4, 1.4]), max_distance=1.5)
+        self.assertEqual(sorted(zip(linked_cur.tolist(), linked_pre.tolist())), [(0, 1), (1, 0)])
+
+    def test_nan_and_empty_centroids(self):
+        cur = np.array([[np.nan, np.nan], [0.0, 1.0]])
+        pre = np.array([[0.0, 0.0], [np.nan, np.nan]])
+        self.assertEqual(link_by_assignment(cur, pre, max_distance=5).tolist(), [-1, 0])
+        self.assertEqual(link_by_assignment(cur, np.full((2, 2), np.nan), 5).tolist(), [-1, -1])
+        self.assertEqual(link_by_assignment(cur, np.empty((0, 2)), 5).tolist(), [-1, -1])
+        self.assertEqual(link_by_assignment(np.empty((0, 2)), pre, 5).tolist(), [])
+
+
+class FakePooledSession(object):
+    def __init__(self):
+        self.healthy = True
+        self.cleaned_up = False
+
+    def cleanup(self):
+        self.cleaned_up = True
+
+
+def _check_fake_session(session):
+    if not session.healthy:
+        raise Exception('connection reset')
+
+
+class SessionPoolTestCase(SimpleTestCase):
+    def _create_pool(self, size=2, timeout=0.05, health_check_interval=0):
+        return SessionPool(size, timeout, health_check_interval,
+                           session_factory=FakePooledSession,
+                           session_checker=_check_fake_session)
+
+    def test_sessions_are_reused(self):
+        pool = self._create_pool()
+        with pool.session() as s1:
+            pass
+        with pool.session() as s2:
+            pass
+        self.assertIs(s1, s2)
+        metrics = pool.get_metrics()
+        self.assertEqual(metrics['checkouts'], 2)
+        self.assertEqual(metrics['created'], 1)
+        self.assertEqual(metrics['idle'], 1)
+
+    def test_failed_session_is_reconnected(self):
+        pool = self._create_pool()
+        with pool.session() as s1:
+            s1.healthy = False
+        with pool.session() as s2:
+            pass
+        self.assertIsNot(s1, s2)
+        self.assertTrue(s1.cleaned_up)
+        self.assertEqual(pool.get_metrics()['reconnects'], 1)
+
+    def test_checkout_times_out_when_pool_is_exhausted(self):
+        pool = self._create_pool(size=1)
+        session = pool.checkout()
+        with self.assertRaises(RuntimeError):
+            pool.checkout()
+        pool.checkin(session)
+        with pool.session() as s:
+            self.assertIs(s, session)
+        metrics = pool.get_metrics()
+        self.assertEqual(metrics['timeouts'], 1)
+        self.assertEqual(metrics['in_use'], 0)
+
+
+class FakeDataObject(object):
+    def __init__(self, server, path):
+        self.server = server
+        self.path = path
+        self.name = path.rsplit('/', 1)[1]
+        self.size = len(server.data[path])
+        self.modify_time = datetime.datetime(2020, 1, 1)
+        self.checksum = None
+
+    @contextmanager
+    def open(self, mode='r'):
+        if mode == 'r':
+            yield io.BytesIO(self.server.data[self.path])
+        else:
+            buf = io.BytesIO()
+            yield buf
+            self.server.data[self.path] = buf.getvalue()
+
+
+class FakeCollection(object):
+    def __init__(self, server, path):
+        self.server = server
+        self.path = path
+        self.name = path.rsplit('/', 1)[1]
+
+    @property
+    def data_objects(self):
+        return [FakeDataObject(self.server, p) for p in sorted(self.server.data)
+                if p.rsplit('/', 1)[0] == self.path]
+
+    @property
+    def subcollections(self):
+        return [FakeCollection(self.server, p) for p in sorted(self.server.colls)
+                if p.rsplit('/', 1)[0] == self.path]
+
+
+class FakeCollectionManager(object):
+    def __init__(self, server):
+        self.server = server
+
+    def exists(self, path):
+        return path in self.server.colls
+
+    def get(self, path):
+        if path not in self.server.colls:
+            raise CollectionDoesNotExist()
+        return FakeCollection(self.server, path)
+
+    def create(self, path, recurse=False):
+        while path and path not in self.server.colls:
+            self.server.colls.add(path)
+            path = path.rsplit('/', 1)[0]
+
+    def remove(self, path, recurse=False, force=False):
+        self.server.colls = {p for p in self.server.colls
+                             if p != path and not p.startswith(path + '/')}
+        self.server.data = {p: d for p, d in self.server.data.items()
+                            if not p.startswith(path + '/')}
+
+
+class FakeDataObjectManager(object):
+    def __init__(self, server):
+        self.server = server
+
+    def exists(self, path):
+        return path in self.server.data
+
+    def get(self, path):
+        if path not in self.server.data:
+            raise DataObjectDoesNotExist()
+        return FakeDataObject(self.server, path)
+
+    def create(self, path):
+        self.server.data[path] = b''
+        return FakeDataObject(self.server, path)
+
+    def put(self, local_path, path, **options):
+        with open(local_path, 'rb') as f:
+            self.server.data[path] = f.read()
+
+    def copy(self, src_path, dest_path, **options):
+        self.get(src_path)
+        self.server.data[dest_path] = self.server.data[src_path]
+
+    def move(self, src_path, dest_path):
+        self.server.data[dest_path] = self.server.data.pop(src_path)
+
+    def unlink(self, path, force=False):
+        del self.server.data[path]
+
+
+class FakeQuery(object):
+    def __init__(self, server):
+        self.server = server
+
+    def filter(self, *criteria):
+        return self
+
+    def order_by(self, *args, **kwargs):
+        return self
+
+    def __iter__(self):
+        for path, priority in sorted(self.server.priority.items(), key=lambda item: item[1],
+                                     reverse=True):
+            yield {Collection.name: path}
+
+
+class FakeIrodsSession(object):
+    """
+    in-memory stand-in for the subset of python-irodsclient session API used by
+    IrodsClientStorage
+    """
+    def __init__(self):
+        self.colls = set()
+        self.data = {}
+        self.priority = {}
+        self.collections = FakeCollectionManager(self)
+        self.data_objects = FakeDataObjectManager(self)
+
+    def query(self, *columns):
+        return FakeQuery(self)
+
+
+@override_settings(IRODS_ZONE='testZone', IRODS_USER='tester')
+class IrodsClientStorageTestCase(SimpleTestCase):
+    home = '/testZone/home/tester'
+
+    def setUp(self):
+        self.session = FakeIrodsSession()
+        self.session.collections.create(self.home + '/exp1/data/image/jpg', recurse=True)
+        self.session.data[self.home + '/exp1/data/image/jpg/frame1.jpg'] = b'frame1'
+        self.session.data[self.home + '/exp1/data/image/jpg/frame2.jpg'] = b'frame2'
+        self.local_dir = tempfile.mkdtemp()
+
+        @contextmanager
+        def fake_irods_session():
+            yield self.session
+        patcher = mock.patch('django_irods.client_storage.irods_session', fake_irods_session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.storage = IrodsClientStorage()
+
+    def tearDown(self):
+        shutil.rmtree(self.local_dir)
+
+    def test_listdir(self):
+        self.assertEqual(self.storage.listdir('exp1/data/image/'),
+                         (['jpg'], []))
+        self.assertEqual(self.storage.listdir('exp1/data/image/jpg'),
+                         ([], ['frame1.jpg', 'frame2.jpg']))
+        with self.assertRaises(SessionException):
+            self.storage.listdir('exp2')
+
+    def test_list_files_info(self):
+        files_info = self.storage.list_files_info('exp1/data/image/jpg')
+        self.assertEqual(list(files_info), ['frame1.jpg', 'frame2.jpg'])
+        self.assertEqual(files_info['frame1.jpg'], IrodsFileInfo(6, 1577836800, ''))
+        self.assertFalse(self.storage.list_files_info('exp2'))
+
+    def test_exists_and_size(self):
+        self.assertTrue(self.storage.exists('exp1/data/image'))
+        self.assertTrue(self.storage.exists('exp1/data/image/jpg/frame1.jpg'))
+        self.assertFalse(self.storage.exists('exp1/data/image/jpg/frame3.jpg'))
+        self.assertEqual(self.storage.size('exp1/data/image/jpg/frame2.jpg'), 6)
+
+    def test_get_one_image_frame(self):
+        dest_path = self.storage.get_one_image_frame('exp1', 'jpg', 'frame2.jpg', self.local_dir)
+        with open(os.path.join(dest_path, 'frame2.jpg'), 'rb') as f:
+            self.assertEqual(f.read(), b'frame2')
+        self.assertEqual(os.listdir(self.local_dir), ['frame2.jpg'])
+
+    def test_save_copy_and_delete_file(self):
+        local_file = os.path.join(self.local_dir, 'frame1.json')
+        with open(local_file, 'w') as f:
+            f.write('[]')
+        self.storage.save_file(local_file, 'exp1/data/segmentation/frame1.json',
+                               create_directory=True)
+        self.assertEqual(self.session.data[self.home + '/exp1/data/segmentation/frame1.json'],
+                         b'[]')
+        self.storage.copy_file('exp1/data/segmentation/frame1.json',
+                               'exp1/data/segmentation/bak_frame1.json')
+        self.assertTrue(self.storage.exists('exp1/data/segmentation/bak_frame1.json'))
+        self.storage.delete('exp1')
+        self.assertFalse(self.storage.exists('exp1'))
+        self.assertFalse(self.session.data)
+
+    def test_open_write_stream(self):
+        path = self.home + '/exp1/data/segmentation/time_series.csv'
+        with self.storage.open_write_stream('exp1/data/segmentation/time_series.csv') as stream:
+            stream.write(b'a,b\n')
+        self.assertEqual(self.session.data, dict(self.session.data, **{path: b'a,b\n'}))
+        self.assertNotIn(path + '.part', self.session.data)
+
+        # a failed write leaves the existing data object in place
+        with self.assertRaises(ValueError):
+            with self.storage.open_write_stream('exp1/data/segmentation/time_series.csv') as s:
+                s.write(b'c,d\n')
+                raise ValueError('failed')
+        self.assertEqual(self.session.data[path], b'a,b\n')
+        self.assertNotIn(path + '.part', self.session.data)
+
+    def test_get_sorted_exp_list(self):
+        self.session.priority = {self.home + '/exp1': '0000000001',
+                                 self.home + '/exp2': '0000000002'}
+        self.assertEqual(self.storage.get_sorted_exp_list(), ['exp2', 'exp1'])
+
+
+class FakeImageStorage(object):
+    def __init__(self):
+        self.images = {}
+        self.gets = 0
+
+    def get_file(self, src_name, dest_name):
+        self.gets += 1
+        with open(dest_name, 'wb') as f:
+            f.write(self.images[src_name])
+
+
+class ImageCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        self.cache_root = tempfile.mkdtemp()
+        self.storage = FakeImageStorage()
+        for fno in range(1, 4):
+            self.storage.images['exp1/data/image/jpg/frame{}.jpg'.format(fno)] = b'x' * 100
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_root)
+
+    def _get(self, img_name, info):
+        with self.settings(IMAGE_CACHE_ROOT=self.cache_root, IMAGE_CACHE_MAX_BYTES=250):
+            return get_cached_image(self.storage, 'exp1', 'jpg', img_name, info)
+
+    def test_cached_image_is_reused_until_it_changes(self):
+        info = IrodsFileInfo(100, 1000, '')
+        path = self._get('frame1.jpg', info)
+        self.assertEqual(self._get('frame1.jpg', info), path)
+        self.assertEqual(self.storage.gets, 1)
+        new_path = self._get('frame1.jpg', IrodsFileInfo(100, 2000, ''))
+        self.assertNotEqual(new_path, path)
+        self.assertEqual(self.storage.gets, 2)
+
+    def test_least_recently_used_image_is_evicted(self):
+        info = IrodsFileInfo(100, 1000, '')
+        path1 = self._get('frame1.jpg', info)
+        path2 = self._get('frame2.jpg', info)
+        # make frame2 the least recently used one
+        os.utime(path2, (1, 1))
+        evictions = get_cache_stats()['evictions']
+        path3 = self._get('frame3.jpg', info)
+        self.assertTrue(os.path.isfile(path1))
+        self.assertFalse(os.path.isfile(path2))
+        self.assertTrue(os.path.isfile(path3))
+        self.assertEqual(get_cache_stats()['evictions'], evictions + 1)
+
+    def test_cache_is_only_scanned_when_estimate_exceeds_budget(self):
+        info = IrodsFileInfo(100, 1000, '')
+        with mock.patch('ct_core.image_cache._list_entries',
+                        wraps=image_cache._list_entries) as list_mock:
+            self._get('frame1.jpg', info)
+            # the first miss of a process scans the cache to estimate its usage
+            self.assertEqual(list_mock.call_count, 1)
+            self._get('frame2.jpg', info)
+            self.assertEqual(list_mock.call_count, 1)
+            self._get('frame3.jpg', info)
+            self.assertEqual(list_mock.call_count, 2)
+
+    def test_stale_temporary_files_are_removed(self):
+        info = IrodsFileInfo(100, 1000, '')
+        path = self._get('frame1.jpg', info)
+        stale_tmp = os.path.join(os.path.dirname(path), '.tmpstale')
+        fresh_tmp = os.path.join(os.path.dirname(path), '.tmpfresh')
+        for tmp in (stale_tmp, fresh_tmp):
+            with open(tmp, 'wb') as f:
+                f.write(b'x')
+        os.utime(stale_tmp, (1, 1))
+        with self.settings(IMAGE_CACHE_ROOT=self.cache_root):
+            image_cache.evict(250)
+        self.assertFalse(os.path.exists(stale_tmp))
+        self.assertTrue(os.path.exists(fresh_tmp))
+        self.assertTrue(os.path.isfile(path))
+
+
+class FrameIndexTestCase(TestCase):
+    def _files_info(self, names):
+        return OrderedDict((name, IrodsFileInfo(100, 1000, '')) for name in names)
+
+    def test_build_frame_index(self):
+        index = build_frame_index(self._files_info(
+            ['frame01.jpg', 'frame02.jpg', 'color_frame01.jpg', 'color_frame02.jpg']))
+        self.assertEqual(index['gray'], {'1': 'frame01.jpg', '2': 'frame02.jpg'})
+        self.assertEqual(index['color'], {'1': 'color_frame01.jpg', '2': 'color_frame02.jpg'})
+        self.assertEqual(index['files']['frame01.jpg'], [100, 1000, ''])
+
+    def test_build_frame_index_starting_from_zero(self):
+        index = build_frame_index(self._files_info(['frame0.jpg', 'frame1.jpg']))
+        self.assertEqual(index['gray'], {'1': 'frame0.jpg', '2': 'frame1.jpg'})
+
+    def test_frame_index_is_stored_until_invalidated(self):
+        ExperimentInfo.objects.create(exp_id='exp1', colormap='viridis')
+        with mock.patch('ct_core.task_utils.get_irods_storage') as storage_mock:
+            storage_mock.return_value.list_files_info.return_value = self._files_info(
+                ['frame1.jpg', 'color_frame1.jpg'])
+            exp_info, index = get_frame_index('exp1')
+            self.assertEqual(exp_info.colormap, 'viridis')
+            self.assertEqual(index['color'], {'1': 'color_frame1.jpg'})
+            get_frame_index('exp1')
+            self.assertEqual(storage_mock.return_value.list_files_info.call_count, 1)
+            invalidate_frame_index('exp1')
+            get_frame_index('exp1')
+            self.assertEqual(storage_mock.return_value.list_files_info.call_count, 2)
+
+
+class DisplayImageTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('imageuser', password='imageuser')
+        self.client.login(username='imageuser', password='imageuser')
+        img_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, img_dir)
+        self.img_file = os.path.join(img_dir, 'abc123.jpg')
+        with open(self.img_file, 'wb') as f:
+            f.write(b'jpeg')
+        self.file_info = IrodsFileInfo(4, 1577836800, '')
+
+    def _get(self, gray_requested=True, **headers):
+        with mock.patch('ct_core.views.get_exp_image_info',
+                        return_value=(self.img_file, self.file_info, gray_requested, None)):
+            return self.client.get('/display-image/exp1/jpg/1', **headers)
+
+    @override_settings(IMAGE_SENDFILE_HEADER='')
+    def test_image_is_served_with_validators(self):
+        response = self._get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'jpeg')
+        self.assertEqual(response['ETag'], '"abc123"')
+        self.assertEqual(response['Last-Modified'], 'Wed, 01 Jan 2020 00:00:00 GMT')
+        self.assertIn('max-age', response['Cache-Control'])
+
+    @override_settings(IMAGE_SENDFILE_HEADER='')
+    def test_color_image_must_be_revalidated(self):
+        response = self._get(gray_requested=False)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+    def test_unchanged_image_is_not_sent_again(self):
+        response = self._get(HTTP_IF_NONE_MATCH='"abc123"')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], '"abc123"')
+
+    @override_settings(IMAGE_SENDFILE_HEADER='X-Accel-Redirect',
+                       IMAGE_SENDFILE_URL_PREFIX='/protected_image_cache/')
+    def test_image_is_handed_off_to_nginx(self):
+        with mock.patch('ct_core.views.get_cache_root',
+                        return_value=os.path.dirname(os.path.dirname(self.img_file))):
+            response = self._get()
+        self.assertEqual(response['X-Accel-Redirect'], '/protected_image_cache/{}/abc123.jpg'.format(
+            os.path.basename(os.path.dirname(self.img_file))))
+        self.assertFalse(response.content)
+
+
+class SegCodecTestCase(SimpleTestCase):
+    def test_round_trip(self):
+        regions = [{'id': 'cell_0', 'vertices': [[0.1, 0.2], [0.3, 0.4], [0.5, 0.6]]},
+                   {'id': 'cell_1', 'link_id': 'cell_0', 'new_edits': True,
+                    'vertices': [[0.0, 1.0], [0.25, 0.75], [1.0, 0.0], [0.5, 0.5]]}]
+        decoded = decode_frame(encode_frame(regions))
+        self.assertEqual(len(decoded), 2)
+        for region, decoded_region in zip(regions, decoded):
+            self.assertEqual({k: v for k, v in decoded_region.items() if k != 'vertices'},
+                             {k: v for k, v in region.items() if k != 'vertices'})
+            self.assertEqual(len(decoded_region['vertices']), len(region['vertices']))
+            for vertex, decoded_vertex in zip(region['vertices'], decoded_region['vertices']):
+                self.assertAlmostEqual(vertex[0], decoded_vertex[0], places=4)
+                self.assertAlmostEqual(vertex[1], decoded_vertex[1], places=4)
+
+    def test_empty_frame(self):
+        self.assertEqual(decode_frame(encode_frame([])), [])
+
+    def test_invalid_data(self):
+        with self.assertRaises(ValueError):
+            decode_frame(b'{"not": "binary seg data"}')
+
+
+class PowerUserSyncTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('poweruser', password='poweruser')
+        UserProfile.objects.create(user=self.user, role=UserProfile.POWERUSER)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.storage = mock.Mock()
+        # only frame1 has a system binary file to back up
+        self.storage.exists.side_effect = lambda path: path.endswith('frame1.seg')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _backups(self):
+        return sorted(c[0][1] for c in self.storage.copy_file.call_args_list)
+
+    @override_settings(SEG_DATA_STORE_BINARY=True)
+    def test_system_files_are_backed_up_before_override(self):
+        with self.settings(IRODS_ROOT=self.tmp_dir), \
+                mock.patch('ct_core.task_utils.get_irods_storage', return_value=self.storage):
+            sync_seg_data_to_irods('exp1', 'poweruser', _create_frame_data(1),
+                                   'exp1/data/user_segmentation/poweruser/frame1.json')
+            self.assertEqual(self._backups(), ['exp1/data/segmentation/bak_frame1.json',
+                                               'exp1/data/segmentation/bak_frame1.seg'])
+            self.storage.copy_file.reset_mock()
+            bulk_sync_seg_data_to_irods('exp1', 'poweruser', {1: _create_frame_data(1),
+                                                              2: _create_frame_data(2)})
+            self.assertEqual(self._backups(), ['exp1/data/segmentation/bak_frame1.json',
+                                               'exp1/data/segmentation/bak_frame1.seg',
+                                               'exp1/data/segmentation/bak_frame2.json'])
+
+
+class GetFrameSegDataTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('seguser', password='seguser')
+        UserProfile.objects.create(user=self.user)
+        self.client.login(username='seguser', password='seguser')
+        Segmentation.objects.create(exp_id='exp1', frame_no=1, data=_create_frame_data(1))
+
+    def test_json_by_default(self):
+        response = self.client.post('/get_frame_seg_data/exp1/1')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.content), _create_frame_data(1))
+
+    def test_binary_on_content_negotiation(self):
+        response = self.client.post('/get_frame_seg_data/exp1/1',
+                                    HTTP_ACCEPT=SEG_CODEC_CONTENT_TYPE)
+        self.assertEqual(response['Content-Type'], SEG_CODEC_CONTENT_TYPE)
+        self.assertIn('Accept', response['Vary'])
+        self.assertEqual([r['id'] for r in decode_frame(response.content)],
+                         [r['id'] for r in _create_frame_data(1)])
+
+
+class GetFramesSegDataTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('seguser', password='seguser')
+        UserProfile.objects.create(user=self.user)
+        self.client.login(username='seguser', password='seguser')
+        for fno in range(1, 4):
+            Segmentation.objects.create(exp_id='exp1', frame_no=fno, data=_create_frame_data(fno))
+        UserSegmentation.objects.create(user=self.user, exp_id='exp1', frame_no=2,
+                                        data=_create_frame_data(2, cells=1))
+
+    def _post(self, start, end):
+        with mock.patch('ct_core.views.get_exp_frame_no', return_value=4):
+            return self.client.post('/get_frames_seg_data/exp1/{}/{}'.format(start, end))
+
+    def _get_frames(self, start, end):
+        response = self._post(start, end)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b''.join(response.streaming_content))
+
+    def test_range_is_clamped_to_experiment_frames(self):
+        self.assertEqual([f['frame'] for f in self._get_frames(3, 1000000000)], [3, 4])
+        self.assertEqual(self._post(5, 1000000000).status_code, 400)
+
+    def test_user_data_is_merged_over_system_data(self):
+        frames = self._get_frames(1, 4)
+        self.assertEqual([f['frame'] for f in frames], [1, 2, 3, 4])
+        self.assertEqual(frames[0]['data'], _create_frame_data(1))
+        self.assertEqual(frames[1]['data'], _create_frame_data(2, cells=1))
+        self.assertEqual(frames[2]['data'], _create_frame_data(3))
+        self.assertEqual(frames[3]['data'], {})
+
+    def test_query_count_does_not_grow_with_frames(self):
+        with CaptureQueriesContext(connection) as small_ctx:
+            self._get_frames(1, 1)
+        with CaptureQueriesContext(connection) as large_ctx:
+            self._get_frames(1, 3)
+        self.assertEqual(len(small_ctx.captured_queries), len(large_ctx.captured_queries))
+
+
+class SegmentationRegionTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reguser', password='reguser')
+        UserProfile.objects.create(user=self.user)
+        frame_data = {fno: _create_frame_data(fno) for fno in range(1, 4)}
+        for fno, data in frame_data.items():
+            Segmentation.objects.create(exp_id='exp1', frame_no=fno, data=data)
+        # region rows are written along with frame data as production write paths do
+        save_seg_regions('exp1', '', frame_data)
+
+    def _track(self, username=''):
+        with mock.patch('ct_core.tasks.get_exp_frame_no', return_value=3), \
+                mock.patch('ct_core.tasks.sync_seg_data_frames_to_irods'):
+            add_tracking('exp1', username=username, force=True)
+
+    def test_region_fields(self):
+        fields = get_region_fields([{'id': 'object1', 'link_id': 'object2', 'edited': True,
+                                     'vertices': [[0.1, 0.5], [0.2, 0.5], [0.2, 0.7],
+                                                  [0.1, 0.7]]},
+                                    {'id': 'object3', 'vertices': []}])
+        self.assertEqual(fields[0]['region_id'], 'object1')
+        self.assertEqual(fields[0]['link_id'], 'object2')
+        self.assertTrue(fields[0]['edited'])
+        self.assertEqual(fields[0]['num_vertices'], 4)
+        self.assertAlmostEqual(fields[0]['centroid_y'], 0.15)
+        self.assertAlmostEqual(fields[0]['centroid_x'], 0.6)
+        self.assertEqual([fields[0]['min_y'], fields[0]['min_x'], fields[0]['max_y'],
+                          fields[0]['max_x']], [0.1, 0.5, 0.2, 0.7])
+        self.assertEqual(fields[1]['link_id'], '')
+        self.assertIsNone(fields[1]['centroid_y'])
+        self.assertEqual(fields[1]['num_vertices'], 0)
+
+    def test_user_save_replaces_region_rows(self):
+        save_user_seg_data_to_db(self.user, 'exp1', 2, json.dumps(_create_frame_data(2)), 0)
+        save_user_seg_data_to_db(self.user, 'exp1', 2, json.dumps(_create_frame_data(2, cells=1)),
+                                 1)
+        self.assertEqual(list(SegmentationRegion.objects.filter(
+            exp_id='exp1', username='reguser', frame_no=2).values_list('region_id', flat=True)),
+            ['object1'])
+
+    def test_tracking_updates_link_ids(self):
+        self._track()
+        regions = SegmentationRegion.objects.filter(exp_id='exp1', username='', frame_no=3)
+        self.assertEqual(sorted(regions.values_list('region_id', 'link_id')),
+                         [('object1', 'object1'), ('object2', 'object2'), ('object3', 'object3')])
+        self.assertEqual(get_frame_info('reguser', 3, 'exp1'),
+                         {'num_of_regions': 3, 'num_edited': 0})
+        self.assertFalse(get_invalid_linked_regions('exp1').exists())
+
+    def test_invalid_linked_regions(self):
+        self._track()
+        data = _create_frame_data(3)
+        data[0]['link_id'] = 'object9'
+        save_user_seg_data_to_db(self.user, 'exp1', 3, json.dumps(data), 1)
+        self.assertEqual(list(get_invalid_linked_regions('exp1', username='reguser').values_list(
+            'frame_no', 'link_id')), [(3, 'object9')])
+
+
+class SegmentationLookupTestCase(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user('lookup{}'.format(i), first_name='First',
+                                               last_name=str(i)) for i in range(3)]
+        now = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        for i, u in enumerate(self.users):
+            for fno in (3, 1, 2):
+                UserSegmentation.objects.create(
+                    user=u, exp_id='exp1', frame_no=fno, data=[],
+                    update_time=now + datetime.timedelta(minutes=fno if i else -fno))
+
+    def test_get_start_frame(self):
+        self.assertEqual(get_start_frame(self.users[0], 'exp1'), 1)
+        self.assertEqual(get_start_frame(self.users[1], 'exp1'), 3)
+        self.assertEqual(get_start_frame(self.users[1], 'exp2'), 1)
+
+    def test_get_edited_frames(self):
+        self.assertEqual(get_edited_frames('lookup0', 'exp1'), '1, 2, 3')
+        self.assertEqual(get_edited_frames('lookup0', 'exp2'), '')
+
+    def test_get_all_edit_users_in_one_query(self):
+        with self.assertNumQueries(1):
+            edit_users = get_all_edit_users('exp1')
+        self.assertEqual(edit_users, [{'username': 'lookup{}'.format(i), 'name': 'First {}'.format(i)}
+                                      for i in range(3)])
+
+
+class ExperimentLockTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user('lockuser1')
+        self.user2 = User.objects.create_user('lockuser2')
+
+    def test_lock_is_exclusive(self):
+        self.assertEqual(is_exp_locked('exp1'), (False, None))
+        self.assertEqual(lock_experiment('exp1', self.user1), 'lockuser1')
+        self.assertEqual(lock_experiment('exp1', self.user2), 'lockuser1')
+        self.assertEqual(is_exp_locked('exp1'), (True, 'lockuser1'))
+
+    def test_lock_check_is_cached(self):
+        lock_experiment('exp1', self.user1)
+        is_exp_locked('exp1')
+        with self.assertNumQueries(0):
+            self.assertEqual(is_exp_locked('exp1'), (True, 'lockuser1'))
+
+    def test_locking_another_experiment_releases_lock(self):
+        lock_experiment('exp1', self.user1)
+        lock_experiment('exp2', self.user1)
+        self.assertEqual(is_exp_locked('exp1'), (False, None))
+        self.assertEqual(lock_experiment('exp1', self.user2), 'lockuser2')
+        release_locks_by_user(self.user2)
+        self.assertEqual(is_exp_locked('exp1'), (False, None))
+
+    def test_expired_lock(self):
+        lock_experiment('exp1', self.user1)
+        ExperimentLock.objects.filter(exp_id='exp1').update(
+            expire_time=datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc))
+        cache.clear()
+        self.assertEqual(is_exp_locked('exp1'), (False, None))
+        self.assertEqual(lock_experiment('exp1', self.user2), 'lockuser2')
+
+
+class ModelRegistryTestCase(SimpleTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.loaded = []
+        self.registry = ModelRegistry(self._load)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _load(self, model_path):
+        self.loaded.append(model_path)
+        with open(model_path) as f:
+            return f.read()
+
+    def _write_model(self, name, content, mtime):
+        model_path = os.path.join(self.tmp_dir, name)
+        with open(model_path, 'w') as f:
+            f.write(content)
+        os.utime(model_path, (mtime, mtime))
+        return model_path
+
+    def test_model_is_loaded_once(self):
+        model_path = self._write_model('model.pkl', 'model1', 1000)
+        self.assertEqual(self.registry.get(model_path), 'model1')
+        self.assertEqual(self.registry.get(model_path), 'model1')
+        self.assertEqual(self.loaded, [model_path])
+        metrics = self.registry.get_metrics()
+        self.assertEqual(metrics['loads'], 1)
+        self.assertEqual(metrics['hits'], 1)
+        self.assertTrue(metrics['loaded'])
+
+    def test_model_is_reloaded_when_changed(self):
+        model_path = self._write_model('model.pkl', 'model1', 1000)
+        self.registry.get(model_path)
+        self._write_model('model.pkl', 'model2', 2000)
+        self.assertEqual(self.registry.get(model_path), 'model2')
+        other_path = self._write_model('other.pkl', 'model3', 2000)
+        self.assertEqual(self.registry.get(other_path), 'model3')
+        self.assertEqual(self.registry.get_metrics()['loads'], 3)
+
+
+class BatchedScoringTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('scoreuser', password='scoreuser')
+        UserProfile.objects.create(user=self.user, score=5)
+        self.client.login(username='scoreuser', password='scoreuser')
+        Segmentation.objects.create(exp_id='exp1', frame_no=1, data=_create_frame_data(1))
+
+    def test_save_scores_all_edited_regions_in_one_batch(self):
+        regions = _create_frame_data(1)
+        for region in regions:
+            region['new_edits'] = True
+        regions[0]['new_changes'] = 2
+        with mock.patch('ct_core.views.get_exp_image', return_value=('frame1.jpg', None)) as image_mock, \
+                mock.patch('ct_core.views.get_edit_scores',
+                           return_value=([1, 2, 3], None)) as score_mock, \
+                mock.patch('ct_core.views.sync_user_edit_frame_from_db_to_irods'):
+            response = self.client.post('/save_segmentation_data/exp1/1',
+                                        {'regions': json.dumps(regions), 'num_edited': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {'total_score': 13})
+        self.assertEqual(image_mock.call_count, 1)
+        self.assertEqual(score_mock.call_count, 1)
+        self.assertEqual(score_mock.call_args[0][1], [r['vertices'] for r in regions])
+
+    def test_get_scores(self):
+        regions = _create_frame_data(1, cells=2)
+        with mock.patch('ct_core.views.get_exp_image', return_value=('frame1.jpg', None)), \
+                mock.patch('ct_core.views.get_edit_scores', return_value=([4, 6], None)):
+            response = self.client.post('/get_scores/exp1/1', {'regions': json.dumps(regions)})
+        self.assertEqual(json.loads(response.content), {'scores': [4, 6]})
+        self.assertEqual(UserProfile.objects.get(user=self.user).score, 15)
+
+
+@override_settings(SCORE_ASYNC=True)
+class AsyncScoringTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('asyncuser', password='asyncuser')
+        UserProfile.objects.create(user=self.user, score=5)
+        self.other_user = User.objects.create_user('otheruser', password='otheruser')
+        UserProfile.objects.create(user=self.other_user, score=1)
+        self.client.login(username='asyncuser', password='asyncuser')
+        Segmentation.objects.create(exp_id='exp1', frame_no=1, data=_create_frame_data(1))
+
+    def test_save_does_not_score_inline(self):
+        regions = _create_frame_data(1)
+        for region in regions:
+            region['new_edits'] = True
+        regions[0]['new_changes'] = 2
+        with mock.patch('ct_core.views.get_edit_scores') as score_mock, \
+                mock.patch('ct_core.views.sync_user_edit_frame_from_db_to_irods'):
+            response = self.client.post('/save_segmentation_data/exp1/1',
+                                        {'regions': json.dumps(regions), 'num_edited': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {'total_score': 7, 'pending_scores': 3})
+        self.assertFalse(score_mock.called)
+        self.assertEqual(PendingRegionScore.objects.filter(user=self.user).count(), 3)
+        self.assertTrue(UserSegmentation.objects.filter(user=self.user, exp_id='exp1',
+                                                        frame_no=1).exists())
+
+    def test_score_pending_regions_batches_across_users(self):
+        regions = _create_frame_data(1, cells=2)
+        for u, region in ((self.user, regions[0]), (self.other_user, regions[1]),
+                          (self.user, regions[1])):
+            PendingRegionScore.objects.create(user=u, exp_id='exp1', frame_no=1,
+                                              vertices=region['vertices'])
+        with mock.patch('ct_core.tasks.get_exp_image',
+                        return_value=('frame1.jpg', None)) as image_mock, \
+                mock.patch('ct_core.tasks.get_edit_scores',
+                           return_value=([3, 4, 6], None)) as score_mock:
+            deltas = score_pending_regions()
+        self.assertEqual(deltas, {self.user.id: 9, self.other_user.id: 4})
+        self.assertEqual(image_mock.call_count, 1)
+        self.assertEqual(score_mock.call_count, 1)
+        self.assertEqual(len(score_mock.call_args[0][1]), 3)
+        self.assertEqual(UserProfile.objects.get(user=self.user).score, 14)
+        self.assertEqual(UserProfile.objects.get(user=self.other_user).score, 5)
+        self.assertFalse(PendingRegionScore.objects.exists())
+
+        response = self.client.post('/get_user_info/')
+        self.assertEqual(json.loads(response.content)['pending_scores'], 0)
+
+    def test_scores_are_pending_until_they_are_added(self):
+        PendingRegionScore.objects.create(user=self.user, exp_id='exp1', frame_no=1,
+                                          vertices=_create_frame_data(1)[0]['vertices'])
+
+        def get_scores(img_file, vertices_list):
+            # the claimed region is still pending while it is being scored, and another run of
+            # the task does not claim it again
+            content = json.loads(self.client.post('/get_user_info/').content)
+            self.assertEqual((content['pending_scores'], content['total_score']), (1, 5))
+            self.assertEqual(score_pending_regions(), {})
+            return [4], None
+
+        with mock.patch('ct_core.tasks.get_exp_image', return_value=('frame1.jpg', None)), \
+                mock.patch('ct_core.tasks.get_edit_scores', side_effect=get_scores) as score_mock:
+            self.assertEqual(score_pending_regions(), {self.user.id: 4})
+        self.assertEqual(score_mock.call_count, 1)
+        content = json.loads(self.client.post('/get_user_info/').content)
+        self.assertEqual((content['pending_scores'], content['total_score']), (0, 9))
+
+    @override_settings(SCORE_ASYNC_MAX_ATTEMPTS=1)
+    def test_score_pending_regions_drops_unscorable_regions(self):
+        PendingRegionScore.objects.create(user=self.user, exp_id='exp1', frame_no=1,
+                                          vertices=_create_frame_data(1)[0]['vertices'])
+        with mock.patch('ct_core.tasks.get_exp_image', return_value=(None, 'no image')), \
+                mock.patch('ct_core.tasks.get_edit_scores') as score_mock, \
+                mock.patch.object(score_pending_regions, 'apply_async') as enqueue_mock:
+            self.assertEqual(score_pending_regions(), {})
+        self.assertFalse(score_mock.called)
+        self.assertFalse(enqueue_mock.called)
+        self.assertEqual(UserProfile.objects.get(user=self.user).score, 5)
+        self.assertFalse(PendingRegionScore.objects.exists())
+
+    def test_score_pending_regions_survives_scoring_errors(self):
+        PendingRegionScore.objects.create(user=self.user, exp_id='exp1', frame_no=1,
+                                          vertices=[['bad']])
+        PendingRegionScore.objects.create(user=self.user, exp_id='exp1', frame_no=2,
+                                          vertices=_create_frame_data(2)[0]['vertices'])
+
+        def get_scores(img_file, vertices_list):
+            if img_file == 'frame1.jpg':
+                raise ValueError('malformed vertices')
+            return [4], None
+
+        with mock.patch('ct_core.tasks.get_exp_image',
+                        side_effect=lambda exp_id, fno: ('frame{}.jpg'.format(fno), None)), \
+                mock.patch('ct_core.tasks.get_edit_scores', side_effect=get_scores), \
+                mock.patch.object(score_pending_regions, 'apply_async') as enqueue_mock:
+            self.assertEqual(score_pending_regions(), {self.user.id: 4})
+            # the failing region stays claimed so that it does not block the next run
+            self.assertEqual(score_pending_regions(), {})
+        self.assertEqual(UserProfile.objects.get(user=self.user).score, 9)
+        pending = PendingRegionScore.objects.get()
+        self.assertEqual((pending.frame_no, pending.attempts), (1, 1))
+        self.assertIsNotNone(pending.claimed_time)
+        # the failing region is retried once its claim expires
+        enqueue_mock.assert_called_once_with(countdown=settings.SCORE_ASYNC_CLAIM_SECONDS)
+
+    def test_expired_claims_are_claimed_again(self):
+        pending = PendingRegionScore.objects.create(
+            user=self.user, exp_id='exp1', frame_no=1,
+            vertices=_create_frame_data(1)[0]['vertices'], attempts=1,
+            claimed_time=timezone.now() - datetime.timedelta(
+                seconds=settings.SCORE_ASYNC_CLAIM_SECONDS + 1))
+        with mock.patch('ct_core.tasks.get_exp_image', return_value=('frame1.jpg', None)), \
+                mock.patch('ct_core.tasks.get_edit_scores', return_value=([4], None)):
+            self.assertEqual(score_pending_regions(), {self.user.id: 4})
+        self.assertFalse(PendingRegionScore.objects.exists())
+        self.assertEqual(UserProfile.objects.get(user=self.user).score, 9)
+
+        pending.pk = None
+        pending.save()
+
+        def get_scores(img_file, vertices_list):
+            # the claim expires during scoring and is taken over by another run
+            PendingRegionScore.objects.update(claimed_time=timezone.now())
+            return [4], None
+
+        with mock.patch('ct_core.tasks.get_exp_image', return_value=('frame1.jpg', None)), \
+                mock.patch('ct_core.tasks.get_edit_scores', side_effect=get_scores):
+            self.assertEqual(score_pending_regions(), {})
+        # the score is left to be added by the run that took over the claim
+        self.assertEqual(PendingRegionScore.objects.count(), 1)
+        self.assertEqual(UserProfile.objects.get(user=self.user).score, 9)
+
+    @override_settings(SCORE_ASYNC_BATCH_SIZE=1)
+    def test_score_pending_regions_enqueues_remaining_regions(self):
+        for region in _create_frame_data(1, cells=2):
+            PendingRegionScore.objects.create(user=self.user, exp_id='exp1', frame_no=1,
+                                              vertices=region['vertices'])
+        with mock.patch('ct_core.tasks.get_exp_image', return_value=('frame1.jpg', None)), \
+                mock.patch('ct_core.tasks.get_edit_scores', return_value=([2], None)), \
+                mock.patch.object(score_pending_regions, 'apply_async') as enqueue_mock:
+            score_pending_regions()
+        self.assertEqual(enqueue_mock.call_count, 1)
+        self.assertEqual(PendingRegionScore.objects.count(), 1)
+        self.assertEqual(UserProfile.objects.get(user=self.user).score, 7)
+
+
+@override_settings(SCORE_IMAGE_DIMENSION=(20, 20))
+class ScorePreprocessingTestCase(SimpleTestCase):
+    def setUp(self):
+        self.img = np.full((100, 100), 50, dtype=np.uint8)
+        self.img[45:55, 45:55] = 200
+
+    def test_overlay_stack(self):
+        square = [[0.45, 0.45], [0.55, 0.45], [0.55, 0.55], [0.45, 0.55]]
+        overlay = _create_mask_overlay_stack(self.img, [square, square])
+        self.assertEqual(overlay.dtype, np.float32)
+        self.assertEqual(overlay.shape, (2, 2, 20, 20))
+        # base image crop normalized by its maximum value
+        self.assertAlmostEqual(float(overlay[0, 0].max()), 1.0)
+        self.assertAlmostEqual(float(overlay[0, 0, 0, 0]), 0.25)
+        # region mask covers the center of the crop
+        self.assertEqual(overlay[0, 1, 10, 10], 1)
+        self.assertEqual(overlay[0, 1, 0, 0], 0)
+        self.assertTrue(np.array_equal(overlay[0], overlay[1]))
+
+    def test_overlay_stack_pads_crop_beyond_image(self):
+        corner = [[0.97, 0.97], [1.0, 0.97], [1.0, 1.0], [0.97, 1.0]]
+        overlay = _create_mask_overlay_stack(self.img, [corner])
+        self.assertEqual(overlay.shape, (1, 2, 20, 20))
+        self.assertTrue(np.all(overlay[0, 0, 12:, :] == 0))
+        self.assertTrue(np.all(overlay[0, 0, :, 12:] == 0))
+
+    def test_colour_frame_matches_skimage_preprocessing(self):
+        from skimage.color import rgb2gray
+        rgb = np.random.RandomState(0).randint(0, 256, (100, 100, 3)).astype(np.uint8)
+        with mock.patch('ct_core.frame_cache.cv2.imread', return_value=rgb[..., ::-1].copy()):
+            img = decode_frame_image('frame1.jpg', mode=LUMINANCE_MODE)
+        # skimage imread(as_gray=True) decodes colour frames into [0, 1] luminance
+        expected = rgb2gray(rgb)
+        np.testing.assert_allclose(img, expected, rtol=1e-6)
+        square = [[0.45, 0.45], [0.55, 0.45], [0.55, 0.55], [0.45, 0.55]]
+        # crops of colour frames are not normalized by their maximum value
+        np.testing.assert_allclose(_create_mask_overlay_stack(img, [square])[0, 0],
+                                   expected[40:60, 40:60], rtol=1e-6)
+
+    def test_grayscale_frame_is_decoded_as_is(self):
+        with mock.patch('ct_core.frame_cache.cv2.imread', return_value=self.img):
+            img = decode_frame_image('frame1.jpg', mode=LUMINANCE_MODE)
+        self.assertIs(img, self.img)
+
+
+def _decode_fake_frame(ifile, mode=GRAY_MODE):
+    """
+    decode a fake frame file holding a single pixel value as a 10x10 frame
+    """
+    with open(ifile) as f:
+        return np.full((10, 10), int(f.read()), dtype=np.uint8)
+
+
+@override_settings(FRAME_CACHE_MAX_BYTES=250)
+class FrameCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        clear_frame_cache()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.files = []
+        for fno in range(1, 4):
+            self.files.append(os.path.join(self.tmp_dir, 'frame{}.jpg'.format(fno)))
+            self._write(fno - 1, fno)
+        patcher = mock.patch('ct_core.frame_cache.decode_frame_image',
+                             side_effect=_decode_fake_frame)
+        self.decode_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        clear_frame_cache()
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, idx, value):
+        with open(self.files[idx], 'w') as f:
+            f.write(str(value))
+
+    def test_frame_is_decoded_once_until_it_changes(self):
+        img = get_frame_array(self.files[0])
+        self.assertEqual(img.dtype, np.uint8)
+        self.assertFalse(img.flags.writeable)
+        self.assertIs(get_frame_array(self.files[0]), img)
+        self.assertEqual(self.decode_mock.call_count, 1)
+
+        self._write(0, 10)
+        os.utime(self.files[0], (1, 1))
+        self.assertEqual(get_frame_array(self.files[0])[0, 0], 10)
+        self.assertEqual(self.decode_mock.call_count, 2)
+
+    def test_least_recently_used_frame_is_evicted(self):
+        get_frame_array(self.files[0])
+        get_frame_array(self.files[1])
+        # make frame2 the least recently used one
+        get_frame_array(self.files[0])
+        get_frame_array(self.files[2])
+        stats = get_frame_cache_stats()
+        self.assertEqual(stats['entries'], 2)
+        self.assertEqual(stats['bytes'], 200)
+        self.assertEqual(stats['evictions'], 1)
+        get_frame_array(self.files[0])
+        self.assertEqual(self.decode_mock.call_count, 3)
+        get_frame_array(self.files[1])
+        self.assertEqual(self.decode_mock.call_count, 4)
+
+    def test_frame_stack(self):
+        stack_dir = os.path.join(self.tmp_dir, 'stacks', 'exp1')
+        old_stack_file = write_frame_stack(os.path.join(stack_dir, 'v1.npy'), self.files, 3)
+        stack_file = write_frame_stack(os.path.join(stack_dir, 'v2.npy'), iter(self.files), 3)
+        self.assertFalse(os.path.exists(old_stack_file))
+        stack = load_frame_stack(stack_file)
+        self.assertEqual(stack.shape, (3, 10, 10))
+        self.assertEqual([int(stack[i, 0, 0]) for i in range(3)], [1, 2, 3])
+        self.assertFalse(stack.flags.writeable)
+
+        with self.assertRaises(ValueError):
+            write_frame_stack(os.path.join(stack_dir, 'v3.npy'), self.files, 4)
+        self.assertEqual(os.listdir(stack_dir), ['v2.npy'])
+
+
+class MeasureFrameRegionsTestCase(SimpleTestCase):
+    def setUp(self):
+        self.img = np.arange(100, dtype=np.uint8).reshape(10, 10)
+        # regions covering rows 1-3 x columns 1-3 and rows 5-8 x columns 4-6 of the image,
+        # and a region without vertices
+        self.regions = [{'id': 'object1', 'vertices': [[0.1, 0.1], [0.3, 0.1], [0.3, 0.3],
+                                                       [0.1, 0.3]]},
+                        {'id': 'object2', 'vertices': [[0.5, 0.4], [0.8, 0.4], [0.8, 0.6],
+                                                       [0.5, 0.6]]},
+                        {'id': 'object3', 'vertices': []}]
+
+    def test_rasterize_frame_regions(self):
+        labels = rasterize_frame_regions(self.regions, self.img.shape)
+        self.assertEqual(labels.dtype, np.int32)
+        self.assertTrue(np.all(labels[1:4, 1:4] == 1))
+        self.assertTrue(np.all(labels[5:9, 4:7] == 2))
+        self.assertEqual(np.count_nonzero(labels), 21)
+
+    def test_measure_frame_regions(self):
+        measures = measure_frame_regions(self.img, self.regions)
+        first = self.img[1:4, 1:4]
+        second = self.img[5:9, 4:7]
+        self.assertEqual(measures['area'].tolist(), [9, 12, 0])
+        self.assertEqual(measures['integrated'].tolist(), [first.sum(), second.sum(), 0])
+        self.assertEqual(measures['mean'].tolist(), [first.mean(), second.mean(), 0])
+        self.assertEqual(measures['min'].tolist(), [first.min(), second.min(), 0])
+        self.assertEqual(measures['max'].tolist(), [first.max(), second.max(), 0])
+
+    def test_measure_frame_without_regions(self):
+        measures = measure_frame_regions(self.img, [])
+        self.assertEqual(measures['mean'].shape, (0,))
+
+
+class TimeSeriesExportTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('tsuser', password='tsuser')
+        UserProfile.objects.create(user=self.user)
+        for fno in range(1, 3):
+            Segmentation.objects.create(exp_id='exp1', frame_no=fno,
+                                        data=_create_frame_data(fno, cells=2))
+        user_data = _create_frame_data(2, cells=3)
+        UserSegmentation.objects.create(user=self.user, exp_id='exp1', frame_no=2,
+                                        data=user_data, num_edited=1)
+        self.img = np.zeros((100, 100), dtype=np.uint8)
+        self.img[:50, :] = 100
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    @contextmanager
+    def _mock_images(self):
+        with mock.patch('ct_core.utils.get_exp_image', return_value=('frame.jpg', None)), \
+                mock.patch('ct_core.utils.get_frame_array', return_value=self.img):
+            yield
+
+    def test_measure_time_series_frames(self):
+        with self._mock_images():
+            results = list(measure_time_series_frames('exp1', 2, features=('mean', 'area')))
+        self.assertEqual([err_msg for _, err_msg in results], [None, None])
+        ids, link_ids, values = results[0][0]
+        self.assertEqual(ids, ['object1', 'object2'])
+        self.assertEqual(link_ids, ['', ''])
+        self.assertEqual(values.shape, (2, 2))
+        self.assertEqual(values[0, 0], 100)
+        self.assertEqual(values[1, 0], 100)
+        self.assertGreater(values[0, 1], 0)
+
+        with self._mock_images():
+            results = list(measure_time_series_frames('exp1', 2, username='tsuser'))
+        # user edit data is used for frames the user has edited
+        self.assertEqual(len(results[0][0][0]), 2)
+        self.assertEqual(len(results[1][0][0]), 3)
+
+    def _compute_time_series(self, **kwargs):
+        saved = {}
+
+        @contextmanager
+        def open_write_stream(to_name):
+            stream = io.BytesIO()
+            yield stream
+            saved[to_name.split('/')[-1]] = stream.getvalue()
+
+        storage = mock.Mock()
+        storage.open_write_stream.side_effect = open_write_stream
+        with self._mock_images(), self.settings(IRODS_ROOT=self.tmp_dir), \
+                mock.patch('ct_core.utils.get_exp_frame_no', return_value=2), \
+                mock.patch('ct_core.utils.get_irods_storage', return_value=storage):
+            self.assertIsNone(compute_time_series_and_put_in_irods('exp1', **kwargs))
+        return saved
+
+    @staticmethod
+    def _read_csv(content):
+        return list(csv.reader(io.StringIO(content.decode('utf-8'))))
+
+    def test_compute_time_series_for_system_data(self):
+        # object1 divides into object1 and object2 while the old object2 disappears and object3
+        # appears in the second frame
+        Segmentation.objects.filter(exp_id='exp1', frame_no=2).update(data=[
+            dict(region, link_id=link_id) for region, link_id in zip(
+                _create_frame_data(2, cells=3), ['object1', 'object1', ''])])
+        saved = self._compute_time_series()
+        rows = self._read_csv(saved['time_series.csv'])
+        self.assertEqual(rows[4], ['Cell', 'cell1', 'cell2', 'cell3', 'cell4', 'cell5'])
+        self.assertEqual(rows[7], ['0', '100.0', '100.0', 'NaN', 'NaN', 'NaN'])
+        self.assertEqual(rows[8], ['1', 'NaN', 'NaN', '100.0', '100.0', '0.0'])
+        self.assertEqual(self._read_csv(saved['time_series_lineage.csv']), [
+            ['track', 'start_frame_no', 'end_frame_no', 'parent_track'],
+            ['1', '1', '1', ''], ['2', '1', '1', ''], ['3', '2', '2', '1'], ['4', '2', '2', '1'],
+            ['5', '2', '2', '']])
+
+    def test_compute_time_series_in_long_layout(self):
+        Segmentation.objects.filter(exp_id='exp1', frame_no=2).update(data=[
+            dict(region, link_id=region['id']) for region in _create_frame_data(2, cells=2)])
+        saved = self._compute_time_series(features=('mean', 'area'), layout='long')
+        rows = self._read_csv(saved['time_series_long.csv'])
+        self.assertEqual(rows[0], ['track', 'frame_no', 'mean', 'area'])
+        self.assertEqual([row[:3] for row in rows[1:]], [['1', '1', '100.0'], ['2', '1', '100.0'],
+                                                         ['1', '2', '100.0'], ['2', '2', '100.0']])
+        self.assertNotIn('time_series.csv', saved)
+
+    def test_compute_gzipped_time_series(self):
+        saved = self._compute_time_series(output_format='csv.gz')
+        rows = self._read_csv(gzip.decompress(saved['time_series.csv.gz']))
+        self.assertEqual(rows[4], ['Cell', 'cell1', 'cell2', 'cell3', 'cell4'])
+        self.assertEqual(len(rows), 9)
+        self.assertIn('time_series_lineage.csv', saved)
+
+    def test_compute_time_series_with_invalid_format(self):
+        self.assertEqual(compute_time_series_and_put_in_irods('exp1', output_format='xlsx'),
+                         'Format xlsx is not supported')
+
+
+class TimeSeriesExportCacheTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('exportuser', password='exportuser')
+        UserProfile.objects.create(user=self.user)
+        self.other_user = User.objects.create_user('otheruser', password='otheruser')
+        UserProfile.objects.create(user=self.other_user)
+        for fno in range(1, 3):
+            Segmentation.objects.create(exp_id='exp1', frame_no=fno,
+                                        data=_create_frame_data(fno, cells=2))
+        UserSegmentation.objects.create(user=self.user, exp_id='exp1', frame_no=2,
+                                        data=_create_frame_data(2, cells=3), num_edited=1)
+        cache.clear()
+
+    def test_export_key_follows_segmentation_state(self):
+        system_key = get_time_series_export_key('exp1')
+        self.assertEqual(get_time_series_export_key('exp1'), system_key)
+        # a user without edits exports the system segmentation state
+        self.assertEqual(get_time_series_export_key('exp1', 'otheruser'), system_key)
+        self.assertNotEqual(get_time_series_export_key('exp1', 'exportuser'), system_key)
+        self.assertNotEqual(get_time_series_export_key('exp1', layout='long'), system_key)
+
+        Segmentation.objects.filter(exp_id='exp1', frame_no=2).update(data=[
+            dict(region, link_id=region['id']) for region in _create_frame_data(2, cells=2)])
+        self.assertNotEqual(get_time_series_export_key('exp1'), system_key)
+
+    def test_export_task_is_served_from_cache(self):
+        export_key = get_time_series_export_key('exp1', 'exportuser')
+        with mock.patch('ct_core.tasks.is_time_series_export_cached', return_value=False), \
+                mock.patch('ct_core.tasks.compute_time_series_and_put_in_irods',
+                           return_value=None) as compute_mock:
+            result = export_time_series('exp1', 'exportuser')
+        self.assertEqual(result, {'export_key': export_key,
+                                  'files': ['time_series.csv', 'time_series_lineage.csv']})
+        self.assertEqual(compute_mock.call_args[1]['irods_dir'],
+                         'exp1/data/time_series/' + export_key + '/')
+        self.assertEqual(compute_mock.call_args[1]['workers'], 1)
+
+        with mock.patch('ct_core.tasks.is_time_series_export_cached', return_value=True), \
+                mock.patch('ct_core.tasks.compute_time_series_and_put_in_irods') as compute_mock:
+            self.assertEqual(export_time_series('exp1', 'exportuser')['export_key'], export_key)
+        self.assertFalse(compute_mock.called)
+
+    def test_export_view(self):
+        self.client.login(username='exportuser', password='exportuser')
+        with mock.patch('ct_core.views.get_exp_frame_no', return_value=2), \
+                mock.patch('ct_core.views.is_time_series_export_cached', return_value=True):
+            response = self.client.post('/export_time_series_data/exp1/',
+                                        {'username': 'otheruser', 'format': 'csv.gz'})
+        self.assertEqual(response.status_code, 200)
+        content = json.loads(response.content)
+        self.assertIsNone(content['task_id'])
+        self.assertEqual(content['export_key'],
+                         get_time_series_export_key('exp1', 'otheruser', output_format='csv.gz'))
+        self.assertEqual(content['files'], ['time_series.csv.gz', 'time_series_lineage.csv'])
+
+        with mock.patch('ct_core.views.get_exp_frame_no', return_value=2), \
+                mock.patch('ct_core.views.is_time_series_export_cached', return_value=False), \
+                mock.patch.object(export_time_series, 'apply_async',
+                                  return_value=mock.Mock(task_id='task1')) as enqueue_mock, \
+                mock.patch.object(export_time_series, 'AsyncResult',
+                                  return_value=mock.Mock(ready=lambda: False)):
+            for _ in range(2):
+                response = self.client.post('/export_time_series_data/exp1/',
+                                            {'features': ['mean', 'area'], 'layout': 'long'})
+                self.assertEqual(json.loads(response.content), {'task_id': 'task1'})
+        # a repeat request shares the running task
+        self.assertEqual(enqueue_mock.call_count, 1)
+        self.assertEqual(enqueue_mock.call_args[0][0], ('exp1', '', ['mean', 'area'], 'long', 'csv'))
+
+        response = self.client.post('/export_time_series_data/exp1/', {'layout': 'tall'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_view_rejects_unsupported_parquet(self):
+        self.client.login(username='exportuser', password='exportuser')
+        with mock.patch.object(export_time_series, 'apply_async') as enqueue_mock:
+            response = self.client.post('/export_time_series_data/exp1/', {'format': 'parquet'})
+            self.assertEqual(response.status_code, 400)
+            with mock.patch('ct_core.time_series.pyarrow', None):
+                response = self.client.post('/export_time_series_data/exp1/',
+                                            {'format': 'parquet', 'layout': 'long'})
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(enqueue_mock.called)
+
+
+class LineageBuilderTestCase(SimpleTestCase):
+    def test_tracks_follow_links_to_previous_frame(self):
+        lineage = LineageBuilder()
+        self.assertEqual(lineage.add_frame(1, ['a', 'b'], ['', '']).tolist(), [0, 1])
+        self.assertEqual(lineage.add_frame(2, ['c', 'd'], ['b', 'a']).tolist(), [1, 0])
+        # a link to a region that is not in the previous frame starts a new track
+        self.assertEqual(lineage.add_frame(3, ['e', 'f'], ['d', 'x']).tolist(), [0, 2])
+        self.assertEqual(lineage.tracks, [[1, 1, 3, None], [2, 1, 2, None], [3, 3, 3, None]])
+
+    def test_division_starts_child_tracks(self):
+        lineage = LineageBuilder()
+        lineage.add_frame(1, ['a'], [''])
+        self.assertEqual(lineage.add_frame(2, ['b', 'c'], ['a', 'a']).tolist(), [1, 2])
+        self.assertEqual(lineage.add_frame(3, ['d'], ['c']).tolist(), [2])
+        self.assertEqual(lineage.tracks, [[1, 1, 1, None], [2, 2, 2, 1], [3, 2, 3, 1]])
+
+
+class TimeSeriesWriterTestCase(SimpleTestCase):
+    def setUp(self):
+        self.frames = [(np.array([0, 1]), np.array([[10.0, 4.0], [20.0, 5.0]])),
+                       (np.array([2, 0]), np.array([[30.0, 6.0], [11.0, 4.0]]))]
+
+    def _write(self, layout, output_format, features=('mean', 'area')):
+        stream = io.BytesIO()
+        with open_time_series_writer(stream, layout, output_format, features) as writer:
+            for i, (track_indices, values) in enumerate(self.frames):
+                writer.add_frame(i + 1, track_indices, values)
+            writer.finish(3)
+        return stream.getvalue()
+
+    def test_wide_layout_matches_in_memory_output(self):
+        expected = io.StringIO(newline='')
+        write_wide_time_series(csv.writer(expected), 3, self.frames, ('mean', 'area'))
+        self.assertEqual(self._write('wide', 'csv').decode('utf-8'), expected.getvalue())
+
+    def test_gzipped_long_layout(self):
+        content = gzip.decompress(self._write('long', 'csv.gz')).decode('utf-8')
+        self.assertEqual(list(csv.reader(io.StringIO(content))), [
+            ['track', 'frame_no', 'mean', 'area'], ['1', '1', '10.0', '4.0'],
+            ['2', '1', '20.0', '5.0'], ['3', '2', '30.0', '6.0'], ['1', '2', '11.0', '4.0']])
+
+    def test_parquet_only_supports_long_layout(self):
+        with self.assertRaises(ValueError):
+            self._write('wide', 'parquet')
+
+    @skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_parquet_long_layout(self):
+        parquet_file = pyarrow.parquet.ParquetFile(io.BytesIO(self._write('long', 'parquet')))
+        # one row group per frame
+        self.assertEqual(parquet_file.num_row_groups, 2)
+        table = parquet_file.read()
+        self.assertEqual(table.column_names, ['track', 'frame_no', 'mean', 'area'])
+        self.assertEqual(table.to_pydict()['track'], [1, 2, 3, 1])
@@ -0,0 +1,388 @@
+import io
+import os
+import csv
+import gzip
+from collections import OrderedDict, Counter
+from contextlib import contextmanager
+from tempfile import TemporaryFile
+
+import cv2
+import numpy as np
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    # Parquet output is optional and only available when pyarrow is installed
+    pyarrow = None
+
+
+# per-region measurements computed by measure_frame_regions() keyed by feature name along with
+# the feature name written to time series csv files
+TIME_SERIES_FEATURES = OrderedDict((
+    ('mean', 'Feature'),
+    ('area', 'Area'),
+    ('integrated', 'Integrated Intensity'),
+    ('min', 'Min Intensity'),
+    ('max', 'Max Intensity'),
+))
+
+# time series csv layouts: one row per frame and one column per cell and feature as imported by
+# Cell Cycle Browser, or one row per cell per frame
+WIDE_LAYOUT = 'wide'
+LONG_LAYOUT = 'long'
+# time series csv file name of each layout
+TIME_SERIES_FILES = OrderedDict((
+    (WIDE_LAYOUT, 'time_series.csv'),
+    (LONG_LAYOUT, 'time_series_long.csv'),
+))
+# track lineage csv file name written along with time series
+LINEAGE_FILE = 'time_series_lineage.csv'
+# time series output formats, which are used as the file name extension as well
+CSV_FORMAT = 'csv'
+GZIP_CSV_FORMAT = 'csv.gz'
+PARQUET_FORMAT = 'parquet'
+TIME_SERIES_FORMATS = (CSV_FORMAT, GZIP_CSV_FORMAT, PARQUET_FORMAT)
+
+
+def get_region_points(vertices, rows, cols):
+    """
+    Get polygon points of a region in image pixel coordinates for cv2 drawing functions
+    :param vertices: vertices list in the format of [[y, x], ...] normalized within [0, 1]
+    :param rows: number of image rows
+    :param cols: number of image columns
+    :return: int32 array of [x, y] points
+    """
+    # vertices are normalized into [0, 1], need to restore to original coordinates
+    ary_vertices = np.rint(np.multiply(np.asarray(vertices, dtype=float), [cols, rows]))
+    return ary_vertices[:, ::-1].astype(np.int32)
+
+
+def rasterize_frame_regions(regions, shape):
+    """
+    Rasterize all regions in a frame into a single label image
+    :param regions: list of region dicts in a frame, each of which has a vertices list in the
+    format of [[y, x], ...]
+    :param shape: (rows, cols) shape of the frame image
+    :return: int32 label image where pixels of the i-th region are labeled i + 1 and background
+    pixels are labeled 0. A pixel covered by overlapping regions is labeled with the last one
+    """
+    labels = np.zeros(shape, dtype=np.int32)
+    rows, cols = shape
+    for i, region in enumerate(regions):
+        if region['vertices']:
+            cv2.fillPoly(labels, [get_region_points(region['vertices'], rows, cols)], i + 1)
+    return labels
+
+
+def measure_frame_regions(img, regions):
+    """
+    Measure intensity features of all regions in a frame in one pass over a label image rather
+    than with a full-frame mask per region
+    :param img: grayscale frame image array
+    :param regions: list of region dicts in a frame
+    :return: dict of float arrays with one value per region in region order keyed by feature
+    names in TIME_SERIES_FEATURES, which are pixel count, sum, mean, minimum and maximum of
+    intensity of pixels in each region. All features of a region without pixels are 0
+    """
+    n = len(regions) + 1
+    labels = rasterize_frame_regions(regions, img.shape[:2]).ravel()
+    values = np.asarray(img).ravel()
+    area = np.bincount(labels, minlength=n).astype(float)
+    integrated = np.bincount(labels, weights=values, minlength=n)
+    mean = np.divide(integrated, area, out=np.zeros(n), where=area > 0)
+
+    minimum = np.zeros(n)
+    maximum = np.zeros(n)
+    foreground = np.flatnonzero(labels)
+    if foreground.size:
+        # group foreground pixels by label to reduce each group of pixels in one call
+        order = foreground[np.argsort(labels[foreground], kind='stable')]
+        sorted_labels = labels[order]
+        sorted_values = values[order]
+        starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+        present = sorted_labels[starts]
+        minimum[present] = np.minimum.reduceat(sorted_values, starts)
+        maximum[present] = np.maximum.reduceat(sorted_values, starts)
+
+    return {
+        'mean': mean[1:],
+        'area': area[1:],
+        'integrated': integrated[1:],
+        'min': minimum[1:],
+        'max': maximum[1:],
+    }
+
+
+class LineageBuilder(object):
+    """
+    Build the track lineage table of an experiment by assigning regions of consecutive frames to
+    tracks one frame at a time. A region links to the region with id equal to its link_id in the
+    previous frame. A region continues the track of the region it links to if it is the only
+    region linking to it; if several regions link to the same region, the cell has divided, so
+    its track ends and each of the regions starts a new track with it as the parent track. A
+    region without a valid link starts a new track without a parent track.
+    """
+
+    def __init__(self):
+        # list of [track id, start frame number, end frame number, parent track id or None]
+        # with track ids starting from 1 in the order tracks start
+        self.tracks = []
+        # track index of each region id in the last added frame
+        self._last_frame = {}
+
+    def add_frame(self, frame_no, ids, link_ids):
+        """
+        assign regions of the next frame to tracks, which takes time linear in the number of
+        regions in the frame
+        :param frame_no: frame number of the frame
+        :param ids: list of region ids in the frame
+        :param link_ids: list of link ids of the regions in the frame, each of which is the id of
+        the linked region in the previous frame or empty if the region is not linked
+        :return: int array holding the zero-based track index of each region in region order
+        """
+        children = Counter(link_id for link_id in link_ids if link_id in self._last_frame)
+        track_indices = np.empty(len(ids), dtype=np.intp)
+        cur_frame = {}
+        for i, (rid, link_id) in enumerate(zip(ids, link_ids)):
+            parent = self._last_frame.get(link_id) if link_id else None
+            if parent is not None and children[link_id] == 1:
+                track = parent
+                self.tracks[track][2] = frame_no
+            else:
+                track = len(self.tracks)
+                self.tracks.append([track + 1, frame_no, frame_no,
+                                    self.tracks[parent][0] if parent is not None else None])
+            track_indices[i] = track
+            cur_frame[rid] = track
+        self._last_frame = cur_frame
+        return track_indices
+
+
+def write_wide_time_series(fwriter, num_tracks, frames, features):
+    """
+    Write time series in the wide layout with a metadata header followed by one row per frame
+    holding one column per track and feature, which is NaN in frames the track does not cover
+    :param fwriter: csv writer to write rows with
+    :param num_tracks: number of tracks in the lineage table
+    :param frames: iterable of (track indices, feature values) tuples in frame order, where track
+    indices are returned from LineageBuilder.add_frame() and feature values is an array with one
+    row per region and one column per feature
+    :param features: features in TIME_SERIES_FEATURES the feature values hold
+    :return:
+    """
+    num_cols = num_tracks * len(features)
+    fwriter.writerow(['<begin metadata>'] + [''] * num_cols)
+    fwriter.writerow(['Cell Line', 'CellLinePlaceHolder'] + [''] * num_cols)
+    fwriter.writerow(['Name', 'NamePlaceHolder'])
+    fwriter.writerow(['<end metadata>'] + [''] * num_cols)
+    fwriter.writerow(['Cell'] + ['cell{}'.format(track + 1) for track in range(num_tracks)
+                                 for _ in features])
+    fwriter.writerow(['Species'] * (num_cols + 1))
+    fwriter.writerow(['Feature'] + [TIME_SERIES_FEATURES[feature] for feature in features] *
+                     num_tracks)
+    for i, (track_indices, values) in enumerate(frames):
+        row = np.full((num_tracks, len(features)), np.nan)
+        row[track_indices] = values
+        fwriter.writerow([i] + ['NaN' if v != v else v for v in row.ravel().tolist()])
+
+
+def get_long_time_series_header(features):
+    """
+    Get the header row of time series in the long layout
+    :param features: features in TIME_SERIES_FEATURES to output
+    :return: list of column names
+    """
+    return ['track', 'frame_no'] + list(features)
+
+
+def get_long_time_series_rows(frame_no, track_indices, values):
+    """
+    Get rows of a frame of time series in the long layout with one row per region
+    :param frame_no: frame number of the frame
+    :param track_indices: track index of each region returned from LineageBuilder.add_frame()
+    :param values: feature value array with one row per region and one column per feature
+    :return: list of rows each holding the track id, the frame number and the feature values
+    """
+    return [[track + 1, frame_no] + value
+            for track, value in zip(track_indices.tolist(), values.tolist())]
+
+
+def write_lineage(fwriter, tracks):
+    """
+    Write the track lineage table with one row per track
+    :param fwriter: csv writer to write rows with
+    :param tracks: list of tracks of LineageBuilder
+    :return:
+    """
+    fwriter.writerow(['track', 'start_frame_no', 'end_frame_no', 'parent_track'])
+    for track_id, start_frame_no, end_frame_no, parent in tracks:
+        fwriter.writerow([track_id, start_frame_no, end_frame_no, parent or ''])
+
+
+def get_time_series_file_name(layout, output_format):
+    """
+    Get the time series file name of a layout in an output format
+    :param layout: WIDE_LAYOUT or LONG_LAYOUT
+    :param output_format: one of TIME_SERIES_FORMATS
+    :return: file name, e.g., time_series.csv.gz for the wide layout in GZIP_CSV_FORMAT
+    """
+    return os.path.splitext(TIME_SERIES_FILES[layout])[0] + '.' + output_format
+
+
+@contextmanager
+def open_csv_writer(stream, compress=False):
+    """
+    Wrap a binary stream with a csv writer which optionally gzips rows on the fly as they are
+    written. The stream itself is left open when the writer is closed.
+    :param stream: writable binary file-like object, e.g., from open_write_stream() of the iRODS
+    storage
+    :param compress: gzip written rows if True
+    :return: csv writer
+    """
+    gz = gzip.GzipFile(fileobj=stream, mode='wb') if compress else None
+    text = io.TextIOWrapper(gz if gz else stream, encoding='utf-8', newline='')
+    try:
+        yield csv.writer(text)
+    finally:
+        text.flush()
+        text.detach()
+        if gz:
+            # writes the gzip trailer without closing the stream
+            gz.close()
+
+
+class LongTimeSeriesWriter(object):
+    """
+    Write time series in the long layout as csv, writing the rows of each frame as soon as the
+    frame is added so that only one frame is held in memory
+    """
+
+    def __init__(self, fwriter, features):
+        """
+        :param fwriter: csv writer to write rows with
+        :param features: features in TIME_SERIES_FEATURES the feature values hold
+        """
+        self._fwriter = fwriter
+        self._fwriter.writerow(get_long_time_series_header(features))
+
+    def add_frame(self, frame_no, track_indices, values):
+        """
+        write the rows of the next frame
+        :param frame_no: frame number of the frame
+        :param track_indices: track index of each region returned from LineageBuilder.add_frame()
+        :param values: feature value array with one row per region and one column per feature
+        """
+        self._fwriter.writerows(get_long_time_series_rows(frame_no, track_indices, values))
+
+    def finish(self, num_tracks):
+        """
+        finish writing time series once all frames are added
+        :param num_tracks: number of tracks in the lineage table
+        """
+        pass
+
+
+class WideTimeSeriesWriter(object):
+    """
+    Write time series in the wide layout as csv. The number of columns is only known once cells
+    in all frames are linked, so the compact track indices and feature values of each frame are
+    spilled to a local temporary file as frames are added and read back one frame at a time to
+    write rows when the writer is finished
+    """
+
+    def __init__(self, fwriter, features):
+        """
+        :param fwriter: csv writer to write rows with
+        :param features: features in TIME_SERIES_FEATURES the feature values hold
+        """
+        self._fwriter = fwriter
+        self._features = features
+        self._spill = TemporaryFile()
+        self._num_frames = 0
+
+    def add_frame(self, frame_no, track_indices, values):
+        np.save(self._spill, track_indices)
+        np.save(self._spill, values)
+        self._num_frames += 1
+
+    def _read_frames(self):
+        self._spill.seek(0)
+        for _ in range(self._num_frames):
+            yield np.load(self._spill), np.load(self._spill)
+
+    def finish(self, num_tracks):
+        try:
+            write_wide_time_series(self._fwriter, num_tracks, self._read_frames(), self._features)
+        finally:
+            self._spill.close()
+
+
+class ParquetTimeSeriesWriter(object):
+    """
+    Write time series in the long layout as a Parquet file with one row group per frame, writing
+    each frame as soon as it is added so that only one frame is held in memory. pyarrow must be
+    installed to write Parquet files.
+    """
+
+    def __init__(self, stream, features):
+        """
+        :param stream: writable binary file-like object
+        :param features: features in TIME_SERIES_FEATURES the feature values hold
+        """
+        self._schema = pyarrow.schema(
+            [('track', pyarrow.int64()), ('frame_no', pyarrow.int64())] +
+            [(feature, pyarrow.float64()) for feature in features])
+        self._writer = pyarrow.parquet.ParquetWriter(stream, self._schema)
+
+    def add_frame(self, frame_no, track_indices, values):
+        arrays = [pyarrow.array(np.asarray(track_indices, dtype=np.int64) + 1),
+                  pyarrow.array(np.full(len(track_indices), frame_no, dtype=np.int64))]
+        arrays += [pyarrow.array(values[:, i]) for i in range(values.shape[1])]
+        self._writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self._schema))
+
+    def finish(self, num_tracks):
+        self._writer.close()
+
+
+def get_time_series_format_error(layout, output_format):
+    """
+    Check whether an output format can be written in a layout in this environment
+    :param layout: WIDE_LAYOUT or LONG_LAYOUT
+    :param output_format: one of TIME_SERIES_FORMATS
+    :return: None if the format can be written, or an error message otherwise
+    """
+    if output_format == PARQUET_FORMAT:
+        if layout != LONG_LAYOUT:
+            return 'Format ' + output_format + ' only supports the long layout'
+        if pyarrow is None:
+            return 'Format ' + output_format + ' requires pyarrow to be installed'
+    return None
+
+
+@contextmanager
+def open_time_series_writer(stream, layout, output_format, features):
+    """
+    Open a time series writer writing to a binary stream, which takes frames in frame order with
+    add_frame(frame_no, track_indices, values) and is finished with finish(num_tracks)
+    :param stream: writable binary file-like object, e.g., from open_write_stream() of the iRODS
+    storage
+    :param layout: WIDE_LAYOUT or LONG_LAYOUT
+    :param output_format: one of TIME_SERIES_FORMATS. PARQUET_FORMAT only supports LONG_LAYOUT and
+    requires pyarrow
+    :param features: features in TIME_SERIES_FEATURES the feature values hold
+    :return: time series writer
+    """
+    if output_format == PARQUET_FORMAT:
+        err_msg = get_time_series_format_error(layout, output_format)
+        if err_msg:
+            raise ValueError(err_msg)
+        yield ParquetTimeSeriesWriter(stream, features)
+    elif output_format in (CSV_FORMAT, GZIP_CSV_FORMAT):
+        with open_csv_writer(stream, compress=output_format == GZIP_CSV_FORMAT) as fwriter:
+            if layout == LONG_LAYOUT:
+                yield LongTimeSeriesWriter(fwriter, features)
+            else:
+                yield WideTimeSeriesWriter(fwriter, features)
+    else:
+        raise ValueError('Format ' + output_format + ' is not supported')
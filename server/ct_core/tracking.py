@@ -0,0 +1,203 @@
+import hashlib
+import json
+
+import numpy as np
+
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+NEAREST_LINKING = 'nearest'
+ASSIGNMENT_LINKING = 'assignment'
+
+
+def pack_frame_regions(regions):
+    """
+    Pack vertices of all regions in a frame into one numpy array so that per-region computation
+    can be done in a batch rather than in a python loop over regions
+    :param regions: list of region dicts in a frame, each of which has a vertices list in the
+    format of [[y, x], ...]
+    :return: a tuple of (vertices, counts) where vertices is a 2D float array holding vertices of
+    all regions concatenated in region order and counts is an int array holding the number of
+    vertices for each region
+    """
+    counts = np.fromiter((len(region['vertices']) for region in regions), dtype=np.intp,
+                         count=len(regions))
+    if not counts.sum():
+        return np.empty((0, 2)), counts
+    vertices = np.array([v for region in regions for v in region['vertices']], dtype=float)
+    return vertices, counts
+
+
+def compute_centroids(vertices, counts):
+    """
+    Compute centroids of all regions in a frame in one batched pass
+    :param vertices: 2D numpy array holding packed vertices of all regions returned from
+    pack_frame_regions()
+    :param counts: numpy array holding number of vertices for each region returned from
+    pack_frame_regions()
+    :return: 2D numpy array with one centroid per region, which is NaN for regions without vertices
+    """
+    centroids = np.full((counts.shape[0], 2), np.nan)
+    non_empty = counts > 0
+    if vertices.shape[0]:
+        starts = np.cumsum(counts) - counts
+        sums = np.add.reduceat(vertices, starts[non_empty], axis=0)
+        centroids[non_empty] = sums / counts[non_empty, np.newaxis]
+    return centroids
+
+
+def get_frame_centroids(regions):
+    """
+    Compute centroids of all regions in a frame
+    :param regions: list of region dicts in a frame
+    :return: 2D numpy array with one centroid per region
+    """
+    vertices, counts = pack_frame_regions(regions)
+    return compute_centroids(vertices, counts)
+
+
+def compute_regions_hash(regions):
+    """
+    Compute a content hash of the regions in a frame that changes whenever a region is added,
+    removed or reshaped, but not when link_id of a region is updated by tracking
+    :param regions: list of region dicts in a frame
+    :return: hex digest string of the hash
+    """
+    content = [[region['id'], region['vertices']] for region in regions]
+    return hashlib.sha1(json.dumps(content, separators=(',', ':')).encode()).hexdigest()
+
+
+def centroids_to_bytes(centroids):
+    """
+    Serialize a 2D centroid array returned from compute_centroids() for storing in database
+    """
+    return np.ascontiguousarray(centroids, dtype=np.float64).tobytes()
+
+
+def centroids_from_bytes(buf):
+    """
+    Deserialize a 2D centroid array serialized by centroids_to_bytes()
+    """
+    return np.frombuffer(bytes(buf), dtype=np.float64).reshape(-1, 2)
+
+
+def link_to_nearest(cur_centroids, pre_centroids):
+    """
+    Link each region in the current frame to the region in the previous frame that has the nearest
+    centroid using a KD-tree built on previous frame centroids
+    :param cur_centroids: 2D numpy array holding centroids of regions in the current frame
+    :param pre_centroids: 2D numpy array holding centroids of regions in the previous frame
+    :return: int numpy array holding index of the linked region in the previous frame for each
+    region in the current frame, or -1 if the region cannot be linked
+    """
+    linked_idx = np.full(cur_centroids.shape[0], -1, dtype=np.intp)
+    cur_valid = np.flatnonzero(~np.isnan(cur_centroids).any(axis=1))
+    pre_valid = np.flatnonzero(~np.isnan(pre_centroids).any(axis=1))
+    if not cur_valid.shape[0] or not pre_valid.shape[0]:
+        return linked_idx
+    tree = cKDTree(pre_centroids[pre_valid])
+    _, idx = tree.query(cur_centroids[cur_valid])
+    linked_idx[cur_valid] = pre_valid[idx]
+    return linked_idx
+
+
+def _link_component(cur_idx, pre_idx, gated_cur, gated_pre, gated_dist, max_distance):
+    """
+    internal method to solve the min-cost assignment problem for one connected component of the
+    gating graph, with births and deaths handled by dummy rows and columns
+    :param cur_idx: sorted indices of regions in the current frame belonging to the component
+    :param pre_idx: sorted indices of regions in the previous frame belonging to the component
+    :param gated_cur: current frame region index of each gated candidate link in the component
+    :param gated_pre: previous frame region index of each gated candidate link in the component
+    :param gated_dist: centroid distance of each gated candidate link in the component
+    :param max_distance: cost of leaving a region in either frame unlinked
+    :return: a tuple of (current indices, previous indices) of linked regions
+    """
+    r = cur_idx.shape[0]
+    c = pre_idx.shape[0]
+    rows = np.searchsorted(cur_idx, gated_cur)
+    cols = np.searchsorted(pre_idx, gated_pre)
+    # any cost above the cost of leaving both regions unlinked can never be chosen
+    no_link = 4 * max_distance + 1
+    cost = np.full((r + c, c + r), no_link)
+    # top-left block holds gated link costs, bottom-right block lets unused dummy rows and
+    # columns pair up for free wherever a real link would be allowed
+    cost[rows, cols] = gated_dist
+    cost[r + cols, c + rows] = 0
+    # top-right diagonal is the birth of a region in the current frame, bottom-left diagonal is
+    # the death of a region in the previous frame
+    cost[np.arange(r), c + np.arange(r)] = max_distance
+    cost[r + np.arange(c), np.arange(c)] = max_distance
+    row_ind, col_ind = linear_sum_assignment(cost)
+    linked = (row_ind < r) & (col_ind < c)
+    linked[linked] = cost[row_ind[linked], col_ind[linked]] < no_link
+    return cur_idx[row_ind[linked]], pre_idx[col_ind[linked]]
+
+
+def link_by_assignment(cur_centroids, pre_centroids, max_distance):
+    """
+    Link regions in the current frame to regions in the previous frame by solving a globally
+    optimal min-cost assignment problem so that no two regions claim the same parent. Candidate
+    links are gated by max_distance, and the problem is split into connected components of the
+    gating graph so that each component is solved independently
+    :param cur_centroids: 2D numpy array holding centroids of regions in the current frame
+    :param pre_centroids: 2D numpy array holding centroids of regions in the previous frame
+    :param max_distance: maximum centroid distance for two regions to be linked
+    :return: int numpy array holding index of the linked region in the previous frame for each
+    region in the current frame, or -1 if the region is a birth that cannot be linked
+    """
+    n_cur = cur_centroids.shape[0]
+    n_pre = pre_centroids.shape[0]
+    linked_idx = np.full(n_cur, -1, dtype=np.intp)
+    cur_valid = np.flatnonzero(~np.isnan(cur_centroids).any(axis=1))
+    pre_valid = np.flatnonzero(~np.isnan(pre_centroids).any(axis=1))
+    if not cur_valid.shape[0] or not pre_valid.shape[0]:
+        return linked_idx
+
+    cur_tree = cKDTree(cur_centroids[cur_valid])
+    pre_tree = cKDTree(pre_centroids[pre_valid])
+    gated = cur_tree.sparse_distance_matrix(pre_tree, max_distance, output_type='ndarray')
+    if not gated.shape[0]:
+        return linked_idx
+    gated_cur = cur_valid[gated['i']]
+    gated_pre = pre_valid[gated['j']]
+
+    # split the bipartite gating graph into connected components, with current frame regions
+    # numbered first followed by previous frame regions
+    graph = coo_matrix((np.ones(gated.shape[0]), (gated_cur, n_cur + gated_pre)),
+                       shape=(n_cur + n_pre, n_cur + n_pre))
+    _, labels = connected_components(graph, directed=False)
+    edge_labels = labels[gated_cur]
+    order = np.argsort(edge_labels, kind='stable')
+    bounds = np.flatnonzero(np.diff(edge_labels[order])) + 1
+    for edges in np.split(order, bounds):
+        cur_idx = np.unique(gated_cur[edges])
+        pre_idx = np.unique(gated_pre[edges])
+        if cur_idx.shape[0] == 1 and pre_idx.shape[0] == 1:
+            # a single candidate link is always taken
+            linked_idx[cur_idx[0]] = pre_idx[0]
+            continue
+        linked_cur, linked_pre = _link_component(cur_idx, pre_idx, gated_cur[edges],
+                                                 gated_pre[edges], gated['v'][edges],
+                                                 max_distance)
+        linked_idx[linked_cur] = linked_pre
+    return linked_idx
+
+
+def link_frames(cur_centroids, pre_centroids, method=NEAREST_LINKING, max_distance=None):
+    """
+    Link regions in the current frame to regions in the previous frame using the requested method
+    :param cur_centroids: 2D numpy array holding centroids of regions in the current frame
+    :param pre_centroids: 2D numpy array holding centroids of regions in the previous frame
+    :param method: NEAREST_LINKING by default to link each region to its nearest previous region;
+    ASSIGNMENT_LINKING to solve a gated min-cost assignment problem
+    :param max_distance: maximum centroid distance for two regions to be linked, only used by
+    ASSIGNMENT_LINKING
+    :return: int numpy array holding index of the linked region in the previous frame for each
+    region in the current frame, or -1 if the region cannot be linked
+    """
+    if method == ASSIGNMENT_LINKING:
+        return link_by_assignment(cur_centroids, pre_centroids, max_distance)
+    return link_to_nearest(cur_centroids, pre_centroids)
@@ -30,10 +30,16 @@ urlpatterns = [
         name='save_tracking_data'),
     url(r'^get_frame_seg_data/(?P<exp_id>.*)/(?P<frame_no>[0-9]+)$', views.get_frame_seg_data,
         name='get_frame_seg_data'),
+    url(r'^get_frames_seg_data/(?P<exp_id>.*)/(?P<start_frame_no>[0-9]+)/(?P<end_frame_no>[0-9]+)$',
+        views.get_frames_seg_data, name='get_frames_seg_data'),
     url(r'^save_segmentation_data/(?P<exp_id>.*)/(?P<frame_no>[0-9]+)$', views.save_frame_seg_data,
         name='save_frame_seg_data'),
     url(r'^check_task_status/$', views.check_task_status, name='check_task_status'),
     url(r'^download/(?P<exp_id>.*)/(?P<username>.*)$', views.download, name='download'),
+    url(r'^export_time_series_data/(?P<exp_id>.*)/$', views.export_time_series_data,
+        name='export_time_series_data'),
+    url(r'^download_time_series_data/(?P<exp_id>.*)/(?P<export_key>[0-9a-f]{40})/(?P<file_name>[\w.]+)$',
+        views.download_time_series_data, name='download_time_series_data'),
     url(r'^get_user_frame_info/(?P<exp_id>.*)/(?P<username>.*)/(?P<frame_no>[0-9]+)$',
         views.get_user_frame_info, name='get_user_frame_info'),
     url(r'^get_user_total_edit_frames/(?P<exp_id>.*)/(?P<username>.*)$',
@@ -52,4 +58,11 @@ urlpatterns = [
     url(r'^update_colormap_association/(?P<exp_id>.*)/$', views.update_colormap_association,
         name='update_colormap_association'),
     url(r'^get_score/(?P<exp_id>.*)/(?P<frame_no>[0-9]+)$', views.get_score, name='get_score'),
+    url(r'^get_scores/(?P<exp_id>.*)/(?P<frame_no>[0-9]+)$', views.get_scores, name='get_scores'),
+    url(r'^get_irods_session_pool_metrics/$', views.get_irods_session_pool_metrics,
+        name='get_irods_session_pool_metrics'),
+    url(r'^get_image_cache_stats/$', views.get_image_cache_stats, name='get_image_cache_stats'),
+    url(r'^get_frame_cache_stats/$', views.get_frame_cache_stats, name='get_frame_cache_stats'),
+    url(r'^get_score_model_metrics/$', views.get_score_model_metrics,
+        name='get_score_model_metrics'),
 ]
@@ -1,76 +1,123 @@
 import cv2
 import time
+import logging
 import os
 import shutil
 import csv
 import json
 import errno
+import hashlib
 import datetime
-import pytz
 import numpy as np
 
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 
-from irods.session import iRODSSession
 from irods.exception import CollectionDoesNotExist
 from irods.meta import iRODSMeta
 
 from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
 from django.core.exceptions import ObjectDoesNotExist
+from django.contrib.auth.models import User
+from django.db import transaction, connections
+from django.db.models import Func, TextField, CharField
+from django.db.models.functions import Cast
 
-from django_irods.storage import IrodsStorage
+from django_irods.storage import get_irods_storage, IrodsFileInfo
 from django_irods.icommands import SessionException
+from django_irods.session_pool import irods_session
 
 from wand.image import Image
 
-from ct_core.models import Segmentation, UserSegmentation, UserProfile, get_path, ExperimentInfo
-from ct_core.task_utils  import get_exp_frame_no, validate_user, is_power_user, get_experiment_frame_seg_data
+from ct_core.image_cache import get_cached_image, get_cache_key
+from ct_core.frame_cache import get_frame_array, get_stack_root, write_frame_stack, load_frame_stack
+from ct_core.time_series import measure_frame_regions, LineageBuilder, write_lineage, \
+    open_csv_writer, open_time_series_writer, get_time_series_file_name, TIME_SERIES_FEATURES, \
+    TIME_SERIES_FILES, TIME_SERIES_FORMATS, LINEAGE_FILE, WIDE_LAYOUT, CSV_FORMAT, \
+    get_time_series_format_error
+from ct_core.seg_codec import write_frame_files
+from ct_core.models import Segmentation, UserSegmentation, UserProfile, get_path, ExperimentInfo, \
+    TrackingState, SegmentationRegion, ExperimentLock
+from ct_core.task_utils  import get_exp_frame_no, validate_user, is_power_user, get_experiment_frame_seg_data, \
+    get_experiment_seg_data_by_frame, get_frame_index, invalidate_frame_index, save_seg_regions
+
+
+logger = logging.getLogger(__name__)
+
+
+def _get_lock_cache_key(exp_id):
+    return 'experiment_lock:{}'.format(exp_id)
 
 
 def is_exp_locked(exp_id):
     """
-    Check if experiment is locked, and if yes, check whether lock needs to be released
+    Check if experiment is locked by an unexpired lock. The result is cached for
+    EXPERIMENT_LOCK_CACHE_SECONDS so that the check does not hit the database on every request
     :param exp_id: experiment id
-    :return: True and locked user if it is locked, False otherwise
+    :return: True and the username of the lock owner if it is locked, False and None otherwise
     """
-    lock_obj = Segmentation.objects.filter(exp_id=exp_id, locked_time__isnull=False).first()
-    if lock_obj:
-        # this experiment is locked, check whether lock release is needed
-        elapsed_time = datetime.datetime.now(pytz.utc) - lock_obj.locked_time
-        if elapsed_time.seconds >= settings.LOCK_TIMEOUT_SECONDS:
-            # release the lock
-            lock_obj.locked_time = None
-            lock_obj.locked_user = None
-            lock_obj.save()
-            return False, None
+    cache_key = _get_lock_cache_key(exp_id)
+    lock_username = cache.get(cache_key)
+    if lock_username is None:
+        now = timezone.now()
+        lock = ExperimentLock.objects.filter(exp_id=exp_id, expire_time__gt=now).values_list(
+            'user__username', 'expire_time').first()
+        if lock:
+            lock_username, expire_time = lock
+            timeout = min(settings.EXPERIMENT_LOCK_CACHE_SECONDS,
+                          (expire_time - now).total_seconds())
         else:
-            # experiment is locked
-            return True, lock_obj.locked_user
-    else:
-        return False, None
+            lock_username = ''
+            timeout = settings.EXPERIMENT_LOCK_CACHE_SECONDS
+        cache.set(cache_key, lock_username, timeout)
+    if lock_username:
+        return True, lock_username
+    return False, None
 
 
 def release_locks_by_user(u):
     if u and not u.is_anonymous:
-        for item in Segmentation.objects.filter(locked_user=u):
-            item.locked_time = None
-            item.locked_user = None
-            item.save()
+        with transaction.atomic():
+            locks = ExperimentLock.objects.select_for_update().filter(user=u)
+            exp_ids = [lock.exp_id for lock in locks]
+            locks.delete()
+        cache.delete_many([_get_lock_cache_key(exp_id) for exp_id in exp_ids])
 
 
 def lock_experiment(exp_id, u):
-    try:
-        if u and not u.is_anonymous:
-            # release lockes this user placed on other experiments before locking this experiment
-            release_locks_by_user(u)
-            # lock this experiment by this user
-            entry = Segmentation.objects.get(exp_id=exp_id, frame_no=1)
-            entry.locked_time = datetime.datetime.now(pytz.utc)
-            entry.locked_user = u
-            entry.save()
-    except ObjectDoesNotExist:
-        pass
+    """
+    Lock experiment by a user unless it is locked by another user, releasing locks the user
+    placed on other experiments. An existing lock row is locked with select_for_update so that
+    two users cannot acquire the same lock at the same time
+    :param exp_id: experiment id
+    :param u: requesting user
+    :return: the username of the lock owner after the call, which is the requesting user's
+    username if the lock is acquired, or None if the user cannot lock experiments
+    """
+    if not u or u.is_anonymous:
+        return None
+    # release locks this user placed on other experiments before locking this experiment
+    release_locks_by_user(u)
+    now = timezone.now()
+    expire_time = now + datetime.timedelta(seconds=settings.LOCK_TIMEOUT_SECONDS)
+    with transaction.atomic():
+        lock, created = ExperimentLock.objects.select_for_update().select_related(
+            'user').get_or_create(exp_id=exp_id, defaults={'user': u,
+                                                           'locked_time': now,
+                                                           'expire_time': expire_time})
+        if not created:
+            if lock.user_id != u.id and lock.expire_time > now:
+                # experiment is locked by another user
+                return lock.user.username
+            lock.user = u
+            lock.locked_time = now
+            lock.expire_time = expire_time
+            lock.save()
+    cache.delete(_get_lock_cache_key(exp_id))
+    return u.username
 
 
 def pack_zeros(input_str, string_len=settings.MAX_PRIORITY_STRING_LEN):
@@ -119,12 +166,11 @@ def get_experiment_list_util(req_user=None):
     no filtering of experiment list is needed. Otherwise, locked experiments need to be filtered out
     :return: experiment list and error message
     """
-    istorage = IrodsStorage()
+    istorage = get_irods_storage()
     exp_sorted_list = istorage.get_sorted_exp_list()
     exp_list = []
     locked_exp_list = []
-    with iRODSSession(host=settings.IRODS_HOST, port=settings.IRODS_PORT, user=settings.IRODS_USER,
-                      password=settings.IRODS_PWD, zone=settings.IRODS_ZONE) as session:
+    with irods_session() as session:
         hpath = '/{}/home/{}'.format(settings.IRODS_ZONE, settings.IRODS_USER)
         if not exp_sorted_list:
             # the list is not sorted by priority yet, so sort it now
@@ -164,10 +210,10 @@ def get_experiment_list_util(req_user=None):
                 if req_user:
                     exp_dict['start_frame'] = get_start_frame(req_user, exp_id)
                 if req_user:
-                    locked, l_user = is_exp_locked(exp_id)
+                    locked, lock_username = is_exp_locked(exp_id)
                     if locked:
                         # experiment is locked
-                        exp_dict['locked_by'] = l_user.username
+                        exp_dict['locked_by'] = lock_username
                         locked_exp_list.append(exp_dict)
                     else:
                         exp_dict['locked_by'] = ''
@@ -183,8 +229,7 @@ def get_experiment_list_util(req_user=None):
 
 
 def get_exp_labels(exp_id):
-    with iRODSSession(host=settings.IRODS_HOST, port=settings.IRODS_PORT, user=settings.IRODS_USER,
-                      password=settings.IRODS_PWD, zone=settings.IRODS_ZONE) as session:
+    with irods_session() as session:
         epath = '/' + settings.IRODS_ZONE + '/home/' + settings.IRODS_USER + '/' + str(exp_id)
         try:
             coll = session.collections.get(epath)
@@ -268,7 +313,7 @@ def extract_images_from_video_to_irods(exp_id='', video_input_file='', istorage=
 
     try:
         if not istorage:
-            istorage = IrodsStorage()
+            istorage = get_irods_storage()
 
         irods_path = exp_id + '/data/video/' + video_filename
 
@@ -291,6 +336,7 @@ def extract_images_from_video_to_irods(exp_id='', video_input_file='', istorage=
             istorage.save_file(ifile, irods_path + ofile)
             # clean up
             os.remove(ifile)
+        invalidate_frame_index(exp_id)
         # success
         return 'success'
     except SessionException as ex:
@@ -302,43 +348,26 @@ def read_image_frame(exp_id, image_fname):
     ifile = os.path.join(settings.IRODS_ROOT, exp_id, 'image', image_fname)
     prop_dict = {}
     if os.path.isfile(ifile):
-        img = cv2.imread(ifile, cv2.IMREAD_GRAYSCALE)
+        img = get_frame_array(ifile)
         rows, cols = img.shape
         prop_dict['width'] = cols
         prop_dict['height'] = rows
-        k = []
-        for i in range(rows):
-            k_row = []
-            for j in range(cols):
-                k_row.append(img[i, j])
-            k.append(k_row)
-        prop_dict['intensity_values'] = k
+        prop_dict['intensity_values'] = img.tolist()
     return prop_dict
 
 
 def get_exp_image_size(exp_id):
-    istorage = IrodsStorage()
-    irods_img_path = os.path.join(exp_id, 'data', 'image', 'jpg')
-    file_list = istorage.listdir(irods_img_path)[1]
-    if len(file_list) > 0:
-        img_name = file_list[0]
-        image_path = os.path.join(settings.IRODS_ROOT, exp_id, 'image')
-        if not os.path.exists(image_path):
-            os.makedirs(image_path)
-        ifile = os.path.join(image_path, img_name)
-        if os.path.isfile(ifile):
-            img = cv2.imread(ifile, cv2.IMREAD_GRAYSCALE)
-            rows, cols = img.shape
-            return rows, cols
-        else:
-            dest_path = istorage.get_one_image_frame(exp_id, 'jpg', img_name, image_path)
-            ifile = os.path.join(dest_path, img_name)
-            if os.path.isfile(ifile):
-                img = cv2.imread(ifile, cv2.IMREAD_GRAYSCALE)
-                rows, cols = img.shape
-                return rows, cols
-            else:
-                return -1, -1
+    _, index = get_frame_index(exp_id, 'jpg')
+    if not index['files']:
+        return -1, -1
+    img_name = index['gray'].get('1', next(iter(index['files'])))
+    ifile = get_cached_image(get_irods_storage(), exp_id, 'jpg', img_name,
+                             IrodsFileInfo(*index['files'][img_name]))
+    img = get_frame_array(ifile)
+    if img is None:
+        return -1, -1
+    rows, cols = img.shape
+    return rows, cols
 
 
 def get_exp_image(exp_id, frame_no, type='jpg', gray=True):
@@ -350,74 +379,82 @@ def get_exp_image(exp_id, frame_no, type='jpg', gray=True):
     :param gray: whether to always return the native grayscale image, with default being True
     :return: image file name, error message if any
     """
-    image_path = os.path.join(settings.IRODS_ROOT, exp_id, 'image')
-    # if os.path.exists(image_path):
-    #    shutil.rmtree(image_path)
-    try:
-        if not os.path.exists(image_path):
-            os.makedirs(image_path)
-    except OSError:
-        # path already exists
-        pass
-    fno = int(frame_no)
-    istorage = IrodsStorage()
-    irods_img_path = os.path.join(exp_id, 'data', 'image', type)
-    file_list = istorage.listdir(irods_img_path)[1]
-    flistlen = len(file_list)
-    if flistlen <= 0:
-        return None, "Requested experiment does not contain any image"
-    if fno > flistlen:
-        return None, 'Requested frame_no does not exist'
-
-    # check whether image frame data in iRODS backend starts with 1 or 0
-    if "frame0.jpg" in file_list and frame_no > 0:
-        fno -= 1
-
-    need_gray = gray
+    img_file, _, _, err_msg = get_exp_image_info(exp_id, frame_no, type=type, gray=gray)
+    return img_file, err_msg
+
+
+def get_exp_image_info(exp_id, frame_no, type='jpg', gray=True):
+    """
+    return the specified frame image in the specified experiment along with its iRODS file info
+    and whether it is the grayscale image requested rather than a fallback for a color image
+    that has not been generated yet
+    :param exp_id: experiment id
+    :param frame_no: frame number that starts from 1
+    :param type: jpg or png, with default being jpg
+    :param gray: whether to always return the native grayscale image, with default being True
+    :return: image file name, IrodsFileInfo of the image, True if grayscale image is requested,
+    error message if any
+    """
+    exp_info, index = get_frame_index(exp_id, type)
+    if not index['files']:
+        return None, None, None, "Requested experiment does not contain any image"
+
+    need_gray = gray or not exp_info or exp_info.colormap == 'gray'
+    frame_str = str(int(frame_no))
+    img_name = None
     if not need_gray:
-        exp_info = ExperimentInfo.objects.filter(exp_id=exp_id).first()
-        if exp_info:
-            if exp_info.colormap == 'gray':
-                need_gray = True
-        else:
-            need_gray = True
-    if need_gray:
-        prefix_str = 'frame'
-    else:
-        prefix_str = 'color_frame'
-    img_name = prefix_str + str(fno) + '.jpg'
-    if not img_name in file_list:
-        if len(file_list) == 1:
-            if fno == 1:
-                img_name = file_list[0]
-            else:
-                return None, 'Requested frame_no does not exist'
-        else:
-            img1_name = file_list[0]
-            if img1_name.startswith('frame'):
-                start_idx = len('frame')
-            else:
-                start_idx = len('color_frame')
-            seq_len = len(img1_name[start_idx:-4])
-            if len(frame_no) > seq_len:
-                return None, 'Requested frame_no does not exist'
-            elif len(frame_no) == seq_len:
-                img_name = prefix_str + frame_no + '.' + type
-            else:
-                # len(frame_no) < seq_len
-                packstr = pack_zeros(frame_no, seq_len)
-                img_name = prefix_str + packstr + '.' + type
-
-    ifile = os.path.join(image_path, img_name)
-    if os.path.isfile(ifile):
-        return ifile, None
-    else:
-        dest_path = istorage.get_one_image_frame(exp_id, type, img_name, image_path)
-        ifile = os.path.join(dest_path, img_name)
-        if os.path.isfile(ifile):
-            return ifile, None
-        else:
-            return None, 'Requested image frame does not exist'
+        img_name = index['color'].get(frame_str)
+    if not img_name:
+        # fall back to the grayscale image if the colormap has not been applied yet
+        img_name = index['gray'].get(frame_str)
+    if not img_name:
+        return None, None, None, 'Requested frame_no does not exist'
+
+    file_info = IrodsFileInfo(*index['files'][img_name])
+    try:
+        img_file = get_cached_image(get_irods_storage(), exp_id, type, img_name, file_info)
+        return img_file, file_info, need_gray, None
+    except (SessionException, OSError) as ex:
+        # the frame index could be stale, so rebuild it on next request
+        invalidate_frame_index(exp_id)
+        logger.error('Cannot retrieve image frame {} of experiment {}: {}'.format(img_name, exp_id,
+                                                                              str(ex)))
+        return None, None, None, 'Requested image frame does not exist'
+
+
+def get_exp_frame_stack(exp_id):
+    """
+    return all grayscale frame images of an experiment as one read-only memory-mapped stack,
+    writing the stack from the frame images first if it does not exist yet. The stack file name
+    is derived from the versions of all frame images so that the stack is rewritten whenever
+    any frame image changes.
+    :param exp_id: experiment id
+    :return: uint8 array of shape (frames, rows, cols) indexed by zero-based frame index,
+    error message if any
+    """
+    _, index = get_frame_index(exp_id, 'jpg')
+    frame_count = len(index['gray'])
+    img_names = [index['gray'].get(str(i)) for i in range(1, frame_count + 1)]
+    if not img_names or None in img_names:
+        return None, "Requested experiment does not contain all frame images"
+
+    file_infos = [IrodsFileInfo(*index['files'][img_name]) for img_name in img_names]
+    version = hashlib.sha1(''.join(
+        get_cache_key(exp_id, 'jpg', img_name, file_info)
+        for img_name, file_info in zip(img_names, file_infos)).encode()).hexdigest()
+    stack_file = os.path.join(get_stack_root(), exp_id, version + '.npy')
+    if not os.path.isfile(stack_file):
+        istorage = get_irods_storage()
+        # retrieve each frame image only when it is decoded so that the image cache does not
+        # need to hold the whole experiment
+        ifiles = (get_cached_image(istorage, exp_id, 'jpg', img_name, file_info)
+                  for img_name, file_info in zip(img_names, file_infos))
+        try:
+            write_frame_stack(stack_file, ifiles, frame_count)
+        except (SessionException, OSError, ValueError) as ex:
+            logger.error('Cannot write frame stack of experiment {}: {}'.format(exp_id, str(ex)))
+            return None, 'Cannot read all frame images of the experiment'
+    return load_frame_stack(stack_file), None
 
 
 def _get_seg_coll(session, exp_id):
@@ -439,19 +476,21 @@ def _get_seg_coll(session, exp_id):
         return None, coll_path
 
 
+@contextmanager
 def get_seg_collection(exp_id):
     """
-    return iRODS collection for segmentation data for experiment id
+    context manager to get iRODS collection for segmentation data for experiment id along with
+    the pooled iRODS session it is retrieved with, which can only be used within the context
+    For example:
+    with get_seg_collection(exp_id) as (session, coll, coll_path):
+        ...
     :param exp_id: experiment id
     :return: irods session, irods collection, irods collection path, which could be None if
     experiment does not have segmentation data
     """
-    with iRODSSession(host=settings.IRODS_HOST, port=settings.IRODS_PORT, user=settings.IRODS_USER,
-                      password=settings.IRODS_PWD, zone=settings.IRODS_ZONE) as session:
+    with irods_session() as session:
         coll, coll_path = _get_seg_coll(session, exp_id)
-        return session, coll, coll_path
-
-    return None, None, None
+        yield session, coll, coll_path
 
 
 def convert_csv_to_json(exp_id):
@@ -462,52 +501,52 @@ def convert_csv_to_json(exp_id):
     :return: a list
     """
     resp_data = []
-    session, coll, coll_path = get_seg_collection(exp_id)
-    if coll:
-        for obj in coll.data_objects:
-            _, ext = os.path.splitext(obj.path)
-            if ext != '.csv':
-                continue
-
-            logical_file = session.data_objects.get(obj.path)
-            with logical_file.open('r') as f:
-                contents = csv.reader(f)
-                last_fno = -1
-                obj_dict = {}
-                frame_ary = []
-                for row in contents:
-                    if not row:
-                        continue
-                    if row[0].startswith('#'):
-                        infostrs = row[0].split(' ')
-                        for istr in infostrs:
-                            istr.strip()
-                            if istr.startswith('frame'):
-                                curr_fno = int(istr[len('frame'):])
-                                if obj_dict:
-                                    frame_ary.append(obj_dict)
-                                    obj_dict = {}
-                                if frame_ary and last_fno < curr_fno:
-                                    # starting a new frame
-                                    resp_data.append(frame_ary)
-                                    frame_ary = []
-                                last_fno = curr_fno
-                            elif istr.startswith('object'):
-                                obj_dict['id'] = istr
-                                obj_dict['frame'] = curr_fno + 1
-                                obj_dict['vertices'] = []
-                        continue
-
-                    x = row[0].strip()
-                    y = row[1].strip()
-                    if 'id' in obj_dict:
-                        obj_dict['vertices'].append([x, y])
-
-                # add last obj_dict into resp_data
-                if obj_dict:
-                    frame_ary.append(obj_dict)
-                    resp_data.append(frame_ary)
-            break
+    with get_seg_collection(exp_id) as (session, coll, coll_path):
+        if coll:
+            for obj in coll.data_objects:
+                _, ext = os.path.splitext(obj.path)
+                if ext != '.csv':
+                    continue
+
+                logical_file = session.data_objects.get(obj.path)
+                with logical_file.open('r') as f:
+                    contents = csv.reader(f)
+                    last_fno = -1
+                    obj_dict = {}
+                    frame_ary = []
+                    for row in contents:
+                        if not row:
+                            continue
+                        if row[0].startswith('#'):
+                            infostrs = row[0].split(' ')
+                            for istr in infostrs:
+                                istr.strip()
+                                if istr.startswith('frame'):
+                                    curr_fno = int(istr[len('frame'):])
+                                    if obj_dict:
+                                        frame_ary.append(obj_dict)
+                                        obj_dict = {}
+                                    if frame_ary and last_fno < curr_fno:
+                                        # starting a new frame
+                                        resp_data.append(frame_ary)
+                                        frame_ary = []
+                                    last_fno = curr_fno
+                                elif istr.startswith('object'):
+                                    obj_dict['id'] = istr
+                                    obj_dict['frame'] = curr_fno + 1
+                                    obj_dict['vertices'] = []
+                            continue
+
+                        x = row[0].strip()
+                        y = row[1].strip()
+                        if 'id' in obj_dict:
+                            obj_dict['vertices'].append([x, y])
+
+                    # add last obj_dict into resp_data
+                    if obj_dict:
+                        frame_ary.append(obj_dict)
+                        resp_data.append(frame_ary)
+                break
 
     return resp_data
 
@@ -518,55 +557,53 @@ def sync_seg_data_to_db(eid):
     :param eid: experiment id
     :return: True if link_id field is already in included in segmentation data, False if otherwise
     """
-    session, coll, coll_path = get_seg_collection(eid)
     link_id_exist = False
-    if coll:
-        for obj in coll.data_objects:
-            basename, ext = os.path.splitext(obj.name)
-            if ext != '.json' or not basename.startswith('frame'):
-                continue
-            logical_file = session.data_objects.get(obj.path)
-            with logical_file.open('r') as json_f:
-                json_data = json.load(json_f)
-                frame_no = int(basename[len('frame'):])
-                if not link_id_exist and frame_no > 1:
-                    for item in json_data:
-                        if "link_id" in item:
-                            link_id_exist = True
-                            break
-                idx = obj.path.find(eid)
-                rel_path = obj.path[idx:]
-                obj, created = Segmentation.objects.get_or_create(exp_id=eid,
-                                                                  frame_no=frame_no,
-                                                                  file=rel_path,
-                                                                  defaults={'data': json_data})
-                if not created:
-                    # Segmentation object already exists, update it with new json data
-                    obj.data = json_data
-                    obj.save()
+    # system segmentation data is replaced by data from iRODS, so its tracking states kept by
+    # add_tracking no longer reflect which frames have been linked
+    TrackingState.objects.filter(exp_id=eid, username='').delete()
+    with get_seg_collection(eid) as (session, coll, coll_path):
+        if coll:
+            for obj in coll.data_objects:
+                basename, ext = os.path.splitext(obj.name)
+                if ext != '.json' or not basename.startswith('frame'):
+                    continue
+                logical_file = session.data_objects.get(obj.path)
+                with logical_file.open('r') as json_f:
+                    json_data = json.load(json_f)
+                    frame_no = int(basename[len('frame'):])
+                    if not link_id_exist and frame_no > 1:
+                        for item in json_data:
+                            if "link_id" in item:
+                                link_id_exist = True
+                                break
+                    idx = obj.path.find(eid)
+                    rel_path = obj.path[idx:]
+                    with transaction.atomic():
+                        obj, created = Segmentation.objects.get_or_create(
+                            exp_id=eid, frame_no=frame_no, file=rel_path,
+                            defaults={'data': json_data})
+                        if not created:
+                            # Segmentation object already exists, update it with new json data
+                            obj.data = json_data
+                            obj.save()
+                        save_seg_regions(eid, '', {frame_no: json_data})
     return link_id_exist
 
 
 def get_edited_frames(username, exp_id):
-    try:
-        user_edit_objs = UserSegmentation.objects.filter(
-            user__username=username, exp_id=exp_id).order_by('frame_no')
-        frm_list = []
-        for obj in user_edit_objs:
-            frm_list.append(str(obj.frame_no))
-        return ', '.join(frm_list)
-    except ObjectDoesNotExist:
-        return ''
+    frm_list = UserSegmentation.objects.filter(
+        user__username=username, exp_id=exp_id).order_by('frame_no').values_list('frame_no',
+                                                                                  flat=True)
+    return ', '.join(str(fno) for fno in frm_list)
 
 
 def get_frame_info(username, fno, exp_id):
-    try:
-        def_seg_obj = Segmentation.objects.get(exp_id=exp_id, frame_no=fno)
-    except ObjectDoesNotExist:
+    # count regions with an indexed query on the region table rather than loading the frame data
+    region_cnt = SegmentationRegion.objects.filter(exp_id=exp_id, username='',
+                                                   frame_no=fno).count()
+    if not region_cnt and not Segmentation.objects.filter(exp_id=exp_id, frame_no=fno).exists():
         return {}
 
-    region_cnt = len(def_seg_obj.data)
-
     try:
         user_edit_objs = UserSegmentation.objects.get(user__username=username, exp_id=exp_id,
                                                       frame_no=fno)
@@ -586,15 +623,10 @@ def get_all_edit_users(exp_id):
     :param exp_id: experiment id
     :return: list of usernames
     """
-    user_list = []
-    user_username_list = []
-    filter_objs = UserSegmentation.objects.filter(exp_id=exp_id)
-    for obj in filter_objs:
-        if obj.user.username not in user_username_list:
-            user_username_list.append(obj.user.username)
-            user_list.append({'username': obj.user.username,
-                             'name': obj.user.get_full_name()})
-    return user_list
+    edit_users = User.objects.filter(
+        id__in=UserSegmentation.objects.filter(exp_id=exp_id).values('user')).only(
+        'username', 'first_name', 'last_name').order_by('username')
+    return [{'username': u.username, 'name': u.get_full_name()} for u in edit_users]
 
 
 def get_start_frame(user, exp_id):
@@ -606,13 +638,10 @@ def get_start_frame(user, exp_id):
     :return: start frame the user has saved segmentation data for the experiment,
     otherwise, return the first frame 1
     """
-    filter_obj = UserSegmentation.objects.filter(user=user, exp_id=exp_id,
-                                                 update_time__isnull=False)
-    if filter_obj.exists():
-        obj = filter_obj.latest('update_time')
-        return obj.frame_no
-    else:
-        return 1
+    frame_no = UserSegmentation.objects.filter(
+        user=user, exp_id=exp_id, update_time__isnull=False).order_by(
+        '-update_time').values_list('frame_no', flat=True).first()
+    return frame_no if frame_no is not None else 1
 
 
 def save_user_seg_data_to_db(user, eid, fno, udata, num_edited):
@@ -629,29 +658,32 @@ def save_user_seg_data_to_db(user, eid, fno, udata, num_edited):
     json_data = json.loads(udata)
     int_fno = int(fno)
     curr_time = timezone.now()
-    obj, created = UserSegmentation.objects.get_or_create(user=user,
-                                                          exp_id=eid,
-                                                          frame_no=int_fno,
-                                                          defaults={'data': json_data,
-                                                                    'num_edited': num_edited,
-                                                                    'update_time': curr_time})
-
-    rel_path = get_path(obj)
-    if created:
-        obj.file = rel_path
-        obj.save()
-    else:
-        # UserSegmentation object already exists, update it with new json data
-        obj.data = json_data
-        obj.num_edited = num_edited
-        obj.update_time = curr_time
-        obj.save()
-
-    # override system ground truth data for power users
-    if is_power_user(user):
-        sys_obj = Segmentation.objects.get(exp_id=eid, frame_no=int_fno)
-        sys_obj.data = json_data
-        sys_obj.save()
+    with transaction.atomic():
+        obj, created = UserSegmentation.objects.get_or_create(user=user,
+                                                              exp_id=eid,
+                                                              frame_no=int_fno,
+                                                              defaults={'data': json_data,
+                                                                        'num_edited': num_edited,
+                                                                        'update_time': curr_time})
+
+        rel_path = get_path(obj)
+        if created:
+            obj.file = rel_path
+            obj.save()
+        else:
+            # UserSegmentation object already exists, update it with new json data
+            obj.data = json_data
+            obj.num_edited = num_edited
+            obj.update_time = curr_time
+            obj.save()
+        save_seg_regions(eid, user.username, {int_fno: json_data})
+
+        # override system ground truth data for power users
+        if is_power_user(user):
+            sys_obj = Segmentation.objects.get(exp_id=eid, frame_no=int_fno)
+            sys_obj.data = json_data
+            sys_obj.save()
+            save_seg_regions(eid, '', {int_fno: json_data})
 
     return
 
@@ -662,8 +694,7 @@ def update_experiment_priority(exp_list):
     :param exp_list: the priority-sorted experiment list to update priority for
     :return: raise exception if failure
     """
-    with iRODSSession(host=settings.IRODS_HOST, port=settings.IRODS_PORT, user=settings.IRODS_USER,
-                      password=settings.IRODS_PWD, zone=settings.IRODS_ZONE) as session:
+    with irods_session() as session:
         index = len(exp_list) - 1
         key = str('priority')
         for exp_id in exp_list:
@@ -679,149 +710,221 @@ def update_experiment_priority(exp_list):
             index -= 1
 
 
-def compute_time_series_and_put_in_irods(exp_id, username=''):
+def _measure_time_series_frame(args):
+    """
+    internal method to measure all regions in a frame for time series computation, which runs in
+    a worker process when frames are measured in parallel
+    :param args: tuple of (exp_id, username, frame_no, features, stack_file) where stack_file is
+    the frame stack file to read the frame image from, or None to read it from the frame image
+    :return: tuple of (region ids, link ids, feature value array with one row per region in
+    region order and one column per feature), error message if any
     """
-    compute average intensity for each cell and output time series data in csv format to iRODS for
-    an experiment
+    exp_id, username, frame_no, features, stack_file = args
+    seg_objs, _ = get_experiment_seg_data_by_frame(exp_id, frame_no, frame_no, username=username)
+    regions = seg_objs[frame_no].data if frame_no in seg_objs else []
+    if stack_file:
+        img = np.asarray(load_frame_stack(stack_file)[frame_no - 1])
+    else:
+        ifile, err_msg = get_exp_image(exp_id, frame_no)
+        if err_msg:
+            return None, err_msg
+        img = get_frame_array(ifile)
+    measures = measure_frame_regions(img, regions)
+    values = np.stack([measures[feature] for feature in features], axis=1)
+    return ([region['id'] for region in regions],
+            [region.get('link_id', '') for region in regions], values), None
+
+
+def measure_time_series_frames(exp_id, frame_count, username='', features=('mean',), workers=1):
+    """
+    measure all regions in all frames of an experiment for time series computation. Frames are
+    independent of each other, so they are measured across a pool of worker processes if
+    workers is greater than 1
     :param exp_id: experiment id
+    :param frame_count: number of frames in the experiment
     :param username: Empty by default. If Empty, use system segmentation tracking data;
     otherwise, use user edit segmentation tracking data
-    :return:
+    :param features: features in TIME_SERIES_FEATURES to measure
+    :param workers: number of worker processes to measure frames with
+    :return: generator of (result, error message) tuples returned from
+    _measure_time_series_frame() in frame order. ValueError is raised if the frame stack of the
+    experiment cannot be written
     """
-    username = str(username)
+    stack_file = None
+    if settings.FRAME_STACK_ENABLED:
+        frames, err_msg = get_exp_frame_stack(exp_id)
+        if err_msg:
+            raise ValueError(err_msg)
+        stack_file = frames.filename
+    args_list = [(exp_id, username, fno, tuple(features), stack_file)
+                 for fno in range(1, frame_count + 1)]
+    if workers <= 1:
+        for args in args_list:
+            yield _measure_time_series_frame(args)
+        return
 
-    fno = get_exp_frame_no(exp_id)
-    if fno < 0:
-        # the experiment does not exist
-        return "Experiment " + exp_id + " does not exist"
-    if not validate_user(username):
+    # worker processes cannot share database connections with this process, so they open their
+    # own connections
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunksize = max(1, len(args_list) // (workers * 4))
+        for result in executor.map(_measure_time_series_frame, args_list, chunksize=chunksize):
+            yield result
+
+
+def validate_time_series_options(username, features, layout, output_format):
+    """
+    validate options of time series computation
+    :param username: user whose edit segmentation data to use, or empty to use system
+    segmentation data
+    :param features: features in TIME_SERIES_FEATURES to output for each cell
+    :param layout: WIDE_LAYOUT or LONG_LAYOUT
+    :param output_format: one of TIME_SERIES_FORMATS
+    :return: None if all options are valid, or an error message otherwise
+    """
+    for feature in features:
+        if feature not in TIME_SERIES_FEATURES:
+            return "Feature " + feature + " is not supported"
+    if layout not in TIME_SERIES_FILES:
+        return "Layout " + layout + " is not supported"
+    if output_format not in TIME_SERIES_FORMATS:
+        return "Format " + output_format + " is not supported"
+    format_err_msg = get_time_series_format_error(layout, output_format)
+    if format_err_msg:
+        return format_err_msg
+    if username and not validate_user(username):
         return username + " is not valid"
+    return None
 
-    min_f = 0
-    max_f = fno
 
-    image_path = os.path.join(settings.IRODS_ROOT, exp_id, 'image')
-    if not os.path.exists(image_path):
-        os.makedirs(image_path)
+def _get_frame_data_hashes(seg_qs):
+    """
+    internal method to get the md5 hash of segmentation data of each frame in a queryset, which
+    is computed in the database so that segmentation data is not transferred
+    """
+    return dict(seg_qs.annotate(data_hash=Func(Cast('data', TextField()), function='md5',
+                                               output_field=CharField())).values_list(
+        'frame_no', 'data_hash'))
 
-    c_row = ['Cell']
-    sp_row = ['Species']
-    f_row = ['Feature']
-    cell_linked_data = []
-    cids_linked_data = []
-    cell_val_rows = []
-    for i in range(min_f, max_f):
-        row = [i]
-        cids = []
-        cell_id_dict = {}
-        seg_obj = get_experiment_frame_seg_data(exp_id, i+1, username=username)
-        ifile, err_msg = get_exp_image(exp_id, str(i+1))
 
-        if err_msg:
-            return err_msg
+def get_time_series_export_key(exp_id, username='', features=('mean',), layout=WIDE_LAYOUT,
+                               output_format=CSV_FORMAT):
+    """
+    get the key of a time series export, which is a hash of the segmentation state time series
+    is computed from along with the export options. Like get_experiment_seg_data_by_frame(), user
+    edit segmentation data is used for frames the user has edited unless the user is a power
+    user, so the key changes whenever a region or a link in the segmentation data the export is
+    computed from changes, and exports of users without edits share the key of the system export
+    :param exp_id: experiment id
+    :param username: Empty by default. If Empty, use system segmentation tracking data;
+    otherwise, use user edit segmentation tracking data
+    :param features: features in TIME_SERIES_FEATURES to output for each cell
+    :param layout: WIDE_LAYOUT or LONG_LAYOUT
+    :param output_format: one of TIME_SERIES_FORMATS
+    :return: hex digest string of the key
+    """
+    frame_hashes = _get_frame_data_hashes(Segmentation.objects.filter(exp_id=exp_id))
+    if username:
+        u = User.objects.select_related('user_profile').get(username=username)
+        if not is_power_user(u):
+            frame_hashes.update(_get_frame_data_hashes(UserSegmentation.objects.filter(
+                exp_id=exp_id, user=u)))
+    content = [exp_id, sorted(frame_hashes.items()), list(features), layout, output_format]
+    return hashlib.sha1(json.dumps(content, separators=(',', ':')).encode()).hexdigest()
 
-        img = cv2.imread(ifile, cv2.IMREAD_GRAYSCALE)
-        rows, cols = img.shape
 
-        cell_no = 1
-        for region in seg_obj.data:
-            vertices = region['vertices']
-            # create numpy array from vertices
-            ary_vertices = np.array(vertices)
-            # vertices are normalized into [0, 1], need to restore to original coordinates
-            ary_vertices = np.rint(np.multiply(ary_vertices, [cols, rows]))
-            ypts = ary_vertices[:, 0]
-            xpts = ary_vertices[:, 1]
-            pts = np.vstack((xpts, ypts)).astype(np.int32).T
-            mask = np.zeros_like(img)
-            cv2.fillPoly(mask, [pts], 255)
-            avg_int = cv2.mean(img, mask)[0]
-            region['avg_intensity'] = avg_int
-            cell_id_dict[region['id']] = {
-                'value': avg_int,
-                'link_id': region['link_id'] if 'link_id' in region else ''
-            }
-            if i == min_f:
-                cids.append(region['id'])
-                c_row.append('cell{}'.format(cell_no))
-                sp_row.append('Species')
-                f_row.append('Feature')
-                row.append(avg_int)
-
-            cell_no += 1
-
-        if i > min_f:
-            # use linked id data from last frame to derive order for the current frame
-            idx = len(cell_linked_data) - 1
-            last_frame_dict = cell_linked_data[idx]
-            last_cids = cids_linked_data[idx]
-            link_id_list = []
-            for id in last_cids:
-                link_id = last_frame_dict[id]['link_id']
-                if link_id:
-                    link_id_list.append(link_id)
-                    cids.append(link_id)
-                    row.append(cell_id_dict[link_id]['value'])
-                else:
-                    # this cell has ended the cycle - no linkage of the cell to next frame
-                    cids.append('NaN')
-                    row.append('NaN')
-            # check whether there are new cells appearing from this frame
-            cell_no = len(c_row) + 1
-            for region in seg_obj.data:
-                if region['id'] not in link_id_list:
-                    # a new cell appeared in this frame
-                    cids.append(region['id'])
-                    c_row.append('cell{}'.format(cell_no))
-                    sp_row.append('Species')
-                    f_row.append('Feature')
-                    row.append(region['avg_intensity'])
-                    # append NaN to all previous rows to account for the new cell appearing
-                    for r in cell_val_rows:
-                        r.append('NaN')
-                    cell_no += 1
-
-        cell_linked_data.append(cell_id_dict)
-        cids_linked_data.append(cids)
-        cell_val_rows.append(row)
-
-    output_file = 'time_series.csv'
-    output_file_with_path = os.path.join(settings.IRODS_ROOT, exp_id, output_file)
-    with open(output_file_with_path, 'w') as csvfile:
-        fwriter = csv.writer(csvfile)
-        md_start_row = []
-        md_end_row = []
-        cell_line_row = []
-        name_row = []
-        for cid in c_row:
-            if cid == 'Cell':
-                md_start_row.append('<begin metadata>')
-                md_end_row.append('<end metadata>')
-                cell_line_row.append('Cell Line')
-                cell_line_row.append('CellLinePlaceHolder')
-                name_row.append('Name')
-                name_row.append('NamePlaceHolder')
-            else:
-                md_start_row.append('')
-                md_end_row.append('')
-                cell_line_row.append('')
-
-        fwriter.writerow(md_start_row)
-        fwriter.writerow(cell_line_row)
-        fwriter.writerow(name_row)
-        fwriter.writerow(md_end_row)
-        fwriter.writerow(c_row)
-        fwriter.writerow(sp_row)
-        fwriter.writerow(f_row)
-        for r in cell_val_rows:
-            fwriter.writerow(r)
-
-    # write csv file to iRODS
-    istorage = IrodsStorage()
-    irods_path = exp_id + '/data/segmentation/' + output_file
-    istorage.save_file(output_file_with_path, irods_path, True)
-
-    os.remove(output_file_with_path)
+def get_time_series_export_dir(exp_id, export_key):
+    """
+    get the iRODS collection holding the cached time series export of an export key
+    :param exp_id: experiment id
+    :param export_key: export key returned from get_time_series_export_key()
+    :return: iRODS collection path ending with '/'
+    """
+    return exp_id + '/data/time_series/' + export_key + '/'
+
+
+def get_time_series_export_files(layout, output_format):
+    """
+    get the names of files a time series export writes
+    :param layout: WIDE_LAYOUT or LONG_LAYOUT
+    :param output_format: one of TIME_SERIES_FORMATS
+    :return: list of the time series file name and the track lineage file name
+    """
+    return [get_time_series_file_name(layout, output_format), LINEAGE_FILE]
+
+
+def is_time_series_export_cached(exp_id, export_key, layout, output_format):
+    """
+    check whether a time series export is cached in iRODS. Files are only visible in iRODS once
+    they are completely written, and the lineage file is written last
+    :param exp_id: experiment id
+    :param export_key: export key returned from get_time_series_export_key()
+    :param layout: WIDE_LAYOUT or LONG_LAYOUT
+    :param output_format: one of TIME_SERIES_FORMATS
+    :return: True if all export files exist in iRODS, False otherwise
+    """
+    istorage = get_irods_storage()
+    irods_dir = get_time_series_export_dir(exp_id, export_key)
+    return all(istorage.exists(irods_dir + name)
+               for name in get_time_series_export_files(layout, output_format))
+
+
+def compute_time_series_and_put_in_irods(exp_id, username='', features=('mean',), workers=None,
+                                         layout=WIDE_LAYOUT, output_format=CSV_FORMAT,
+                                         irods_dir=None):
+    """
+    compute average intensity for each cell and output time series data to iRODS for an
+    experiment along with the track lineage table. Rows are streamed to iRODS as frames are
+    measured, so peak memory is bounded by the cells of one frame rather than the experiment
+    :param exp_id: experiment id
+    :param username: Empty by default. If Empty, use system segmentation tracking data;
+    otherwise, use user edit segmentation tracking data
+    :param features: features in TIME_SERIES_FEATURES to output for each cell, with default being
+    only the average intensity. Each cell has one column per feature
+    :param workers: number of worker processes to measure frames with, with default being
+    TIME_SERIES_WORKERS
+    :param layout: WIDE_LAYOUT by default to output one row per frame and one column per cell as
+    imported by Cell Cycle Browser; LONG_LAYOUT to output one row per cell per frame
+    :param output_format: CSV_FORMAT by default; GZIP_CSV_FORMAT to gzip csv rows on the fly;
+    PARQUET_FORMAT to output the long layout as a Parquet file, which requires pyarrow
+    :param irods_dir: iRODS collection ending with '/' to output files to, with default being the
+    segmentation collection of the experiment
+    :return: None if time series is output successfully, or an error message otherwise
+    """
+    username = str(username)
+    err_msg = validate_time_series_options(username, features, layout, output_format)
+    if err_msg:
+        return err_msg
+    fno = get_exp_frame_no(exp_id)
+    if fno < 0:
+        # the experiment does not exist
+        return "Experiment " + exp_id + " does not exist"
+    if workers is None:
+        workers = settings.TIME_SERIES_WORKERS
+
+    istorage = get_irods_storage()
+    if irods_dir is None:
+        irods_dir = exp_id + '/data/segmentation/'
+    lineage = LineageBuilder()
+    try:
+        with istorage.open_write_stream(irods_dir + get_time_series_file_name(
+                layout, output_format)) as stream, \
+                open_time_series_writer(stream, layout, output_format, features) as writer:
+            # measure frames, which is the expensive part, in parallel and link cells across
+            # frames in one sequential pass over the compact per-frame results in frame order
+            for i, (result, err_msg) in enumerate(measure_time_series_frames(
+                    exp_id, fno, username, features, workers)):
+                if err_msg:
+                    raise ValueError(err_msg)
+                ids, link_ids, values = result
+                writer.add_frame(i + 1, lineage.add_frame(i + 1, ids, link_ids), values)
+            writer.finish(len(lineage.tracks))
+
+        with istorage.open_write_stream(irods_dir + LINEAGE_FILE) as stream, \
+                open_csv_writer(stream) as fwriter:
+            write_lineage(fwriter, lineage.tracks)
+    except ValueError as ex:
+        return str(ex)
 
 
 def put_image_list_to_irods(exp_id, files):
@@ -835,7 +938,7 @@ def put_image_list_to_irods(exp_id, files):
         return "input files list cannot be empty"
 
     irods_path = exp_id + '/data/image/jpg/'
-    istorage = IrodsStorage()
+    istorage = get_irods_storage()
 
     # create image collection first
     istorage.save_file('', irods_path, create_directory=True)
@@ -857,11 +960,16 @@ def delete_one_experiment(exp_id):
     :return: error message or 'success'
     """
     try:
-        istorage = IrodsStorage()
+        istorage = get_irods_storage()
         istorage.delete(exp_id)
 
         Segmentation.objects.filter(exp_id=exp_id).delete()
         UserSegmentation.objects.filter(exp_id=exp_id).delete()
+        TrackingState.objects.filter(exp_id=exp_id).delete()
+        SegmentationRegion.objects.filter(exp_id=exp_id).delete()
+        ExperimentLock.objects.filter(exp_id=exp_id).delete()
+        cache.delete(_get_lock_cache_key(exp_id))
+        invalidate_frame_index(exp_id)
         return 'success'
     except SessionException as ex:
         return ex.stderr
@@ -975,7 +1083,12 @@ def create_seg_data_from_csv(exp_id, input_csv_file, irods_path):
         else:
             input_csv_path = input_csv_file
 
-        with open(input_csv_path) as inf:
+        with open(input_csv_path) as inf, irods_session() as session:
+            # use one iRODS session to put all frames and create the collection for them once
+            try:
+                session.collections.get(irods_path)
+            except CollectionDoesNotExist:
+                session.collections.create(irods_path)
             outf_path = '/tmp/{}/'.format(exp_id)
             contents = csv.reader(inf)
             last_fno = -1
@@ -1011,26 +1124,12 @@ def create_seg_data_from_csv(exp_id, input_csv_file, irods_path):
                                 # irods under the corresponding experiment id collection
                                 ofilename = 'frame' + str(last_fno + 1) + '.json'
                                 outf_name = outf_path + ofilename
-                                with open(outf_name, 'w') as outf:
-                                    outf.write(json.dumps(frame_ary, indent=2))
                                 # put file to irods
-                                with iRODSSession(host=settings.IRODS_HOST,
-                                                  port=settings.IRODS_PORT,
-                                                  user=settings.IRODS_USER,
-                                                  password=settings.IRODS_PWD,
-                                                  zone=settings.IRODS_ZONE,
-                                                  ) as session:
-                                    session.default_resource = settings.IRODS_RESC
-                                    try:
-                                        coll = session.collections.get(irods_path)
-                                    except CollectionDoesNotExist:
-                                        session.collections.create(irods_path)
-
-                                    session.data_objects.put(outf_name,
-                                                             irods_path + '/' + ofilename)
-
-                                # clean up
-                                os.remove(outf_name)
+                                for out_file in write_frame_files(frame_ary, outf_name):
+                                    session.data_objects.put(out_file,
+                                                             irods_path + '/' + os.path.basename(out_file))
+                                    # clean up
+                                    os.remove(out_file)
 
                                 frame_ary = []
                             last_fno = curr_fno
@@ -1056,25 +1155,12 @@ def create_seg_data_from_csv(exp_id, input_csv_file, irods_path):
                           obj_dict['id'])
                 ofilename = 'frame' + str(last_fno + 1) + '.json'
                 outf_name = outf_path + ofilename
-                with open(outf_name, 'w') as outf:
-                    outf.write(json.dumps(frame_ary, indent=2))
                 # put file to irods
-                with iRODSSession(host=settings.IRODS_HOST,
-                                  port=settings.IRODS_PORT,
-                                  user=settings.IRODS_USER,
-                                  password=settings.IRODS_PWD,
-                                  zone=settings.IRODS_ZONE) as session:
-                    session.default_resource = settings.IRODS_RESC
-                    try:
-                        coll = session.collections.get(irods_path)
-                    except CollectionDoesNotExist:
-                        session.collections.create(irods_path)
-
-                    session.data_objects.put(outf_name,
-                                             irods_path + '/' + ofilename)
-
-                # clean up
-                os.remove(outf_name)
+                for out_file in write_frame_files(frame_ary, outf_name):
+                    session.data_objects.put(out_file,
+                                             irods_path + '/' + os.path.basename(out_file))
+                    # clean up
+                    os.remove(out_file)
                 # success
                 return 'success'
     except Exception as ex:
@@ -12,6 +12,9 @@ from django.conf import settings
 from django.http import HttpResponse, HttpResponseServerError, StreamingHttpResponse, \
     HttpResponseBadRequest, JsonResponse, HttpResponseForbidden, HttpResponseRedirect, FileResponse
 from django.views.decorators import gzip
+from django.utils.cache import get_conditional_response, patch_cache_control, \
+    patch_vary_headers
+from django.utils.http import http_date
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.views import PasswordResetView, LogoutView
 from django.shortcuts import render, redirect
@@ -19,28 +22,38 @@ from django.forms.models import inlineformset_factory
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.utils.datastructures import MultiValueDictKeyError
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
+from django.db.models import F
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from rest_framework import status
 
-from irods.session import iRODSSession
 from irods.exception import CollectionDoesNotExist
 
-from scoring_module import get_edit_score
+from scoring_module import get_edit_score, get_edit_scores, score_model_registry
 
 from ct_core.utils import get_experiment_list_util, read_video, \
     extract_images_from_video_to_irods, read_image_frame, get_seg_collection, \
-    save_user_seg_data_to_db, get_start_frame, get_exp_image, get_edited_frames, get_all_edit_users, \
+    save_user_seg_data_to_db, get_start_frame, get_exp_image, get_exp_image_info, get_edited_frames, get_all_edit_users, \
     create_user_segmentation_data_for_download, get_frame_info, create_seg_data_from_csv, \
     sync_seg_data_to_db, delete_one_experiment, get_users, update_experiment_priority, pack_zeros, \
     is_exp_locked, lock_experiment, release_locks_by_user, add_labels_to_exp, get_exp_labels, get_all_user_scores, \
-    add_colormap_to_exp
-from ct_core.task_utils import get_exp_frame_no, is_power_user, get_experiment_frame_seg_data
+    add_colormap_to_exp, validate_time_series_options, get_time_series_export_key, \
+    get_time_series_export_dir, get_time_series_export_files, is_time_series_export_cached
+from ct_core.task_utils import get_exp_frame_no, is_power_user, get_experiment_frame_seg_data, \
+    iter_experiment_seg_data
 from ct_core.forms import SignUpForm, UserProfileForm, UserPasswordResetForm
-from ct_core.models import UserProfile, ExperimentInfo
-from django_irods.storage import IrodsStorage
+from ct_core.models import UserProfile, ExperimentInfo, PendingRegionScore
+from ct_core.image_cache import get_cache_stats, get_cache_root
+from ct_core.frame_cache import get_frame_cache_stats as get_frame_cache_stats_util
+from ct_core.seg_codec import encode_frame, SEG_CODEC_CONTENT_TYPE
+from ct_core.time_series import TIME_SERIES_FILES, TIME_SERIES_FORMATS, LINEAGE_FILE, WIDE_LAYOUT, \
+    CSV_FORMAT, get_time_series_file_name
+from django_irods.storage import get_irods_storage
 from django_irods.icommands import SessionException
-from ct_core.tasks import add_tracking, sync_user_edit_frame_from_db_to_irods, apply_colormap_to_exp_task
+from django_irods.session_pool import irods_session, get_session_pool
+from ct_core.tasks import add_tracking, sync_user_edit_frame_from_db_to_irods, apply_colormap_to_exp_task, \
+    score_pending_regions, export_time_series
 
 
 logger = logging.getLogger(__name__)
@@ -232,6 +245,7 @@ def get_user_info(request):
                                   'grade': up.grade,
                                   'school': up.school,
                                   'total_score': up.score,
+                                  'pending_scores': up.user.pending_region_scores.count(),
                                   'settings': up.settings,
                                   'is_power_user': 'true' if is_power_user(up.user) else 'false'
                                   })
@@ -275,17 +289,21 @@ def get_experiment_info(request, exp_id):
     exp_frame_no = get_exp_frame_no(exp_id)
 
     if exp_frame_no > 0:
-        _, coll, _ = get_seg_collection(exp_id)
-        if coll:
-            locked, lock_user = is_exp_locked(exp_id)
-            if locked and lock_user.username != request.user.username:
+        with get_seg_collection(exp_id) as (_, coll, _):
+            has_segmentation = coll is not None
+        if has_segmentation:
+            locked, lock_username = is_exp_locked(exp_id)
+            if locked and lock_username != request.user.username:
                 # experiment is locked by another user
-                exp_info['locked_by'] = lock_user.username
+                exp_info['locked_by'] = lock_username
                 return JsonResponse(exp_info, status=status.HTTP_403_FORBIDDEN)
-            else:
+            elif is_power_user(request.user):
                 # lock the experiment
-                if is_power_user(request.user):
-                    lock_experiment(exp_id, request.user)
+                lock_username = lock_experiment(exp_id, request.user)
+                if lock_username != request.user.username:
+                    # experiment is locked by another user in the meantime
+                    exp_info['locked_by'] = lock_username
+                    return JsonResponse(exp_info, status=status.HTTP_403_FORBIDDEN)
             exp_info['has_segmentation'] = 'true'
             exp_info['labels'] = get_exp_labels(exp_id)
         else:
@@ -329,7 +347,7 @@ def stream_video(request, exp_id):
         os.makedirs(video_path)
     if os.path.exists(video_path):
         shutil.rmtree(video_path)
-    istorage = IrodsStorage()
+    istorage = get_irods_storage()
     dpath = istorage.get_video(exp_id, video_path)
     for vfile in os.listdir(dpath):
         # there is supposed to be only one video
@@ -352,17 +370,43 @@ def display_image(request, exp_id, type, frame_no):
     :param frame_no: image frame sequence number starting from 1
     :return:
     """
-    locked, lock_user = is_exp_locked(exp_id)
-    if locked and lock_user.username != request.user.username:
+    locked, lock_username = is_exp_locked(exp_id)
+    if locked and lock_username != request.user.username:
         # experiment is locked by another user
-        return JsonResponse({'locked_by': lock_user.username}, status=status.HTTP_403_FORBIDDEN)
+        return JsonResponse({'locked_by': lock_username}, status=status.HTTP_403_FORBIDDEN)
 
-    img_file, err_msg = get_exp_image(exp_id, frame_no, type=type, gray=False)
+    img_file, file_info, gray_requested, err_msg = get_exp_image_info(exp_id, frame_no,
+                                                                      type=type, gray=False)
 
     if err_msg:
         return HttpResponseServerError(err_msg)
 
-    return HttpResponse(open(img_file, 'rb'), content_type='image/' + type)
+    # cached image file name is the content address of the image in iRODS, so it is used as a
+    # strong ETag, while the cached file modify time is touched by the image cache for LRU
+    # eviction, so the iRODS modify time is used as Last-Modified
+    etag = '"{}"'.format(os.path.splitext(os.path.basename(img_file))[0])
+    response = get_conditional_response(request, etag=etag,
+                                         last_modified=file_info.modify_time)
+    if response is None:
+        if settings.IMAGE_SENDFILE_HEADER == 'X-Accel-Redirect':
+            response = HttpResponse(content_type='image/' + type)
+            response['X-Accel-Redirect'] = settings.IMAGE_SENDFILE_URL_PREFIX + \
+                os.path.relpath(img_file, get_cache_root())
+        elif settings.IMAGE_SENDFILE_HEADER == 'X-Sendfile':
+            response = HttpResponse(content_type='image/' + type)
+            response['X-Sendfile'] = img_file
+        else:
+            response = FileResponse(open(img_file, 'rb'), content_type='image/' + type)
+        response['Last-Modified'] = http_date(file_info.modify_time)
+    response['ETag'] = etag
+    if gray_requested:
+        # grayscale frames do not change unless the experiment colormap is changed
+        patch_cache_control(response, private=True, max_age=settings.IMAGE_MAX_AGE_SECONDS)
+    else:
+        # color frames are regenerated when the experiment colormap changes, so they need to be
+        # revalidated, which is answered with 304 as long as they have not changed
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 
 @login_required
@@ -384,23 +428,78 @@ def get_frame_seg_data(request, exp_id, frame_no):
     # check if user edit segmentation is available and if yes, use that instead
     uname = request.POST.get('username', '')
     u = request.user if not uname else User.objects.get(username=uname)
-    locked, lock_user = is_exp_locked(exp_id)
-    if locked and lock_user.username != u.username:
+    locked, lock_username = is_exp_locked(exp_id)
+    if locked and lock_username != u.username:
         # experiment is locked by another user
-        return JsonResponse({'locked_by': lock_user.username}, status=status.HTTP_403_FORBIDDEN)
+        return JsonResponse({'locked_by': lock_username}, status=status.HTTP_403_FORBIDDEN)
 
     seg_obj = get_experiment_frame_seg_data(exp_id, int(frame_no), username=u.username)
 
     if seg_obj:
         json_resp_data = seg_obj.data
         if json_resp_data:
-            return HttpResponse(json.dumps(json_resp_data), content_type='application/json')
+            if SEG_CODEC_CONTENT_TYPE in request.META.get('HTTP_ACCEPT', '') and \
+                    isinstance(json_resp_data, list):
+                # client asks for the compact binary format
+                resp = HttpResponse(encode_frame(json_resp_data),
+                                    content_type=SEG_CODEC_CONTENT_TYPE)
+            else:
+                resp = HttpResponse(json.dumps(json_resp_data), content_type='application/json')
+            patch_vary_headers(resp, ('Accept',))
+            return resp
         else:
             return JsonResponse({})
     else:
         return JsonResponse({})
 
 
+@login_required
+def get_frames_seg_data(request, exp_id, start_frame_no, end_frame_no):
+    """
+    Return segmentation data of all frames in a frame range in one response
+    :param request:
+    :param exp_id: experiment id
+    :param start_frame_no: the first frame number in the range starting from 1
+    :param end_frame_no: the last frame number in the range, which is clamped to the number of
+    frames in the experiment
+    :return: JSON array of {"frame": frame_no, "data": segmentation data} objects in frame order,
+    one for each frame in the range with empty data for frames without segmentation data, which
+    is streamed to the client as frames are read from DB
+    """
+    # check if user edit segmentation is available and if yes, use that instead
+    uname = request.POST.get('username', '')
+    u = request.user if not uname else \
+        User.objects.select_related('user_profile').get(username=uname)
+    locked, lock_username = is_exp_locked(exp_id)
+    if locked and lock_username != u.username:
+        # experiment is locked by another user
+        return JsonResponse({'locked_by': lock_username}, status=status.HTTP_403_FORBIDDEN)
+
+    start_frame_no = int(start_frame_no)
+    end_frame_no = min(int(end_frame_no), get_exp_frame_no(exp_id))
+    if start_frame_no < 1 or end_frame_no < start_frame_no:
+        return HttpResponseBadRequest('invalid frame range {} to {}'.format(start_frame_no,
+                                                                          end_frame_no))
+
+    def frame_json(frame_no, data):
+        return json.dumps({'frame': frame_no, 'data': data if data else {}})
+
+    def stream_frames():
+        yield '['
+        next_frame_no = start_frame_no
+        for frame_no, data in iter_experiment_seg_data(exp_id, start_frame_no, end_frame_no,
+                                                       user=u):
+            for fno in range(next_frame_no, frame_no):
+                yield (',' if fno > start_frame_no else '') + frame_json(fno, {})
+            yield (',' if frame_no > start_frame_no else '') + frame_json(frame_no, data)
+            next_frame_no = frame_no + 1
+        for fno in range(next_frame_no, end_frame_no + 1):
+            yield (',' if fno > start_frame_no else '') + frame_json(fno, {})
+        yield ']'
+
+    return StreamingHttpResponse(stream_frames(), content_type='application/json')
+
+
 @login_required
 def save_tracking_data(request, exp_id):
     uname = request.user.username
@@ -419,9 +518,7 @@ def save_tracking_data(request, exp_id):
         else:
             return HttpResponseServerError(ex.message)
 
-    with iRODSSession(host=settings.IRODS_HOST, port=settings.IRODS_PORT, user=settings.IRODS_USER,
-                      password=settings.IRODS_PWD, zone=settings.IRODS_ZONE) as session:
-        session.default_resource = settings.IRODS_RESC
+    with irods_session() as session:
         ipath = '/' + settings.IRODS_ZONE + '/home/' + settings.IRODS_USER + '/' + str(exp_id) + \
                 '/tracking/' + uname
         try:
@@ -605,7 +702,7 @@ def add_experiment_to_server(request):
             exp_id = '{}_{}'.format(exp_id, idx)
             idx += 1
 
-        istorage = IrodsStorage()
+        istorage = get_irods_storage()
         if upload_video:
             # create new experiment collection in iRODS and transfer uploaded video to iRODS
             retmsg = extract_images_from_video_to_irods(exp_id=exp_id,
@@ -628,9 +725,7 @@ def add_experiment_to_server(request):
 
         # put experiment data as metadata for the newly created experiment collection
         cpath = '/{}/home/{}/{}'.format(settings.IRODS_ZONE, settings.IRODS_USER, exp_id)
-        with iRODSSession(host=settings.IRODS_HOST, port=settings.IRODS_PORT,
-                          user=settings.IRODS_USER,
-                          password=settings.IRODS_PWD, zone=settings.IRODS_ZONE) as session:
+        with irods_session() as session:
             coll = session.collections.get(cpath)
             coll.metadata.add('experiment_name', exp_name)
             coll.metadata.add('priority', pack_zeros(str(len(exp_list))))
@@ -641,6 +736,8 @@ def add_experiment_to_server(request):
             if not created:
                 # Segmentation object already exists, update it with new json data
                 obj.colormap = exp_lut
+                # image frames are uploaded again, so frame index has to be rebuilt
+                obj.frame_index = {}
                 obj.save()
 
 
@@ -710,9 +807,7 @@ def update_label_association(request, exp_id):
         if not exp_labels:
             return JsonResponse({"message": 'Bad request: input labels are empty'}, status=status.HTTP_400_BAD_REQUEST)
         cpath = '/{}/home/{}/{}'.format(settings.IRODS_ZONE, settings.IRODS_USER, exp_id)
-        with iRODSSession(host=settings.IRODS_HOST, port=settings.IRODS_PORT,
-                          user=settings.IRODS_USER,
-                          password=settings.IRODS_PWD, zone=settings.IRODS_ZONE) as session:
+        with irods_session() as session:
             try:
                 coll = session.collections.get(cpath)
             except CollectionDoesNotExist:
@@ -760,38 +855,54 @@ def save_frame_seg_data(request, exp_id, frame_no):
         return JsonResponse({'message': 'regions key not included in user edit segmentation data '
                                         'to be saved'},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    locked, lock_user = is_exp_locked(exp_id)
-    if locked and lock_user.username != request.user.username:
+    locked, lock_username = is_exp_locked(exp_id)
+    if locked and lock_username != request.user.username:
         # experiment is locked by another user
-        return JsonResponse({'locked_by': lock_user.username}, status=status.HTTP_403_FORBIDDEN)
+        return JsonResponse({'locked_by': lock_username}, status=status.HTTP_403_FORBIDDEN)
     try:
         u = request.user
-        total_score = u.user_profile.score
+        score_delta = 0
+        pending_regions = []
         edit_data = json.loads(seg_data['regions'])
         if edit_data:
+            edit_reg_data = [reg['vertices'] for reg in edit_data
+                             if 'new_edits' in reg and reg['new_edits']]
+            if edit_reg_data and settings.SCORE_ASYNC:
+                # newly edited regions are scored by the score_pending_regions task after saving
+                pending_regions = [PendingRegionScore(user=u, exp_id=exp_id, frame_no=frame_no,
+                                                      vertices=vertices)
+                                   for vertices in edit_reg_data]
+            elif edit_reg_data:
+                # score all newly edited regions in the frame in one batch
+                img_file, err_msg = get_exp_image(exp_id, frame_no)
+                if err_msg:
+                    return JsonResponse({'message': err_msg}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                scores, err_msg = get_edit_scores(img_file, edit_reg_data)
+                if err_msg:
+                    return JsonResponse({'message': err_msg}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                score_delta += sum(scores)
             for reg in edit_data:
-                if 'new_edits' in reg and reg['new_edits']:
-                    edit_reg_data = reg['vertices']
-                    img_file, err_msg = get_exp_image(exp_id, frame_no)
-                    if err_msg:
-                        return JsonResponse({'message': err_msg}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-                    score, err_msg = get_edit_score(img_file, edit_reg_data)
-                    if err_msg:
-                        return JsonResponse({'message': err_msg}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-                    total_score = score + total_score
                 if 'new_changes' in reg:
-                    total_score = int(reg['new_changes']) + total_score
-
-        u.user_profile.score = total_score
-        u.user_profile.save()
-
-        save_user_seg_data_to_db(request.user, exp_id, frame_no, seg_data['regions'], num_edited)
+                    score_delta += int(reg['new_changes'])
+
+        with transaction.atomic():
+            # increment the score in the database so that a score added concurrently by the
+            # scoring task is not overwritten
+            UserProfile.objects.filter(user=u).update(score=F('score') + score_delta)
+            save_user_seg_data_to_db(request.user, exp_id, frame_no, seg_data['regions'], num_edited)
+            if pending_regions:
+                PendingRegionScore.objects.bulk_create(pending_regions)
+                transaction.on_commit(lambda: score_pending_regions.apply_async())
         # task = add_tracking.apply_async((exp_id, request.user.username, int(frame_no)),
         #                                countdown=1)
         # return JsonResponse({'task_id': task.task_id}, status=status.HTTP_200_OK)
         sync_user_edit_frame_from_db_to_irods.apply_async((exp_id, request.user.username, int(frame_no)),
                                                           countdown=1)
-        return JsonResponse({'total_score': total_score}, status=status.HTTP_200_OK)
+        ret_data = {'total_score': UserProfile.objects.values_list('score', flat=True).get(user=u)}
+        if settings.SCORE_ASYNC:
+            # the client polls get_user_info for the updated score until no scores are pending
+            ret_data['pending_scores'] = PendingRegionScore.objects.filter(user=u).count()
+        return JsonResponse(ret_data, status=status.HTTP_200_OK)
     except AttributeError as ex:
         return JsonResponse({'message': 'Scoring raised AttributeError'},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -804,11 +915,12 @@ def save_frame_seg_data(request, exp_id, frame_no):
 @login_required
 def check_task_status(request):
     """
-    A view function to tell the client if the asynchronous add_tracking() task is done.
+    A view function to tell the client if an asynchronous task such as add_tracking() or
+    export_time_series() is done.
     Args:
-        request: an ajax request to check for add tracking status
+        request: an ajax request to check for task status
     Returns:
-        JSON response to return result from asynchronous task add_tracking()
+        JSON response to return result from the asynchronous task
     """
     task_id = request.POST.get('task_id', None)
     ret_result = {}
@@ -858,6 +970,77 @@ def download(request, exp_id, username):
     return response
 
 
+@login_required
+def export_time_series_data(request, exp_id):
+    """
+    Export time series of an experiment computed from system or any user's edit segmentation
+    data. Exports are cached in iRODS keyed by the segmentation state they are computed from, so
+    a repeat export of an unchanged state is served from the cache without recomputation;
+    otherwise an export_time_series task is started, or the running task of the same state is
+    reused, and the client checks its status with check_task_status
+    :param request: POST request with optional 'username' of the user whose edit segmentation data
+    to export with system segmentation data being exported if empty, 'features' list of features
+    in TIME_SERIES_FEATURES with default being mean, 'layout' and 'format'
+    :param exp_id: experiment id
+    :return: JSON response with 'task_id' of the export task, or with 'task_id' being None along
+    with 'export_key' and 'files' to download with download_time_series_data if it is cached
+    """
+    username = request.POST.get('username', '')
+    features = request.POST.getlist('features') or ['mean']
+    layout = request.POST.get('layout', WIDE_LAYOUT)
+    output_format = request.POST.get('format', CSV_FORMAT)
+    err_msg = validate_time_series_options(username, features, layout, output_format)
+    if err_msg:
+        return JsonResponse({'message': err_msg}, status=status.HTTP_400_BAD_REQUEST)
+    if get_exp_frame_no(exp_id) < 0:
+        return JsonResponse({'message': 'Experiment ' + exp_id + ' does not exist'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+    export_key = get_time_series_export_key(exp_id, username, features, layout, output_format)
+    if is_time_series_export_cached(exp_id, export_key, layout, output_format):
+        return JsonResponse({'task_id': None,
+                             'export_key': export_key,
+                             'files': get_time_series_export_files(layout, output_format)},
+                            status=status.HTTP_200_OK)
+
+    task_cache_key = 'time_series_export:{}:{}'.format(exp_id, export_key)
+    task_id = cache.get(task_cache_key)
+    if not task_id or export_time_series.AsyncResult(task_id).ready():
+        task = export_time_series.apply_async((exp_id, username, features, layout, output_format))
+        task_id = task.task_id
+        cache.set(task_cache_key, task_id, settings.TIME_SERIES_EXPORT_TASK_SECONDS)
+    return JsonResponse({'task_id': task_id}, status=status.HTTP_200_OK)
+
+
+@login_required
+def download_time_series_data(request, exp_id, export_key, file_name):
+    """
+    Download a file of a time series export cached in iRODS
+    :param request: GET request
+    :param exp_id: experiment id
+    :param export_key: export key returned from export_time_series_data or check_task_status
+    :param file_name: one of the exported file names returned along with export_key
+    :return: file response to download the file as an attachment
+    """
+    file_names = {get_time_series_file_name(layout, output_format)
+                  for layout in TIME_SERIES_FILES for output_format in TIME_SERIES_FORMATS}
+    file_names.add(LINEAGE_FILE)
+    if file_name not in file_names:
+        return JsonResponse({'message': file_name + ' is not a time series export file'},
+                            status=status.HTTP_400_BAD_REQUEST)
+    irods_path = get_time_series_export_dir(exp_id, export_key) + file_name
+    istorage = get_irods_storage()
+    if not istorage.exists(irods_path):
+        return JsonResponse({'message': 'Time series export ' + export_key + ' of experiment ' +
+                                        exp_id + ' does not exist'},
+                            status=status.HTTP_404_NOT_FOUND)
+    mtype, encoding = mimetypes.guess_type(file_name)
+    if encoding == 'gzip':
+        mtype = 'application/gzip'
+    return FileResponse(istorage.open(irods_path), as_attachment=True, filename=file_name,
+                        content_type=mtype or 'application/octet-stream')
+
+
 @login_required
 def get_score(request, exp_id, frame_no):
     seg_data = request.POST.dict()
@@ -883,3 +1066,74 @@ def get_score(request, exp_id, frame_no):
         logger.error("Cannot get score for a region in experiment {} frame {}: {}".format(exp_id, frame_no, ex))
         return JsonResponse({'message': 'Scoring raised exception. See server log for details'},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@login_required
+def get_scores(request, exp_id, frame_no):
+    """
+    Score multiple edited regions in a frame in one batch and add the scores to the user score
+    :param request: POST request with a 'regions' JSON list of regions each with 'vertices'
+    :param exp_id: experiment id
+    :param frame_no: frame number starting from 1
+    :return: JSON response with a 'scores' list in the order of the regions
+    """
+    seg_data = request.POST.dict()
+    if 'regions' not in seg_data:
+        return JsonResponse({'message': 'regions key not included in user edit segmentation data'},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    try:
+        regions = json.loads(seg_data['regions'])
+        img_file, err_msg = get_exp_image(exp_id, frame_no)
+        if err_msg:
+            return JsonResponse({'message': err_msg}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        scores, err_msg = get_edit_scores(img_file, [reg['vertices'] for reg in regions])
+        if err_msg:
+            return JsonResponse({'message': err_msg}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        UserProfile.objects.filter(user=request.user).update(score=F('score') + sum(scores))
+        return JsonResponse({'scores': scores}, status=status.HTTP_200_OK)
+    except AttributeError as ex:
+        return JsonResponse({'message': 'Scoring raised AttributeError'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    except Exception as ex:
+        logger.error("Cannot get scores for regions in experiment {} frame {}: {}".format(exp_id, frame_no, ex))
+        return JsonResponse({'message': 'Scoring raised exception. See server log for details'},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@login_required
+def get_irods_session_pool_metrics(request):
+    if request.user.is_authenticated and request.user.is_superuser:
+        return JsonResponse(get_session_pool().get_metrics(), status=status.HTTP_200_OK)
+    else:
+        return JsonResponse({'message': 'You must log in as data manager to get iRODS session '
+                                        'pool metrics'},
+                            status=status.HTTP_401_UNAUTHORIZED)
+
+
+@login_required
+def get_image_cache_stats(request):
+    if request.user.is_authenticated and request.user.is_superuser:
+        return JsonResponse(get_cache_stats(), status=status.HTTP_200_OK)
+    else:
+        return JsonResponse({'message': 'You must log in as data manager to get image cache '
+                                        'statistics'},
+                            status=status.HTTP_401_UNAUTHORIZED)
+
+
+@login_required
+def get_frame_cache_stats(request):
+    if request.user.is_authenticated and request.user.is_superuser:
+        return JsonResponse(get_frame_cache_stats_util(), status=status.HTTP_200_OK)
+    else:
+        return JsonResponse({'message': 'You must log in as data manager to get frame cache '
+                                        'statistics'},
+                            status=status.HTTP_401_UNAUTHORIZED)
+
+
+@login_required
+def get_score_model_metrics(request):
+    if request.user.is_authenticated and request.user.is_superuser:
+        return JsonResponse(score_model_registry.get_metrics(), status=status.HTTP_200_OK)
+    else:
+        return JsonResponse({'message': 'You must log in as data manager to get scoring model '
+                                        'metrics'},
+                            status=status.HTTP_401_UNAUTHORIZED)
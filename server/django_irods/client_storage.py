@@ -0,0 +1,281 @@
+import os
+import shutil
+import calendar
+from contextlib import contextmanager
+from collections import OrderedDict
+from tempfile import NamedTemporaryFile
+
+from irods import keywords as kw
+from irods.exception import CollectionDoesNotExist, DataObjectDoesNotExist
+from irods.models import Collection, CollectionMeta
+
+from django.utils.deconstruct import deconstructible
+from django.core.exceptions import ValidationError
+from django.conf import settings
+
+from .icommands import SessionException
+from .session_pool import irods_session
+from .storage import IrodsStorage, IrodsFileInfo
+
+
+# chunk size in bytes for streaming data objects from and to iRODS
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+@deconstructible
+class IrodsClientStorage(IrodsStorage):
+    """
+    IrodsStorage backend that talks to iRODS in-process with python-irodsclient through the
+    pooled iRODS sessions rather than forking an icommands process for each call. It keeps the
+    same public API as IrodsStorage. Bulk recursive transfers such as get_video(), get_all_images()
+    and save_dir() are still done with icommands in one process per transfer.
+    """
+
+    @staticmethod
+    def _abs_path(name):
+        """
+        internal method to convert a path relative to the iRODS home collection as accepted by
+        icommands to an absolute iRODS logical path
+        """
+        name = name.strip()
+        while len(name) > 1 and name.endswith('/'):
+            name = name[:-1]
+        if os.path.isabs(name):
+            return name
+        return os.path.join('/', settings.IRODS_ZONE, 'home', settings.IRODS_USER, name)
+
+    @staticmethod
+    def _download(session, src_path, dest_file):
+        """
+        internal method to stream a data object to a local file which is written to a temporary
+        file first and then renamed so that no half-written file is ever visible at dest_file
+        """
+        obj = session.data_objects.get(src_path)
+        dest_dir = os.path.dirname(dest_file) or '.'
+        with NamedTemporaryFile(dir=dest_dir, delete=False) as tmp:
+            try:
+                with obj.open('r') as src:
+                    shutil.copyfileobj(src, tmp, STREAM_CHUNK_SIZE)
+            except Exception:
+                tmp.close()
+                os.unlink(tmp.name)
+                raise
+        os.rename(tmp.name, dest_file)
+
+    def get_one_image_frame(self, exp_id, image_type, image_name, dest_path):
+        """
+        Get one image frame from an experiment.
+        :param exp_id: experiment id
+        :param image_type: type of the image, only 'png' and 'jpg' are supported
+        :param image_name: name of the image to retrieve
+        :param dest_path: destination path on web server to retrieve image from iRODS to
+        :return: the image file name with full path
+        """
+        src_path = self._abs_path(os.path.join(exp_id, 'data', 'image', image_type, image_name))
+        with irods_session() as session:
+            try:
+                self._download(session, src_path, os.path.join(dest_path, image_name))
+            except DataObjectDoesNotExist as ex:
+                raise SessionException(-1, '', str(ex))
+        return dest_path
+
+    def get_file(self, src_name, dest_name):
+        with irods_session() as session:
+            try:
+                self._download(session, self._abs_path(src_name), dest_name)
+            except DataObjectDoesNotExist as ex:
+                raise SessionException(-1, '', str(ex))
+
+    def save_file(self, from_name, to_name, create_directory=False, data_type_str=''):
+        """
+        Parameters:
+        :param
+        from_name: the temporary file name in local disk to be uploaded from.
+        to_name: the data object path in iRODS to be uploaded to
+        create_directory: create directory as needed when set to True. Default is False
+        Note if only directory needs to be created without saving a file, from_name should be empty
+        and to_name should have "/" as the last character
+        """
+        with irods_session() as session:
+            if create_directory:
+                splitstrs = to_name.rsplit('/', 1)
+                if len(splitstrs) <= 1:
+                    return
+                session.collections.create(self._abs_path(splitstrs[0]), recurse=True)
+
+            if from_name:
+                options = {kw.FORCE_FLAG_KW: ''}
+                if data_type_str:
+                    options[kw.DATA_TYPE_KW] = data_type_str
+                session.data_objects.put(from_name, self._abs_path(to_name), **options)
+        return
+
+    @contextmanager
+    def open_write_stream(self, to_name):
+        """
+        Open a binary stream writing straight into a data object in iRODS without spooling it to
+        local disk, creating collections as needed. The stream writes a temporary data object
+        which replaces the data object at to_name only when the stream is closed without an error,
+        so that no half-written data object is ever visible at to_name
+        :param to_name: the data object path in iRODS to be written to
+        :return: a writable binary file-like object
+        """
+        path = self._abs_path(to_name)
+        part_path = path + '.part'
+        with irods_session() as session:
+            session.collections.create(os.path.dirname(path), recurse=True)
+            if session.data_objects.exists(part_path):
+                session.data_objects.unlink(part_path, force=True)
+            obj = session.data_objects.create(part_path)
+            try:
+                with obj.open('w') as dest:
+                    yield dest
+                if session.data_objects.exists(path):
+                    session.data_objects.unlink(path, force=True)
+                session.data_objects.move(part_path, path)
+            except Exception:
+                if session.data_objects.exists(part_path):
+                    session.data_objects.unlink(part_path, force=True)
+                raise
+
+    def copy_file(self, src_name, dest_name, ires=None, create_dest_coll_as_needed=False):
+        """
+        copy an irods data-object (file) or collection (directory) to another data-object or collection
+        Parameters:
+        :param
+        src_name: the iRODS data-object or collection name to be copied from.
+        dest_name: the iRODS data-object or collection name to be copied to
+        create_dest_coll_as_needed: optional indicating whether to create destination
+        collection as needed. Default is False
+        """
+        if not src_name or not dest_name:
+            return
+        with irods_session() as session:
+            src_path = self._abs_path(src_name)
+            if session.collections.exists(src_path):
+                # python-irodsclient cannot copy collections, so fall back to icommands
+                return super(IrodsClientStorage, self).copy_file(src_name, dest_name, ires,
+                                                                 create_dest_coll_as_needed)
+            dest_path = self._abs_path(dest_name)
+            if create_dest_coll_as_needed:
+                session.collections.create(os.path.dirname(dest_path), recurse=True)
+            options = {kw.FORCE_FLAG_KW: ''}
+            if ires:
+                options[kw.DEST_RESC_NAME_KW] = ires
+            session.data_objects.copy(src_path, dest_path, **options)
+        return
+
+    def move_file(self, src_name, dest_name, create_dest_coll_as_needed=False):
+        """
+        Parameters:
+        :param
+        src_name: the iRODS data-object or collection name to be moved from.
+        dest_name: the iRODS data-object or collection name to be moved to
+        moveFile() moves/renames an irods data-object (file) or collection
+        (directory) to another data-object or collection
+        create_dest_coll_as_needed: optional indicating whether to create destination
+        collection as needed. Default is False
+        """
+        if not src_name or not dest_name:
+            return
+        with irods_session() as session:
+            src_path = self._abs_path(src_name)
+            dest_path = self._abs_path(dest_name)
+            if create_dest_coll_as_needed:
+                session.collections.create(os.path.dirname(dest_path), recurse=True)
+            if session.collections.exists(src_path):
+                session.collections.move(src_path, dest_path)
+            else:
+                session.data_objects.move(src_path, dest_path)
+        return
+
+    def _open(self, name, mode='rb'):
+        tmp = NamedTemporaryFile()
+        with irods_session() as session:
+            obj = session.data_objects.get(self._abs_path(name))
+            with obj.open('r') as src:
+                shutil.copyfileobj(src, tmp, STREAM_CHUNK_SIZE)
+        tmp.seek(0)
+        return tmp
+
+    def _save(self, name, content):
+        path = self._abs_path(name)
+        with irods_session() as session:
+            session.collections.create(os.path.dirname(path), recurse=True)
+            if not session.data_objects.exists(path):
+                session.data_objects.create(path)
+            obj = session.data_objects.get(path)
+            with obj.open('w') as dest:
+                for chunk in content.chunks():
+                    dest.write(chunk)
+        return name
+
+    def delete(self, name):
+        path = self._abs_path(name)
+        with irods_session() as session:
+            if session.collections.exists(path):
+                session.collections.remove(path, recurse=True, force=True)
+            elif session.data_objects.exists(path):
+                session.data_objects.unlink(path, force=True)
+
+    def exists(self, name):
+        path = self._abs_path(name)
+        with irods_session() as session:
+            return session.collections.exists(path) or session.data_objects.exists(path)
+
+    def listdir(self, path):
+        """
+        return list of sub-collections/sub-directories and data objects/files
+        :param path: iRODS collection/directory path
+        :return: (sub_directory_list, file_name_list)
+        """
+        with irods_session() as session:
+            try:
+                coll = session.collections.get(self._abs_path(path))
+            except CollectionDoesNotExist:
+                raise SessionException(-1, '', 'folder {} does not exist'.format(path))
+            fname_list = [obj.name for obj in coll.data_objects]
+            subdir_list = [sub_coll.name for sub_coll in coll.subcollections]
+        return subdir_list, fname_list
+
+    def list_files_info(self, path):
+        """
+        list data objects/files under path along with their size, modify time and checksum in
+        one query
+        :param path: iRODS collection/directory path
+        :return: OrderedDict of IrodsFileInfo keyed by file name, which is empty if path does not
+        exist
+        """
+        info_dict = OrderedDict()
+        with irods_session() as session:
+            try:
+                coll = session.collections.get(self._abs_path(path))
+            except CollectionDoesNotExist:
+                return info_dict
+            for obj in coll.data_objects:
+                info_dict[obj.name] = IrodsFileInfo(int(obj.size),
+                                                    calendar.timegm(obj.modify_time.timetuple()),
+                                                    obj.checksum or '')
+        return info_dict
+
+    def size(self, name):
+        """
+        return the size of the data object/file with file name being passed in
+        :param name: file name
+        :return: the size of the file
+        """
+        if len(name.rsplit('/', 1)) < 2:
+            raise ValidationError('{} is not a valid file path to retrieve file size '
+                                  'from iRODS'.format(name))
+        with irods_session() as session:
+            try:
+                return int(session.data_objects.get(self._abs_path(name)).size)
+            except DataObjectDoesNotExist:
+                raise ValidationError("{} cannot be found in iRODS to retrieve "
+                                      "file size".format(name))
+
+    def get_sorted_exp_list(self):
+        with irods_session() as session:
+            query = session.query(Collection.name, CollectionMeta.value).filter(
+                CollectionMeta.name == 'priority').order_by(CollectionMeta.value, order='desc')
+            return [row[Collection.name].rsplit('/', 1)[1] for row in query]
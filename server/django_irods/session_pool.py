@@ -0,0 +1,232 @@
+import os
+import time
+import logging
+import threading
+
+from contextlib import contextmanager
+from socket import error as SocketError
+
+from irods.session import iRODSSession
+from irods.exception import NetworkException
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+# exceptions raised by python-irodsclient when the connection to iRODS server is broken, in which
+# case the session is discarded rather than returned to the pool
+CONNECTION_ERRORS = (NetworkException, SocketError, EOFError)
+
+
+def _create_session():
+    """
+    internal method to create a new iRODS session with the configured iRODS settings
+    """
+    session = iRODSSession(host=settings.IRODS_HOST, port=settings.IRODS_PORT,
+                           user=settings.IRODS_USER, password=settings.IRODS_PWD,
+                           zone=settings.IRODS_ZONE)
+    session.default_resource = settings.IRODS_RESC
+    return session
+
+
+def _check_session(session):
+    """
+    internal method to check whether a pooled iRODS session can still talk to the iRODS server by
+    doing a cheap round trip to get the iRODS home collection
+    """
+    session.collections.get('/{}/home/{}'.format(settings.IRODS_ZONE, settings.IRODS_USER))
+
+
+class SessionPool(object):
+    """
+    A thread-safe pool of authenticated iRODS sessions shared by all threads in a process so that
+    callers do not pay a full iRODS connect and authentication handshake on each iRODS access.
+    Idle sessions are health checked before being handed out again if they have been idle longer
+    than the health check interval, and sessions that fail the check or break while in use are
+    replaced by new connections. The pool is recreated automatically in a forked child process,
+    e.g., a Celery prefork worker, since connections cannot be shared across processes.
+    """
+
+    def __init__(self, size, timeout, health_check_interval, session_factory=_create_session,
+                 session_checker=_check_session):
+        """
+        :param size: maximum number of sessions open at the same time
+        :param timeout: seconds to wait for a session to be checked in when all sessions are in
+        use before raising an exception, or None to wait forever
+        :param health_check_interval: seconds a session can stay idle before it is health checked
+        on checkout
+        :param session_factory: callable to create a new session
+        :param session_checker: callable to check a session, which raises an exception if the
+        session is not usable
+        """
+        self.size = size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._session_factory = session_factory
+        self._session_checker = session_checker
+        self._cond = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # list of (session, last checkin time) tuples with the most recently used one last
+        self._idle = []
+        self._in_use = 0
+        self._metrics = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_seconds': 0.0,
+            'created': 0,
+            'reconnects': 0,
+            'discarded': 0,
+            'timeouts': 0,
+        }
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            # forked into a new process, sessions inherited from the parent process cannot be used
+            self._reset()
+
+    def _discard(self, session):
+        self._metrics['discarded'] += 1
+        try:
+            session.cleanup()
+        except Exception as ex:
+            logger.warning('Failed to clean up iRODS session: ' + str(ex))
+
+    def checkout(self):
+        """
+        check out a session from the pool, which must be checked back in with checkin()
+        :return: an iRODS session
+        """
+        with self._cond:
+            self._check_pid()
+            start = time.time()
+            waited = False
+            while not self._idle and self._in_use >= self.size:
+                waited = True
+                remaining = None
+                if self.timeout is not None:
+                    remaining = self.timeout - (time.time() - start)
+                    if remaining <= 0:
+                        self._metrics['timeouts'] += 1
+                        raise RuntimeError('Timed out waiting for an iRODS session from the pool')
+                self._cond.wait(remaining)
+            if waited:
+                self._metrics['waits'] += 1
+                self._metrics['wait_seconds'] += time.time() - start
+            self._metrics['checkouts'] += 1
+            self._in_use += 1
+            idle = self._idle.pop() if self._idle else None
+
+        try:
+            if idle:
+                session, last_used = idle
+                if time.time() - last_used < self.health_check_interval:
+                    return session
+                try:
+                    self._session_checker(session)
+                    return session
+                except Exception as ex:
+                    logger.warning('Reconnecting failed iRODS session: ' + str(ex))
+                    with self._cond:
+                        self._metrics['reconnects'] += 1
+                        self._discard(session)
+            session = self._session_factory()
+            with self._cond:
+                self._metrics['created'] += 1
+            return session
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def checkin(self, session, discard=False):
+        """
+        check a session checked out from checkout() back in to the pool
+        :param session: the session to check in
+        :param discard: True to close the session rather than return it to the pool, e.g., when
+        the connection is broken
+        """
+        with self._cond:
+            if self._pid != os.getpid():
+                # checked out before the process was forked, nothing to return to
+                return
+            self._in_use -= 1
+            if discard:
+                self._discard(session)
+            else:
+                self._idle.append((session, time.time()))
+            self._cond.notify()
+
+    @contextmanager
+    def session(self):
+        """
+        context manager to check out a session from the pool and check it back in on exit. The
+        session is discarded if the connection to iRODS server breaks while it is used
+        """
+        session = self.checkout()
+        discard = False
+        try:
+            yield session
+        except CONNECTION_ERRORS:
+            discard = True
+            raise
+        finally:
+            self.checkin(session, discard=discard)
+
+    def close(self):
+        """
+        close all idle sessions in the pool
+        """
+        with self._cond:
+            idle = self._idle
+            self._idle = []
+        for session, _ in idle:
+            try:
+                session.cleanup()
+            except Exception as ex:
+                logger.warning('Failed to clean up iRODS session: ' + str(ex))
+
+    def get_metrics(self):
+        """
+        get pool metrics to help size the pool under load
+        :return: a dict of pool metrics
+        """
+        with self._cond:
+            self._check_pid()
+            metrics = dict(self._metrics)
+            metrics['size'] = self.size
+            metrics['in_use'] = self._in_use
+            metrics['idle'] = len(self._idle)
+        return metrics
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_session_pool():
+    """
+    get the process-wide iRODS session pool, creating it on first use
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = SessionPool(settings.IRODS_SESSION_POOL_SIZE,
+                                    settings.IRODS_SESSION_POOL_TIMEOUT_SECONDS,
+                                    settings.IRODS_SESSION_HEALTH_CHECK_SECONDS)
+    return _pool
+
+
+def irods_session():
+    """
+    context manager to use a pooled iRODS session, used in place of creating a new iRODSSession
+    For example:
+    with irods_session() as session:
+        coll = session.collections.get(path)
+    """
+    return get_session_pool().session()
@@ -1,14 +1,22 @@
 import os
+from contextlib import contextmanager
+from collections import OrderedDict, namedtuple
 from tempfile import NamedTemporaryFile
 
 from django.utils.deconstruct import deconstructible
 from django.core.files.storage import Storage
 from django.core.exceptions import ValidationError
 from django.conf import settings
+from django.utils.module_loading import import_string
 
 from .icommands import GLOBAL_SESSION, GLOBAL_ENVIRONMENT, SessionException
 
 
+# size in bytes, modify time in seconds since epoch, and checksum (empty if not computed) of a
+# data object in iRODS
+IrodsFileInfo = namedtuple('IrodsFileInfo', ['size', 'modify_time', 'checksum'])
+
+
 @deconstructible
 class IrodsStorage(Storage):
     def __init__(self):
@@ -85,6 +93,38 @@ class IrodsStorage(Storage):
                     self.session.run("iput", None, '-f', from_name, to_name)
         return
 
+    @contextmanager
+    def open_write_stream(self, to_name):
+        """
+        Open a binary stream to write a data object in iRODS with. icommands cannot write from a
+        stream, so the stream is spooled to a local temporary file which is uploaded when the
+        stream is closed without an error, creating directories as needed
+        :param to_name: the data object path in iRODS to be written to
+        :return: a writable binary file-like object
+        """
+        with NamedTemporaryFile(delete=False) as f:
+            try:
+                yield f
+                f.close()
+                self.save_file(f.name, to_name, create_directory=True)
+            finally:
+                f.close()
+                os.unlink(f.name)
+
+    def save_dir(self, from_dir, to_coll):
+        """
+        Upload a local directory with all files in it to iRODS in one bulk transfer
+        Parameters:
+        :param
+        from_dir: the local directory to be uploaded from
+        to_coll: the parent collection in iRODS to upload to. The directory is uploaded as
+        a sub-collection with the same name as the directory, and existing data objects in that
+        sub-collection are overwritten
+        """
+        self.session.run("imkdir", None, '-p', to_coll)
+        self.session.run("iput", None, '-rf', from_dir, to_coll)
+        return
+
     def copy_file(self, src_name, dest_name, ires=None, create_dest_coll_as_needed=False):
         """
         copy an irods data-object (file) or collection (directory) to another data-object or collection
@@ -178,6 +218,31 @@ class IrodsStorage(Storage):
 
         return fname_list
 
+    def list_files_info(self, path):
+        """
+        list data objects/files under path along with their size, modify time and checksum in
+        one query
+        :param path: iRODS collection/directory path
+        :return: OrderedDict of IrodsFileInfo keyed by file name, which is empty if path does not
+        exist
+        """
+        path = path.strip()
+        while path.endswith('/'):
+            path = path[:-1]
+        qrystr = "select DATA_NAME, DATA_SIZE, DATA_MODIFY_TIME, DATA_CHECKSUM where " \
+                 "DATA_REPL_STATUS != '0' AND {}".format(IrodsStorage.get_absolute_path_query(path))
+        stdout = self.session.run("iquest", None, "--no-page", "%s|%s|%s|%s",
+                                  qrystr)[0].split("\n")
+        info_dict = OrderedDict()
+        for line in stdout:
+            if not line or "CAT_NO_ROWS_FOUND" in line:
+                break
+            fname, size, modify_time, checksum = line.rsplit('|', 3)
+            if fname not in info_dict:
+                # only keep the first good replica
+                info_dict[fname] = IrodsFileInfo(int(size), int(modify_time), checksum.strip())
+        return info_dict
+
     def _list_sub_dirs(self, path):
         """
         internal method to only list sub-collections/sub-directories under path
@@ -293,3 +358,12 @@ class IrodsStorage(Storage):
             exp_lst.append(exp_id)
 
         return exp_lst
+
+
+def get_irods_storage():
+    """
+    return an instance of the iRODS storage backend selected by settings.IRODS_STORAGE_CLASS,
+    which is either IrodsStorage that runs icommands or IrodsClientStorage that uses
+    python-irodsclient in-process
+    """
+    return import_string(settings.IRODS_STORAGE_CLASS)()
@@ -4,7 +4,6 @@
 # otherwise an AttributeError will be raised when loading the pickled scording model using load_learner
 
 import torch
-from skimage.io import imread
 from skimage.draw import polygon
 
 from fastai.vision import *
@@ -12,95 +11,110 @@ from fastai.utils.mem import *
 
 from django.conf import settings
 
+from scoring_module.registry import ModelRegistry
+from ct_core.frame_cache import get_frame_array, LUMINANCE_MODE
 
-class MultiChannelImageList(ImageList):
-    # placeholder class for loading the trained model
-    def open(self, fn):
-        return []
 
-
-def _create_mask_image(row, col, row_list, col_list):
+def _load_score_model(model_path):
     """
-    Create the mask image out of polygon boundary for scoring
-    :param row: number of rows for the mask image
-    :param col: number of columns for the mask image
-    :param row_list: list of row indices for polygon boundary
-    :param col_list: list of column indices for polygon boundary
-    :return: mask image with pixel value of 255 inside polygon boundary, and 0 outside the boundary
+    Load the trained scoring model from the pickled learner file
+    :param model_path: pickled learner file path
+    :return: fastai learner
     """
-    img = np.zeros((row, col), dtype=np.uint8)
-    # make sure all image values are positive
-    for i, item in enumerate(row_list):
-        if item < 0:
-            row_list[i] = 0
+    path, fname = os.path.split(model_path)
+    return load_learner(path, fname)
 
-    for i, item in enumerate(col_list):
-        if item < 0:
-            col_list[i] = 0
 
-    r = np.array(row_list)
-    c = np.array(col_list)
-    rr, cc = polygon(r, c)
-    img[rr, cc] = 1
-    return img
+# the scoring model is loaded once per process and shared by all scoring requests
+score_model_registry = ModelRegistry(_load_score_model)
 
 
-def _create_mask_overlay_image(in_img_path, vert_arr):
+def get_score_model():
     """
-    Create a mask and overlay on the input image to return a single multi channel overlaid image
-    :param in_img_path: file pointer that contains the input image
-    :param vert_arr: array of vertices in the format of [[y, x], ...]
-    :return: single multi-channel overlaid image
+    Get the scoring model loaded from SCORE_MODEL_PATH, loading it on first use or when the model
+    file changes
+    :return: fastai learner
     """
+    return score_model_registry.get(settings.SCORE_MODEL_PATH)
 
-    # Load images and split
-    in_img = imread(in_img_path, as_gray=True)
+
+class MultiChannelImageList(ImageList):
+    # placeholder class for loading the trained model
+    def open(self, fn):
+        return []
+
+
+def _create_mask_overlay_stack(in_img, vert_lists):
+    """
+    Create a two channel image for each region to be scored with the normalized base image
+    cropped around the region in the first channel and the region mask in the second channel
+    :param in_img: input image array returned from get_frame_array() in LUMINANCE_MODE, which
+    holds the [0, 1] luminance of a colour frame or the raw values of a grayscale frame. A crop
+    with values above 1 is normalized by its maximum value
+    :param vert_lists: list of vertices lists, each in the format of [[y, x], ...] with y and x
+    normalized within [0,1]
+    :return: float32 array of shape (len(vert_lists), 2, dim_x, dim_y) with the crop zero padded
+    where it extends beyond the image
+    """
     r = in_img.shape[0]
     c = in_img.shape[1]
-
-    # find center and scale vertices back to image range
-    sum_x = 0.0
-    sum_y = 0.0
-    count = 0
-    for v in vert_arr:
-        y = float(v[0]) * c
-        x = float(v[1]) * r
-        v[0] = y
-        v[1] = x
-        sum_x += x
-        sum_y += y
-        count += 1
-
-    center_x = int(sum_x /count + 0.5)
-    center_y = int(sum_y / count + 0.5)
     dim_x = settings.SCORE_IMAGE_DIMENSION[0]
     dim_y = settings.SCORE_IMAGE_DIMENSION[1]
     half_size_x = dim_x / 2
     half_size_y = dim_y / 2
-
-    row_arr = [v[1]-center_x + half_size_x for v in vert_arr]
-    col_arr = [v[0]-center_y + half_size_y for v in vert_arr]
-
-    mask_img = _create_mask_image(dim_x, dim_y, row_arr, col_arr)
-
-    x_start = (int)(center_x - half_size_x) if center_x >= half_size_x else 0
-    y_start = (int)(center_y - half_size_y) if center_y >= half_size_y else 0
-
-    in_base_img = in_img[x_start:x_start + dim_x, y_start:y_start + dim_y]
-    # make sure base image is normalized with grayscale value between 0 and 1
-    max = np.amax(in_base_img)
-    if max > 1:
-        in_base_img = in_base_img/max
-
-    img_list = [in_base_img, mask_img]
-
-    img_count = len(img_list)
-    overlay_img = torch.zeros((img_count, dim_x, dim_y))
-
-    for i, img in enumerate(img_list):
-        data = torch.from_numpy(img.astype(float))
-        overlay_img[i, :, :] = data
-    return Image(overlay_img)
+    overlay = np.zeros((len(vert_lists), 2, dim_x, dim_y), dtype=np.float32)
+    for i, vert_list in enumerate(vert_lists):
+        # find center and scale vertices back to image range
+        verts = np.asarray(vert_list, dtype=float)
+        ys = verts[:, 0] * c
+        xs = verts[:, 1] * r
+        center_x = int(xs.mean() + 0.5)
+        center_y = int(ys.mean() + 0.5)
+
+        # polygon boundary relative to the crop with negative indices clamped to 0
+        rr, cc = polygon(np.maximum(xs - center_x + half_size_x, 0),
+                         np.maximum(ys - center_y + half_size_y, 0), shape=(dim_x, dim_y))
+        overlay[i, 1, rr, cc] = 1
+
+        x_start = int(center_x - half_size_x) if center_x >= half_size_x else 0
+        y_start = int(center_y - half_size_y) if center_y >= half_size_y else 0
+        crop = in_img[x_start:x_start + dim_x, y_start:y_start + dim_y]
+        base = overlay[i, 0, :crop.shape[0], :crop.shape[1]]
+        base[...] = crop
+        # make sure base image is normalized with grayscale value between 0 and 1
+        max_val = base.max() if base.size else 0
+        if max_val > 1:
+            base /= max_val
+    return overlay
+
+
+def get_edit_scores(ifile, vert_lists, edit_type='edit'):
+    """
+    Get predicted scores of multiple regions in the same image using the trained model. The image
+    is decoded once through the frame cache for all regions, and all regions are scored in one
+    batched forward pass
+    :param ifile: experiment base image to be scored on
+    :param vert_lists: list of vertices lists, each in the format of [[y, x],...] with y and x
+    normalized within [0,1]
+    :param edit_type: optional parameter, 'remove' type will be assumed if it is not the default 'edit'
+    :return: list of scores in the order of vert_lists, err_msg
+    """
+    if not vert_lists:
+        return [], None
+    learn = get_score_model()
+    in_img = get_frame_array(ifile, mode=LUMINANCE_MODE)
+    if in_img is None:
+        return [], 'Cannot read image to be scored on'
+    overlay = torch.from_numpy(_create_mask_overlay_stack(in_img, vert_lists))
+    # apply the same item transforms learn.predict() applies to a single item
+    batches = [learn.data.one_item(Image(item)) for item in overlay]
+    xb = torch.cat([batch[0] for batch in batches])
+    yb = torch.cat([batch[1] for batch in batches])
+    preds = learn.pred_batch(batch=(xb, yb))
+    scores = [int(score) for score in np.round(preds[:, 0].numpy() * 10, 0)]
+    if edit_type != 'edit':
+        scores = [10 - score for score in scores]
+    return scores, None
 
 
 def get_edit_score(ifile, vert_list, edit_type='edit'):
@@ -111,12 +125,7 @@ def get_edit_score(ifile, vert_list, edit_type='edit'):
     :param edit_type: optional parameter, 'remove' type will be assumed if it is not the default 'edit'
     :return: score, err_msg
     """
-    model_path = settings.SCORE_MODEL_PATH
-    path, fname = os.path.split(model_path)
-    learn = load_learner(path, fname)
-    overlay_img = _create_mask_overlay_image(ifile, vert_list)
-    prediction = learn.predict(overlay_img)
-    score = int(np.round(float(prediction[2][0])*10,0))
-    if edit_type != 'edit':
-        score = 10 - score
-    return score, None
+    scores, err_msg = get_edit_scores(ifile, [vert_list], edit_type=edit_type)
+    if err_msg:
+        return None, err_msg
+    return scores[0], None
@@ -0,0 +1,104 @@
+import os
+import time
+import logging
+import resource
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+def _get_rss_bytes():
+    """
+    internal method to get the resident set size of this process
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        # peak resident set size in kilobytes on platforms without /proc
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _get_model_key(model_path):
+    """
+    internal method to get the key identifying a model file version, which changes when either
+    the model path or the model file changes
+    """
+    try:
+        return model_path, os.stat(model_path).st_mtime
+    except OSError:
+        return model_path, None
+
+
+class ModelRegistry(object):
+    """
+    A process-level registry holding a model loaded once and shared by all requests served by
+    the process rather than loaded on every call. The model is loaded on first use, or at worker
+    startup with preload, and reloaded when the model path or the model file changes.
+    """
+
+    def __init__(self, loader):
+        """
+        :param loader: callable to load a model, which takes the model path as the only argument
+        """
+        self._loader = loader
+        self._lock = threading.Lock()
+        # (model key, model) tuple of the loaded model, replaced as a whole so that readers never
+        # see a model with the key of another model
+        self._entry = None
+        self._metrics = {
+            'model_path': '',
+            'loads': 0,
+            'hits': 0,
+            'last_load_seconds': 0.0,
+            'total_load_seconds': 0.0,
+            'rss_delta_bytes': 0,
+        }
+
+    def get(self, model_path):
+        """
+        get the model loaded from model_path, loading it if it is not loaded yet or the model file
+        has changed since it was loaded
+        :param model_path: model file path
+        :return: the loaded model
+        """
+        key = _get_model_key(model_path)
+        entry = self._entry
+        if entry and entry[0] == key:
+            with self._lock:
+                self._metrics['hits'] += 1
+            return entry[1]
+        with self._lock:
+            # another thread could have loaded the model while this one was waiting
+            if not self._entry or self._entry[0] != key:
+                self._load(model_path, key)
+            return self._entry[1]
+
+    def _load(self, model_path, key):
+        if self._entry:
+            logger.info('Reloading model from {}'.format(model_path))
+        rss_before = _get_rss_bytes()
+        start = time.time()
+        model = self._loader(model_path)
+        elapsed = time.time() - start
+        # drop the reference to the old model so that its memory can be freed
+        self._entry = (key, model)
+        self._metrics['model_path'] = model_path
+        self._metrics['loads'] += 1
+        self._metrics['last_load_seconds'] = elapsed
+        self._metrics['total_load_seconds'] += elapsed
+        self._metrics['rss_delta_bytes'] = _get_rss_bytes() - rss_before
+        logger.info('Loaded model from {} in {:.2f} seconds'.format(model_path, elapsed))
+
+    def get_metrics(self):
+        """
+        get model load metrics of this process
+        :return: a dict of model metrics
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics['loaded'] = self._entry is not None
+        metrics['rss_bytes'] = _get_rss_bytes()
+        metrics['pid'] = os.getpid()
+        return metrics